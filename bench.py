@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+import json
+import socket
+import threading
+import time
+from framing import MessageReader
+from fragmentation import Fragmenter, Reassembler, is_fragment, prepare_socket
+from metrics import LatencyHistogram
+
+# Нагрузочный тест работающего tcp-server / udp-server: много клиентов-потоков
+# выполняют сценарии, результаты - пропускная способность и перцентили задержки.
+
+SCENARIOS = ['ping', 'echo', 'broadcast', 'churn', 'large']
+DEFAULT_LARGE_SIZE = 1024 * 1024
+UDP_TIMEOUT = 2.0
+
+class ScenarioResult:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.operations = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.operations += other.operations
+        self.bytes += other.bytes
+        self.errors += other.errors
+
+class TCPBenchClient:
+    def __init__(self, host, port, tls=None):
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.socket = None
+        self.reader = None
+
+    def connect(self):
+        self.socket = socket.create_connection((self.host, self.port), timeout=10)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.tls is not None:
+            # общий TLSClient: повторные подключения (churn) возобновляют сессию
+            self.socket = self.tls.wrap(self.socket, self.host)
+        self.reader = MessageReader(self.socket, max_message_size=64 * 1024 * 1024)
+        return self.receive()  # приветствие
+
+    def send(self, data):
+        self.socket.sendall(data + b'\n')
+
+    def receive(self):
+        return self.reader.read_message()
+
+    def close(self):
+        try:
+            self.send(b'quit')
+            self.receive()
+        except OSError:
+            pass
+        self.socket.close()
+
+class UDPBenchClient:
+    def __init__(self, host, port):
+        self.address = (socket.gethostbyname(host), port)
+        self.socket = None
+        self.fragmenter = Fragmenter()
+        self.reassembler = Reassembler()
+
+    def connect(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        prepare_socket(self.socket)
+        self.socket.settimeout(UDP_TIMEOUT)
+        self.send(b'/ping')
+        return self.receive()  # первая датаграмма нового клиента получает приветствие
+
+    def send(self, data):
+        for datagram in self.fragmenter.split(data, self.address):
+            self.socket.sendto(datagram, self.address)
+
+    def receive(self):
+        # None - ответ потерян
+        while True:
+            try:
+                data = self.socket.recv(65535)
+            except socket.timeout:
+                return None
+            if is_fragment(data):
+                data = self.reassembler.add(data, self.address)
+                if data is None:
+                    continue
+            return data
+
+    def close(self):
+        try:
+            self.send(b'quit')
+            self.receive()
+        except OSError:
+            pass
+        self.socket.close()
+
+class Benchmark:
+    def __init__(self, host='localhost', port=8888, target='tcp', scenarios=None, clients=10,
+                 duration=5.0, message_size=64, window=16, large_size=DEFAULT_LARGE_SIZE, output=None,
+                 tls=None):
+        self.host = host
+        self.port = port
+        self.target = target
+        self.scenarios = scenarios or ['ping', 'echo', 'churn', 'large']
+        self.clients = clients
+        self.duration = duration
+        self.message_size = message_size
+        self.window = window
+        self.large_size = large_size
+        self.output = output
+        self.tls = tls
+        self.results = {}
+        self.arrivals = {}  # {сообщение рассылки: время прихода к первому клиенту}
+        self.arrivals_lock = threading.Lock()
+
+    def make_client(self):
+        if self.target == 'udp':
+            return UDPBenchClient(self.host, self.port)
+        return TCPBenchClient(self.host, self.port, self.tls)
+
+    def start(self):
+        print(f"Benchmark: {self.target} server at {self.host}:{self.port}, {self.clients} clients, "
+              f"{self.duration}s per scenario")
+        for scenario in self.scenarios:
+            if scenario not in SCENARIOS:
+                print(f"Unknown scenario {scenario}, available: {', '.join(SCENARIOS)}")
+                continue
+            print(f"Running {scenario}...", flush=True)
+            if scenario == 'broadcast':
+                self.arrivals = {}
+                print(f"  waiting {self.duration}s for broadcasts - run 'broadcast <text>' on the server")
+            self.results[scenario] = self.run_scenario(scenario)
+            self.print_result(scenario, self.results[scenario])
+        if self.tls is not None:
+            print(f"TLS handshakes: {self.tls.full} full, {self.tls.resumed} resumed")
+
+        if self.output:
+            report = {
+                'target': self.target,
+                'host': self.host,
+                'port': self.port,
+                'clients': self.clients,
+                'duration': self.duration,
+                'message_size': self.message_size,
+                'window': self.window,
+                'large_size': self.large_size,
+                'tls': self.tls is not None,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'results': self.results
+            }
+            with open(self.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Results saved to {self.output}")
+
+    def run_scenario(self, scenario):
+        worker = getattr(self, f"run_{scenario}")
+        results = [ScenarioResult() for _ in range(self.clients)]
+        ready = threading.Barrier(self.clients + 1)
+        threads = [threading.Thread(target=self.run_client, args=(worker, result, ready))
+                   for result in results]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        ready.wait()
+        started = time.time()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        total = ScenarioResult()
+        for result in results:
+            total.merge(result)
+        summary = total.latency.summary()
+        summary.update({
+            'operations': total.operations,
+            'errors': total.errors,
+            'elapsed_s': round(elapsed, 3),
+            'ops_per_s': round(total.operations / elapsed, 1) if elapsed else 0.0,
+            'mb_per_s': round(total.bytes / elapsed / 1e6, 3) if elapsed else 0.0
+        })
+        return summary
+
+    def run_client(self, worker, result, ready):
+        try:
+            worker(result, ready)
+        except Exception as e:
+            result.errors += 1
+            print(f"Benchmark client error: {e}")
+
+    def connect(self, result, ready):
+        # все клиенты подключаются до старта замера
+        client = self.make_client()
+        try:
+            if client.connect() is None:
+                result.errors += 1
+        finally:
+            ready.wait()
+        return client
+
+    def run_ping(self, result, ready):
+        client = self.connect(result, ready)
+        deadline = time.time() + self.duration
+        while time.time() < deadline:
+            started = time.perf_counter()
+            client.send(b'/ping')
+            if client.receive() is None:
+                result.errors += 1
+                continue
+            result.latency.record(time.perf_counter() - started)
+            result.operations += 1
+        client.close()
+
+    def run_echo(self, result, ready):
+        # окно из window сообщений в полете, задержка считается для каждого
+        client = self.connect(result, ready)
+        payload = b'e' * max(self.message_size, 1)
+        deadline = time.time() + self.duration
+        while time.time() < deadline:
+            sent = []
+            for _ in range(self.window):
+                sent.append(time.perf_counter())
+                client.send(payload)
+            for started in sent:
+                reply = client.receive()
+                if reply is None:
+                    result.errors += 1
+                    continue
+                result.latency.record(time.perf_counter() - started)
+                result.operations += 1
+                result.bytes += len(payload) + len(reply)
+        client.close()
+
+    def run_large(self, result, ready):
+        client = self.connect(result, ready)
+        payload = b'L' * self.large_size
+        deadline = time.time() + self.duration
+        while time.time() < deadline:
+            started = time.perf_counter()
+            client.send(payload)
+            reply = client.receive()
+            if reply is None or len(reply) < len(payload):
+                result.errors += 1
+                continue
+            result.latency.record(time.perf_counter() - started)
+            result.operations += 1
+            result.bytes += len(payload) + len(reply)
+        client.close()
+
+    def run_churn(self, result, ready):
+        # задержка = подключение + приветствие + quit/Goodbye
+        ready.wait()
+        deadline = time.time() + self.duration
+        while time.time() < deadline:
+            started = time.perf_counter()
+            client = self.make_client()
+            try:
+                if client.connect() is None:
+                    result.errors += 1
+                    continue
+                client.close()
+            except OSError:
+                result.errors += 1
+                continue
+            result.latency.record(time.perf_counter() - started)
+            result.operations += 1
+
+    def run_broadcast(self, result, ready):
+        # Клиенты только слушают; рассылки делает администратор сервера (broadcast <text>).
+        # Задержка - насколько позже первого получателя сообщение дошло до этого клиента.
+        client = self.connect(result, ready)
+        if isinstance(client, TCPBenchClient):
+            client.socket.settimeout(0.5)
+        deadline = time.time() + self.duration
+        while time.time() < deadline:
+            try:
+                message = client.receive()
+            except socket.timeout:
+                continue
+            if message is None:
+                if isinstance(client, TCPBenchClient):
+                    break
+                continue
+            arrived = time.perf_counter()
+            with self.arrivals_lock:
+                first = self.arrivals.setdefault(message, arrived)
+            result.latency.record(arrived - first)
+            result.operations += 1
+            result.bytes += len(message)
+        client.socket.settimeout(UDP_TIMEOUT)
+        client.close()
+
+    def print_result(self, scenario, summary):
+        print(f"  {scenario}: {summary['operations']} ops in {summary['elapsed_s']}s, "
+              f"{summary['ops_per_s']} ops/s, {summary['mb_per_s']} MB/s, errors {summary['errors']}")
+        print(f"    latency ms: p50 {summary['p50_ms']}  p90 {summary['p90_ms']}  p99 {summary['p99_ms']}  "
+              f"p999 {summary['p999_ms']}  max {summary['max_ms']}")
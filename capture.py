@@ -0,0 +1,879 @@
+#!/usr/bin/env python3
+
+import collections
+import heapq
+import itertools
+import json
+import mmap
+import os
+import socket
+import struct
+import time
+import zlib
+from framing import (BINARY_ACK, BINARY_COMMAND, FRAME_HEADER, FRAME_DATA, FRAME_COMMAND, FRAME_ECHO,
+                     FRAME_REPLY, FRAME_SERVER, FRAME_BROADCAST, FRAME_CHANNEL, FRAME_COMPRESSED,
+                     FRAME_COMPRESSED_SHARED, FRAME_BUSY)
+from compression import COMPRESS_COMMAND, COMPRESS_ACK, DEFLATE_WBITS, is_compressed_datagram
+from fragmentation import FRAGMENT_HEADER, is_fragment
+from reliable_udp import RELIABLE_HEADER, PACKET_DATA, is_reliable_packet
+from metrics import LatencyHistogram
+
+# Разбор дампов (pcapng и классический pcap) без scapy и tshark: TCP-соединения
+# и UDP-обмены этого приложения, их сообщения, задержки, скорость и повторы.
+# Файл отображается в память (mmap) и читается один раз по порядку; прочитанные
+# страницы отдаются системе. От соединения хранятся счетчики, гистограммы задержек
+# и первые сообщения, от длинного сообщения - только его начало, а закрытые
+# соединения сворачиваются в итог, поэтому память не зависит от размера дампа.
+
+BUNDLED_CAPTURES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'net_dump', name)
+                    for name in ('tcp-protocol.pcapng', 'udp-protocol.pcapng')]
+DEFAULT_FLOWS = 20        # подробный отчет - по стольким самым большим соединениям
+DEFAULT_MESSAGES = 10     # первых сообщений соединения в отчете
+PREVIEW_SIZE = 100        # байт от начала каждого сообщения
+MAX_PENDING_BYTES = 4 * 1024 * 1024  # сегменты после дыры; больше - дыра пропускается
+MAX_UNACKED = 4096        # сегментов, ждущих подтверждения для замера RTT
+MAX_UDP_MESSAGES = 1024   # незавершенных фрагментированных сообщений и номеров --reliable
+FLOW_IDLE_TIMEOUT = 600.0  # соединение без пакетов столько секунд (по времени дампа) закрывается
+FLOW_IDLE_CHECK = 60.0
+RELEASE_CHUNK = 64 * 1024 * 1024
+INFLATE_CHUNK = 1024 * 1024
+
+PCAPNG_SECTION = 0x0A0D0D0A
+PCAPNG_INTERFACE = 1
+PCAPNG_OBSOLETE_PACKET = 2
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+OPTION_TSRESOL = 9
+OPTION_TSOFFSET = 14
+PCAP_RESOLUTION = {0xA1B2C3D4: 1e-6, 0xA1B23C4D: 1e-9}
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+IPV6_HEADER = struct.Struct('!IHBB16s16s')
+IPV6_EXTENSIONS = (0, 43, 60)  # hop-by-hop, routing, destination options
+IPV6_FRAGMENT = 44
+TCP_HEADER = struct.Struct('!HHIIH')
+UDP_HEADER = struct.Struct('!HHHH')
+PROTOCOL_TCP = 6
+PROTOCOL_UDP = 17
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+SEQ_MASK = 0xFFFFFFFF
+
+FRAME_NAMES = {
+    FRAME_DATA: 'data', FRAME_COMMAND: 'command', FRAME_ECHO: 'echo', FRAME_REPLY: 'reply',
+    FRAME_SERVER: 'server', FRAME_BROADCAST: 'broadcast', FRAME_CHANNEL: 'channel', FRAME_BUSY: 'busy'
+}
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:g} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def format_endpoint(endpoint):
+    address, port = endpoint
+    if len(address) == 4:
+        return f"{socket.inet_ntop(socket.AF_INET, address)}:{port}"
+    return f"[{socket.inet_ntop(socket.AF_INET6, address)}]:{port}"
+
+def keep_preview(preview, data):
+    if len(preview) < PREVIEW_SIZE:
+        preview += data[:PREVIEW_SIZE - len(preview)]
+
+def inflate_preview(inflater, data, preview):
+    # Весь вход нужен контексту сжатия, а из выхода хранится только начало;
+    # возвращает размер развернутых данных
+    size = 0
+    while data:
+        chunk = inflater.decompress(data, INFLATE_CHUNK)
+        keep_preview(preview, chunk)
+        size += len(chunk)
+        data = inflater.unconsumed_tail
+    return size
+
+class CaptureReader:
+    # Пакеты отдаются срезами memoryview прямо из отображения файла, без копирования;
+    # срез действителен только до следующего пакета
+    def __init__(self, path):
+        self.path = path
+        self.truncated = False  # дамп оборван посреди блока (запись еще идет или файл обрезан)
+
+    def packets(self):
+        # (время, тип канального уровня, данные, исходная длина пакета)
+        with open(self.path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                raise ValueError("empty capture")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mm)
+            try:
+                if struct.unpack_from('<I', mm)[0] == PCAPNG_SECTION:
+                    yield from self.read_pcapng(mm, view)
+                else:
+                    yield from self.read_pcap(mm, view)
+            finally:
+                view.release()
+                try:
+                    mm.close()
+                except BufferError:
+                    # у вызывающего остались срезы пакета - отображение закроется вместе с ними
+                    pass
+
+    def packet(self, view, timestamp, linktype, start, size, length):
+        packet = view[start:start + size]
+        try:
+            yield timestamp, linktype, packet, length
+        finally:
+            # срез, оставшийся у вызывающего, не должен держать отображение открытым
+            packet.release()
+
+    def release(self, mm, offset, released):
+        # Прочитанное не понадобится: страницы файла выбрасываются из памяти процесса
+        if offset - released < RELEASE_CHUNK:
+            return released
+        if hasattr(mmap, 'MADV_DONTNEED'):
+            mm.madvise(mmap.MADV_DONTNEED, released, RELEASE_CHUNK)
+        return released + RELEASE_CHUNK
+
+    def read_pcap(self, mm, view):
+        for endian in ('<', '>'):
+            magic = struct.unpack_from(endian + 'I', mm)[0]
+            if magic in PCAP_RESOLUTION:
+                break
+        else:
+            raise ValueError("not a pcap or pcapng file")
+        resolution = PCAP_RESOLUTION[magic]
+        linktype = struct.unpack_from(endian + 'I', mm, 20)[0] & 0x0FFFFFFF
+        record = struct.Struct(endian + 'IIII')
+        offset, released, size = 24, 0, len(mm)
+        while offset + record.size <= size:
+            seconds, fraction, captured, length = record.unpack_from(mm, offset)
+            offset += record.size
+            if offset + captured > size:
+                self.truncated = True
+                return
+            yield from self.packet(view, seconds + fraction * resolution, linktype, offset, captured, length)
+            offset += captured
+            released = self.release(mm, offset, released)
+        self.truncated = offset != size
+
+    def read_pcapng(self, mm, view):
+        endian = '<'
+        interfaces = []  # [(тип канального уровня, цена единицы времени, смещение времени)]
+        timestamp = 0.0
+        offset, released, size = 0, 0, len(mm)
+        while offset + 12 <= size:
+            block_type = struct.unpack_from(endian + 'I', mm, offset)[0]
+            if block_type == PCAPNG_SECTION:
+                # порядок байт задается заново в каждой секции
+                endian = '<' if struct.unpack_from('<I', mm, offset + 8)[0] == PCAPNG_BYTE_ORDER else '>'
+                if struct.unpack_from(endian + 'I', mm, offset + 8)[0] != PCAPNG_BYTE_ORDER:
+                    raise ValueError("bad pcapng byte-order magic")
+                interfaces = []
+            block_length = struct.unpack_from(endian + 'I', mm, offset + 4)[0]
+            if block_length < 12 or block_length % 4 or offset + block_length > size:
+                self.truncated = True
+                return
+            body = offset + 8
+            if block_type == PCAPNG_INTERFACE:
+                interfaces.append(self.read_interface(mm, endian, body, offset + block_length - 4))
+            elif block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_OBSOLETE_PACKET):
+                if block_type == PCAPNG_ENHANCED_PACKET:
+                    interface, high, low, captured, length = struct.unpack_from(endian + 'IIIII', mm, body)
+                else:
+                    interface, _, high, low, captured, length = struct.unpack_from(endian + 'HHIIII', mm, body)
+                linktype, resolution, shift = interfaces[interface]
+                timestamp = ((high << 32) | low) * resolution + shift
+                yield from self.packet(view, timestamp, linktype, body + 20, captured, length)
+            elif block_type == PCAPNG_SIMPLE_PACKET:
+                # без времени и номера интерфейса: интерфейс 0, время предыдущего пакета
+                length = struct.unpack_from(endian + 'I', mm, body)[0]
+                captured = min(length, block_length - 16)
+                yield from self.packet(view, timestamp, interfaces[0][0], body + 4, captured, length)
+            offset += block_length
+            released = self.release(mm, offset, released)
+        self.truncated = offset != size
+
+    def read_interface(self, mm, endian, position, end):
+        linktype = struct.unpack_from(endian + 'H', mm, position)[0]
+        resolution, shift = 1e-6, 0
+        position += 8
+        while position + 4 <= end:
+            code, length = struct.unpack_from(endian + 'HH', mm, position)
+            value = position + 4
+            if code == 0:
+                break
+            if code == OPTION_TSRESOL:
+                exponent = mm[value]
+                resolution = 2.0 ** -(exponent & 0x7F) if exponent & 0x80 else 10.0 ** -exponent
+            elif code == OPTION_TSOFFSET:
+                shift = struct.unpack_from(endian + 'q', mm, value)[0]
+            position = value + (length + 3) // 4 * 4
+        return linktype, resolution, shift
+
+def network_layer(linktype, data):
+    # Смещение заголовка IP в кадре канального уровня или None, если в кадре не IP
+    if linktype == LINKTYPE_ETHERNET:
+        offset, ethertype = 14, int.from_bytes(data[12:14], 'big')
+        while ethertype in ETHERTYPE_VLAN:
+            ethertype = int.from_bytes(data[offset + 2:offset + 4], 'big')
+            offset += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset, ethertype = 16, int.from_bytes(data[14:16], 'big')
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        offset, ethertype = 20, int.from_bytes(data[0:2], 'big')
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        offset, ethertype = 4, None
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        offset, ethertype = 0, None
+    else:
+        return None
+    if ethertype is not None and ethertype not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+        return None
+    return offset if len(data) > offset else None
+
+class StreamDecoder:
+    # Сообщения одного направления TCP: строки до '\n', а после /binary или /compress -
+    # кадры framing.py (сжатые разворачиваются контекстом соединения, как у клиента)
+    def __init__(self, flow, side):
+        self.flow = flow
+        self.side = side
+        self.mode = 'text'      # text, frames, tls; lost - кадры после дыры в дампе не разобрать
+        self.started = False
+        self.synced = True      # False - после дыры ждем начала следующей строки
+        self.preview = bytearray()
+        self.size = 0
+        self.header = bytearray()
+        self.remaining = None   # байт payload текущего кадра; None - читается заголовок
+        self.frame_type = None
+        self.original = None    # исходный тип сжатого кадра
+        self.inflater = None
+        self.stream_inflater = None
+        # строки, после которых направление переходит на кадры (см. switch)
+        self.markers = ((BINARY_COMMAND.encode(), COMPRESS_COMMAND.encode()) if side == 'client'
+                        else (BINARY_ACK.strip().encode(), COMPRESS_ACK.encode()))
+
+    def lost(self):
+        # в дампе не хватает байт потока
+        if self.mode == 'text':
+            self.synced = False
+            self.preview.clear()
+            self.size = 0
+        elif self.mode == 'frames':
+            self.mode = 'lost'
+
+    def feed(self, data, now):
+        if not self.started:
+            self.started = True
+            # приложение начинает с текста, а TLS - с записи рукопожатия
+            if data[:1] == b'\x16':
+                self.mode = 'tls'
+                self.flow.tls = True
+        position = 0
+        while position < len(data):
+            if self.mode == 'text':
+                position = self.feed_text(data, position, now)
+            elif self.mode == 'frames':
+                position = self.feed_frame(data, position, now)
+            else:
+                return
+
+    def keep(self, data):
+        keep_preview(self.preview, data)
+
+    def feed_text(self, data, position, now):
+        if not self.size and self.synced and not self.flow.sampling():
+            # начало строки, образцы уже собраны: целые строки только считаются
+            last = data.rfind(b'\n', position)
+            if last >= 0 and not any(data.find(marker, position, last) >= 0 for marker in self.markers):
+                self.flow.count_messages(self.side, data.count(b'\n', position, last + 1))
+                position = last + 1
+                if position == len(data):
+                    return position
+        index = data.find(b'\n', position)
+        end = len(data) if index < 0 else index
+        self.keep(data[position:end])
+        self.size += end - position
+        if index < 0:
+            return end
+        if self.synced:
+            text = self.preview.decode('utf-8', 'replace').rstrip('\r')
+            self.flow.message(self.side, now, 'text', self.size, text)
+            self.switch(text)
+        self.synced = True
+        self.preview.clear()
+        self.size = 0
+        return index + 1
+
+    def switch(self, text):
+        # после этих строк направление переходит на кадры
+        if self.side == 'client' and text in (BINARY_COMMAND, COMPRESS_COMMAND):
+            self.mode = 'frames'
+        elif self.side == 'server' and (text == BINARY_ACK.strip() or text.startswith(COMPRESS_ACK)):
+            self.mode = 'frames'
+
+    def feed_frame(self, data, position, now):
+        if self.remaining is None:
+            needed = FRAME_HEADER.size - len(self.header)
+            self.header += data[position:position + needed]
+            position += needed
+            if len(self.header) < FRAME_HEADER.size:
+                return len(data)
+            self.remaining, self.frame_type = FRAME_HEADER.unpack(self.header)
+            self.header.clear()
+            self.size = 0
+            self.original = self.inflater = None
+        else:
+            chunk = data[position:position + self.remaining]
+            position += len(chunk)
+            self.remaining -= len(chunk)
+            if self.frame_type in (FRAME_COMPRESSED, FRAME_COMPRESSED_SHARED):
+                self.feed_compressed(chunk)
+            else:
+                self.keep(chunk)
+                self.size += len(chunk)
+        if self.remaining == 0 and self.mode == 'frames':
+            self.finish_frame(now)
+        return position
+
+    def feed_compressed(self, chunk):
+        if self.original is None and chunk:
+            self.original = chunk[0]
+            chunk = chunk[1:]
+            if self.frame_type == FRAME_COMPRESSED:
+                if self.stream_inflater is None:
+                    self.stream_inflater = zlib.decompressobj(DEFLATE_WBITS)
+                self.inflater = self.stream_inflater
+            else:
+                self.inflater = zlib.decompressobj(DEFLATE_WBITS)
+        try:
+            self.size += inflate_preview(self.inflater, chunk, self.preview)
+        except zlib.error:
+            self.mode = 'lost'
+
+    def finish_frame(self, now):
+        frame_type = self.frame_type if self.original is None else self.original
+        kind = FRAME_NAMES.get(frame_type, f"frame {frame_type}")
+        if self.original is not None:
+            kind += ' zlib'
+        self.flow.message(self.side, now, kind, self.size, self.preview.decode('utf-8', 'replace'))
+        self.preview.clear()
+        self.remaining = None
+
+class Direction:
+    # Одно направление соединения: счетчики и (у TCP) сборка потока по номерам seq
+    def __init__(self, flow, side):
+        self.side = side
+        self.packets = 0
+        self.bytes = 0           # payload с повторами - как по проводу
+        self.messages = 0
+        self.retransmissions = 0
+        self.out_of_order = 0    # сегменты после дыры, пришедшие раньше ее заполнения
+        self.gaps = 0            # дыры, которые так и не заполнились (потери при захвате)
+        self.fin = False
+        self.first = None
+        self.last = None
+        self.next_seq = None     # номер следующего ожидаемого байта без переполнения 2^32
+        self.isn = None
+        self.pending = []        # куча [(начало, длина, данные)] сегментов после дыры
+        self.pending_bytes = 0
+        self.unacked = collections.deque()  # [(конец сегмента, время)] для замера RTT
+        self.reliable = {}       # UDP --reliable: {сессия: (старший seq, недавние seq)}
+        self.fragments = collections.OrderedDict()  # UDP: {id: [получено, всего, размер, начало]}
+        self.decoder = StreamDecoder(flow, side)
+
+    def count(self, size, now):
+        self.packets += 1
+        self.bytes += size
+        if self.first is None:
+            self.first = now
+        self.last = now
+
+    def absolute(self, seq):
+        delta = (seq - self.next_seq) & SEQ_MASK
+        if delta >= 1 << 31:
+            delta -= 1 << 32
+        return self.next_seq + delta
+
+    def summary(self):
+        elapsed = (self.last - self.first) if self.first is not None else 0.0
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'messages': self.messages,
+            'throughput_kb_s': round(self.bytes / elapsed / 1024, 3) if elapsed > 0 else 0.0,
+            'retransmissions': self.retransmissions,
+            'out_of_order': self.out_of_order,
+            'gaps': self.gaps
+        }
+
+class Flow:
+    def __init__(self, protocol, client, server, now, messages):
+        self.protocol = protocol
+        self.client = client
+        self.server = server
+        self.first = self.last = now
+        self.directions = {client: Direction(self, 'client'), server: Direction(self, 'server')}
+        self.sample_size = messages
+        self.samples = []        # первые сообщения: (время, сторона, вид, размер, начало текста)
+        self.response = LatencyHistogram()  # от запроса клиента до первого ответа сервера
+        self.rtt = LatencyHistogram()       # от сегмента до его подтверждения
+        self.waiting = None
+        self.tls = False
+        self.state = 'open'
+
+    def message(self, side, now, kind, size, text):
+        self.count_messages(side, 1)
+        if len(self.samples) < self.sample_size:
+            self.samples.append((now, side, kind, size, text))
+
+    def count_messages(self, side, count):
+        self.directions[self.client if side == 'client' else self.server].messages += count
+
+    def sampling(self):
+        return len(self.samples) < self.sample_size
+
+    def data(self, side, now):
+        # новые данные стороны: запрос клиента ждет ответа, первый ответ сервера его закрывает
+        if side == 'client':
+            if self.waiting is None:
+                self.waiting = now
+        elif self.waiting is not None:
+            self.response.record(now - self.waiting)
+            self.waiting = None
+
+    def summary(self):
+        client = self.directions[self.client]
+        server = self.directions[self.server]
+        return {
+            'protocol': self.protocol,
+            'client': format_endpoint(self.client),
+            'server': format_endpoint(self.server),
+            'start': self.first,
+            'duration_s': round(self.last - self.first, 6),
+            'state': self.state,
+            'tls': self.tls,
+            'handshake_ms': None,
+            'client_to_server': client.summary(),
+            'server_to_client': server.summary(),
+            'rtt': self.rtt.summary(),
+            'response': self.response.summary(),
+            'messages': [[round(now - self.first, 6), side, kind, size, text]
+                         for now, side, kind, size, text in self.samples]
+        }
+
+class TCPFlow(Flow):
+    def __init__(self, client, server, now, messages):
+        super().__init__('tcp', client, server, now, messages)
+        self.syn_time = None
+        self.handshake = None
+
+    def segment(self, source, seq, ack, flags, payload, length, now):
+        # length - длина payload по заголовку IP, payload - сколько из нее попало в дамп
+        self.last = now
+        sender = self.directions[source]
+        receiver = self.directions[self.server if source == self.client else self.client]
+        sender.count(length, now)
+        if flags & TCP_SYN:
+            if sender.isn is not None:
+                sender.retransmissions += 1
+                self.syn_time = None  # Karn: по повторному SYN рукопожатие не мерить
+                return
+            sender.isn = seq
+            sender.next_seq = seq + 1
+            if not flags & TCP_ACK:
+                self.syn_time = now
+            elif self.syn_time is not None:
+                self.handshake = now - self.syn_time
+        elif sender.next_seq is None:
+            # соединение началось до начала захвата
+            sender.next_seq = seq
+            if length:
+                sender.decoder.synced = False
+        if flags & TCP_ACK and receiver.next_seq is not None:
+            self.acknowledged(receiver, receiver.absolute(ack), now)
+        if length:
+            # данные в SYN (TCP Fast Open) идут после его номера
+            start = sender.absolute((seq + 1) & SEQ_MASK if flags & TCP_SYN else seq)
+            self.receive(sender, start, payload, length, now)
+        if flags & TCP_RST:
+            self.state = 'reset'
+        elif flags & TCP_FIN:
+            sender.fin = True
+            if receiver.fin:
+                self.state = 'closed'
+
+    def acknowledged(self, direction, ack, now):
+        sent = None
+        while direction.unacked and direction.unacked[0][0] <= ack:
+            sent = direction.unacked.popleft()[1]
+        if sent is not None:
+            self.rtt.record(now - sent)
+
+    def receive(self, direction, start, payload, length, now):
+        end = start + length
+        if end <= direction.next_seq:
+            direction.retransmissions += 1
+            direction.unacked.clear()  # Karn: подтверждение повтора не отличить от оригинала
+            return
+        if start < direction.next_seq:
+            # повтор, частично перекрывающий принятое
+            direction.retransmissions += 1
+            direction.unacked.clear()
+            skip = direction.next_seq - start
+            payload, length, start = payload[skip:], length - skip, direction.next_seq
+        if start > direction.next_seq:
+            direction.out_of_order += 1
+            heapq.heappush(direction.pending, (start, length, bytes(payload)))
+            direction.pending_bytes += length
+            if direction.pending_bytes > MAX_PENDING_BYTES:
+                self.skip_gap(direction)
+            return
+        if direction.pending:
+            # сегмент заполнил дыру: оригинал потерян до точки захвата
+            direction.retransmissions += 1
+            direction.unacked.clear()
+        else:
+            direction.unacked.append((end, now))
+            if len(direction.unacked) > MAX_UNACKED:
+                direction.unacked.popleft()
+        self.deliver(direction, payload, length, now)
+        self.drain(direction, now)
+
+    def deliver(self, direction, payload, length, now):
+        direction.next_seq += length
+        self.data(direction.side, now)
+        direction.decoder.feed(bytes(payload), now)
+        if len(payload) < length:
+            # пакет обрезан при захвате (snaplen)
+            direction.decoder.lost()
+
+    def drain(self, direction, now):
+        while direction.pending and direction.pending[0][0] <= direction.next_seq:
+            start, length, payload = heapq.heappop(direction.pending)
+            direction.pending_bytes -= length
+            skip = direction.next_seq - start
+            if skip < length:
+                self.deliver(direction, payload[skip:], length - skip, now)
+
+    def skip_gap(self, direction):
+        # дыра так и не заполнилась: байты потеряны при захвате, разбор идет дальше
+        direction.gaps += 1
+        direction.next_seq = direction.pending[0][0]
+        direction.decoder.lost()
+        self.drain(direction, self.last)
+
+    def finish(self):
+        for direction in self.directions.values():
+            if direction.pending:
+                self.skip_gap(direction)
+
+    def summary(self):
+        summary = super().summary()
+        if self.handshake is not None:
+            summary['handshake_ms'] = round(self.handshake * 1000, 3)
+        return summary
+
+class UDPFlow(Flow):
+    def __init__(self, client, server, now, messages):
+        super().__init__('udp', client, server, now, messages)
+
+    def datagram(self, source, payload, now):
+        self.last = now
+        direction = self.directions[source]
+        direction.count(len(payload), now)
+        if is_reliable_packet(payload):
+            _, packet_type, session, seq = RELIABLE_HEADER.unpack_from(payload)[:4]
+            if packet_type != PACKET_DATA:
+                return
+            if self.repeated(direction, session, seq):
+                direction.retransmissions += 1
+                return
+            payload = payload[RELIABLE_HEADER.size:]
+        self.data(direction.side, now)
+        if is_fragment(payload):
+            self.fragment(direction, payload, now)
+            return
+        if is_compressed_datagram(payload):
+            preview = bytearray()
+            try:
+                size = inflate_preview(zlib.decompressobj(DEFLATE_WBITS), payload[1:], preview)
+            except zlib.error:
+                self.message(direction.side, now, 'zlib corrupt', len(payload), '')
+                return
+            self.message(direction.side, now, 'zlib', size, preview.decode('utf-8', 'replace'))
+            return
+        self.message(direction.side, now, 'text', len(payload),
+                     bytes(payload[:PREVIEW_SIZE]).decode('utf-8', 'replace').rstrip('\n'))
+
+    def repeated(self, direction, session, seq):
+        # номера --reliable, уже виденные в этом направлении
+        highest, seen = direction.reliable.get(session, (seq, set()))
+        if seq in seen:
+            return True
+        seen.add(seq)
+        highest = max(highest, seq)
+        if len(seen) > MAX_UDP_MESSAGES:
+            seen.difference_update([number for number in seen if number < highest - MAX_UDP_MESSAGES // 2])
+        direction.reliable[session] = (highest, seen)
+        if len(direction.reliable) > MAX_UDP_MESSAGES:
+            direction.reliable.pop(next(iter(direction.reliable)))
+        return False
+
+    def fragment(self, direction, payload, now):
+        _, _, message_id, index, count = FRAGMENT_HEADER.unpack_from(payload)
+        state = direction.fragments.setdefault(message_id, [0, count, 0, b''])
+        state[0] += 1
+        state[2] += len(payload) - FRAGMENT_HEADER.size
+        if index == 0:
+            state[3] = bytes(payload[FRAGMENT_HEADER.size:FRAGMENT_HEADER.size + PREVIEW_SIZE])
+        if state[0] >= count:
+            del direction.fragments[message_id]
+            self.message(direction.side, now, f"fragmented x{count}", state[2],
+                         state[3].decode('utf-8', 'replace'))
+        elif len(direction.fragments) > MAX_UDP_MESSAGES:
+            direction.fragments.popitem(last=False)
+
+class FlowTable:
+    # Соединения одного дампа: активные по паре концов, закрытые - в итоге и в куче
+    # самых больших для подробного отчета
+    def __init__(self, ports=None, flows=DEFAULT_FLOWS, messages=DEFAULT_MESSAGES):
+        self.ports = ports
+        self.flow_limit = flows
+        self.messages = messages
+        self.active = {}   # {(протокол, меньший конец, больший конец): Flow}
+        self.largest = []  # [(байт, номер, summary)]
+        self.counter = itertools.count()
+        self.packets = 0
+        self.bytes = 0
+        self.skipped = 0   # не IP, не TCP/UDP, фрагменты IP, чужие порты, пакеты закрытых соединений
+        self.first = None
+        self.last = None
+        self.next_expiry = None
+        self.flows = {'tcp': 0, 'udp': 0}
+        self.retransmissions = 0
+        self.gaps = 0
+        self.rtt = LatencyHistogram()
+        self.response = LatencyHistogram()
+
+    def packet(self, timestamp, linktype, data, length):
+        self.packets += 1
+        self.bytes += length
+        if self.first is None:
+            self.first = self.last = timestamp
+            self.next_expiry = timestamp + FLOW_IDLE_CHECK
+        self.last = max(self.last, timestamp)
+        if timestamp >= self.next_expiry:
+            self.expire(timestamp)
+        try:
+            parsed = self.transport(linktype, data)
+        except (struct.error, IndexError):
+            parsed = None
+        if parsed is None:
+            self.skipped += 1
+            return
+        protocol, source, destination, segment, size = parsed
+        try:
+            if protocol == PROTOCOL_TCP:
+                self.tcp_segment(source, destination, segment, size, timestamp)
+            elif protocol == PROTOCOL_UDP:
+                self.udp_datagram(source, destination, segment, timestamp)
+            else:
+                self.skipped += 1
+        except struct.error:
+            self.skipped += 1
+
+    def transport(self, linktype, data):
+        # (протокол, адрес источника, адрес получателя, сегмент, длина сегмента по заголовку IP)
+        offset = network_layer(linktype, data)
+        if offset is None:
+            return None
+        version = data[offset] >> 4
+        if version == 4:
+            first, _, total, _, fragment, _, protocol, _, source, destination = \
+                IPV4_HEADER.unpack_from(data, offset)
+            if fragment & 0x3FFF:
+                return None
+            start = offset + (first & 0x0F) * 4
+            # 0 в длине - сегментация на сетевой карте (TSO) при захвате на отправителе
+            end = offset + total if total else len(data)
+        elif version == 6:
+            _, payload_length, protocol, _, source, destination = IPV6_HEADER.unpack_from(data, offset)
+            start = offset + IPV6_HEADER.size
+            end = start + payload_length
+            while protocol in IPV6_EXTENSIONS:
+                protocol = data[start]
+                start += (data[start + 1] + 1) * 8
+            if protocol == IPV6_FRAGMENT:
+                return None
+        else:
+            return None
+        return protocol, source, destination, data[start:end], end - start
+
+    def wanted(self, source, destination):
+        return not self.ports or source[1] in self.ports or destination[1] in self.ports
+
+    def tcp_segment(self, source, destination, segment, size, now):
+        source_port, destination_port, seq, ack, offset_flags = TCP_HEADER.unpack_from(segment)
+        source, destination = (source, source_port), (destination, destination_port)
+        if not self.wanted(source, destination):
+            self.skipped += 1
+            return
+        header = (offset_flags >> 12) * 4
+        flags = offset_flags & 0x1FF
+        length = size - header
+        key = (PROTOCOL_TCP, min(source, destination), max(source, destination))
+        flow = self.active.get(key)
+        if flow is not None and flags & TCP_SYN and not flags & TCP_ACK:
+            isn = flow.directions[source].isn
+            if isn is not None and isn != seq or flow.directions[source].bytes:
+                # порт использован новым соединением
+                self.finish(flow)
+                flow = None
+        if flow is None:
+            if not length and not flags & TCP_SYN:
+                # подтверждения и FIN уже закрытого соединения
+                self.skipped += 1
+                return
+            if flags & TCP_SYN:
+                client, server = (destination, source) if flags & TCP_ACK else (source, destination)
+            else:
+                # соединение открыто до начала захвата: сервер - сторона с меньшим портом
+                client, server = (source, destination) if source_port > destination_port else (destination, source)
+            flow = self.active[key] = TCPFlow(client, server, now, self.messages)
+            flow.key = key
+        flow.segment(source, seq, ack, flags, segment[header:], length, now)
+        if flow.state != 'open':
+            self.finish(flow)
+
+    def udp_datagram(self, source, destination, segment, now):
+        source_port, destination_port, length, _ = UDP_HEADER.unpack_from(segment)
+        source, destination = (source, source_port), (destination, destination_port)
+        if not self.wanted(source, destination):
+            self.skipped += 1
+            return
+        key = (PROTOCOL_UDP, min(source, destination), max(source, destination))
+        flow = self.active.get(key)
+        if flow is None:
+            client, server = (source, destination) if source_port > destination_port else (destination, source)
+            flow = self.active[key] = UDPFlow(client, server, now, self.messages)
+            flow.key = key
+        flow.datagram(source, segment[UDP_HEADER.size:length], now)
+
+    def expire(self, now):
+        # UDP не закрывается, а у TCP мог не попасть в дамп FIN или RST
+        self.next_expiry = now + FLOW_IDLE_CHECK
+        for flow in [flow for flow in self.active.values() if now - flow.last > FLOW_IDLE_TIMEOUT]:
+            flow.state = 'idle' if flow.protocol == 'tcp' else flow.state
+            self.finish(flow)
+
+    def finish(self, flow):
+        del self.active[flow.key]
+        if flow.protocol == 'tcp':
+            flow.finish()
+        self.flows[flow.protocol] += 1
+        for direction in flow.directions.values():
+            self.retransmissions += direction.retransmissions
+            self.gaps += direction.gaps
+        self.rtt.merge(flow.rtt)
+        self.response.merge(flow.response)
+        if self.flow_limit:
+            size = sum(direction.bytes for direction in flow.directions.values())
+            heapq.heappush(self.largest, (size, next(self.counter), flow.summary()))
+            if len(self.largest) > self.flow_limit:
+                heapq.heappop(self.largest)
+
+    def report(self):
+        for flow in list(self.active.values()):
+            self.finish(flow)
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'skipped_packets': self.skipped,
+            'duration_s': round(self.last - self.first, 6) if self.packets else 0.0,
+            'flows': dict(self.flows),
+            'retransmissions': self.retransmissions,
+            'gaps': self.gaps,
+            'rtt': self.rtt.summary(),
+            'response': self.response.summary(),
+            'largest_flows': [summary for _, _, summary in sorted(self.largest, key=lambda item: item[2]['start'])]
+        }
+
+class CaptureAnalysis:
+    def __init__(self, paths=None, ports=None, flows=DEFAULT_FLOWS, messages=DEFAULT_MESSAGES, output=None):
+        self.paths = paths or BUNDLED_CAPTURES
+        self.ports = set(ports or ())
+        self.flows = flows
+        self.messages = messages
+        self.output = output
+        self.results = {}
+
+    def start(self):
+        for path in self.paths:
+            print(f"Capture {path}", flush=True)
+            reader = CaptureReader(path)
+            table = FlowTable(self.ports, self.flows, self.messages)
+            started = time.perf_counter()
+            try:
+                for packet in reader.packets():
+                    table.packet(*packet)
+            except (OSError, ValueError, IndexError, struct.error) as e:
+                print(f"  Cannot read capture: {e}")
+                continue
+            report = table.report()
+            report['read_s'] = round(time.perf_counter() - started, 3)
+            report['truncated'] = reader.truncated
+            self.results[path] = report
+            self.print_report(report)
+
+        if self.output:
+            with open(self.output, 'w') as f:
+                json.dump({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'captures': self.results}, f, indent=2)
+            print(f"Results saved to {self.output}")
+
+    def print_report(self, report):
+        flows = report['flows']
+        print(f"  {report['packets']} packets, {format_size(report['bytes'])} over {report['duration_s']:.3f}s "
+              f"(read in {report['read_s']}s): {flows['tcp']} tcp and {flows['udp']} udp flows, "
+              f"retransmissions {report['retransmissions']}, gaps {report['gaps']}, "
+              f"skipped packets {report['skipped_packets']}")
+        if report['truncated']:
+            print("  capture ends in the middle of a packet")
+        self.print_latency('  ', report)
+        for flow in report['largest_flows']:
+            handshake = f", handshake {flow['handshake_ms']} ms" if flow['handshake_ms'] is not None else ''
+            print(f"  {flow['protocol']} {flow['client']} -> {flow['server']}, {flow['duration_s']:.3f}s, "
+                  f"{flow['state']}{', tls' if flow['tls'] else ''}{handshake}")
+            for name, side in (('client -> server', 'client_to_server'), ('server -> client', 'server_to_client')):
+                direction = flow[side]
+                print(f"    {name}: {direction['messages']} messages, {direction['packets']} packets, "
+                      f"{format_size(direction['bytes'])}, {direction['throughput_kb_s']} KB/s, "
+                      f"retransmissions {direction['retransmissions']}, out of order {direction['out_of_order']}, "
+                      f"gaps {direction['gaps']}")
+            self.print_latency('    ', flow)
+            for offset, side, kind, size, text in flow['messages']:
+                print(f"      +{offset:.6f}s {side:6} {kind} {format_size(size)}{': ' + text if text else ''}")
+
+    def print_latency(self, indent, report):
+        for name in ('rtt', 'response'):
+            latency = report[name]
+            if latency['count']:
+                print(f"{indent}{name} ms: p50 {latency['p50_ms']}  p90 {latency['p90_ms']}  "
+                      f"p99 {latency['p99_ms']}  max {latency['max_ms']}  n={latency['count']}")
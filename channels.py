@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import threading
+
+# Каналы (комнаты) pub/sub, общие для TCP и UDP серверов. Индекс канал -> подписчики
+# дает публикацию только подписчикам канала, обратный индекс клиент -> каналы
+# снимает все подписки отключившегося клиента без обхода всех каналов.
+
+CHANNEL_COMMANDS = ('/subscribe', '/unsubscribe', '/publish', '/channels')
+MAX_CHANNEL_NAME = 64
+MAX_CHANNELS_PER_CLIENT = 256
+
+class ChannelIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.subscribers = {}  # {канал: set(client_id)}
+        self.memberships = {}  # {client_id: set(канал)}
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self, client_id, channel):
+        # False - клиент уже подписан
+        with self.lock:
+            channels = self.memberships.setdefault(client_id, set())
+            if channel in channels:
+                return False
+            if len(channels) >= MAX_CHANNELS_PER_CLIENT:
+                raise ValueError(f"at most {MAX_CHANNELS_PER_CLIENT} channels per client")
+            channels.add(channel)
+            self.subscribers.setdefault(channel, set()).add(client_id)
+            return True
+
+    def unsubscribe(self, client_id, channel):
+        with self.lock:
+            channels = self.memberships.get(client_id)
+            if not channels or channel not in channels:
+                return False
+            channels.discard(channel)
+            if not channels:
+                del self.memberships[client_id]
+            self.drop_subscriber(channel, client_id)
+            return True
+
+    def remove_client(self, client_id):
+        with self.lock:
+            channels = self.memberships.pop(client_id, ())
+            for channel in channels:
+                self.drop_subscriber(channel, client_id)
+            return sorted(channels)
+
+    def drop_subscriber(self, channel, client_id):
+        # пустые каналы не хранятся
+        members = self.subscribers.get(channel)
+        if members is not None:
+            members.discard(client_id)
+            if not members:
+                del self.subscribers[channel]
+
+    def members(self, channel):
+        with self.lock:
+            return list(self.subscribers.get(channel, ()))
+
+    def channels_of(self, client_id):
+        with self.lock:
+            return sorted(self.memberships.get(client_id, ()))
+
+    def counts(self):
+        with self.lock:
+            return {channel: len(members) for channel, members in self.subscribers.items()}
+
+    def subscription_count(self):
+        with self.lock:
+            return sum(len(channels) for channels in self.memberships.values())
+
+def channel_message(channel, sender, message):
+    return f"[{channel}] {sender}: {message}"
+
+def channel_command(channels, client_id, message, publish):
+    # Команды каналов от клиента; publish(channel, text) рассылает text подписчикам
+    parts = message.split(' ', 2)
+    command = parts[0].lower()
+    if command == '/channels':
+        names = channels.channels_of(client_id)
+        return f"Your channels: {', '.join(names)}" if names else "You are not subscribed to any channel"
+
+    if len(parts) < 2 or not parts[1]:
+        usage = " <message>" if command == '/publish' else ""
+        return f"Usage: {command} <channel>{usage}"
+    channel = parts[1]
+    if len(channel) > MAX_CHANNEL_NAME:
+        return f"Channel name is longer than {MAX_CHANNEL_NAME} characters"
+
+    if command == '/subscribe':
+        try:
+            if not channels.subscribe(client_id, channel):
+                return f"Already subscribed to {channel}"
+        except ValueError as e:
+            return f"Cannot subscribe to {channel}: {e}"
+        return f"Subscribed to {channel}"
+    elif command == '/unsubscribe':
+        if not channels.unsubscribe(client_id, channel):
+            return f"Not subscribed to {channel}"
+        return f"Unsubscribed from {channel}"
+    else:
+        if len(parts) < 3:
+            return "Usage: /publish <channel> <message>"
+        publish(channel, channel_message(channel, f"Client #{client_id}", parts[2]))
+        return f"Published to {channel}"
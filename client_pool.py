@@ -0,0 +1,607 @@
+#!/usr/bin/env python3
+
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import random
+import socket
+import threading
+import time
+from compression import COMPRESS_COMMAND, COMPRESS_ACK, FrameDecompressor
+from framing import (
+    DEFAULT_MAX_MESSAGE_SIZE, FRAME_HEADER, BINARY_COMMAND, BINARY_ACK,
+    FRAME_DATA, FRAME_COMMAND, FRAME_ECHO, FRAME_REPLY, FRAME_BUSY,
+    MessageReader, MessageTooLargeError, pack_frame_header, send_buffers
+)
+from tls import RECV_SIZE
+from heartbeat import HEARTBEAT_COMMAND, DEFAULT_HEARTBEAT_INTERVAL, IDLE_CHECK_INTERVAL, enable_keepalive
+from ratelimit import BUSY_PREFIX
+
+# Программный клиент TCP-сервера для встраивания в сервисы: пул постоянных соединений,
+# переподключение с экспоненциальной задержкой и случайным разбросом и конвейерные
+# запросы - в полете сколько угодно запросов, ответы сопоставляются по порядку (сервер
+# отвечает на сообщения соединения строго в порядке получения). Соединения работают в
+# бинарном режиме: ответы (FRAME_ECHO, FRAME_REPLY) по типу кадра отличаются от
+# сообщений, которые сервер шлет сам (рассылки, каналы) - те уходят в on_message.
+#
+#   with ClientPool('localhost', 8888, size=4) as pool:
+#       pool.request('/ping')                              # 'pong'
+#       futures = [pool.submit(b'data') for _ in range(1000)]
+#
+#   async with AsyncClientPool('localhost', 8888) as pool:
+#       await pool.request('/ping')
+#
+# Запросы, которые были в полете при обрыве соединения, завершаются ConnectionError:
+# обработал ли их сервер, неизвестно, поэтому повторять их или нет, решает вызывающий.
+# Простаивающие соединения шлют /heartbeat (сервер не отключит их по таймауту), а
+# соединение, которое дольше timeout не получает ответов, считается мертвым.
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_MAX_PENDING = 1024  # запросов в полете на одно соединение
+DEFAULT_TIMEOUT = 10.0
+RECONNECT_BASE = 0.1
+RECONNECT_CAP = 10.0
+REPLY_FRAMES = (FRAME_ECHO, FRAME_REPLY, FRAME_BUSY)
+
+log = logging.getLogger('network_app.client')
+
+class ServerBusyError(Exception):
+    # сервер отклонил запрос по лимиту (FRAME_BUSY) - запрос не выполнен, его можно повторить
+    pass
+
+def backoff_delay(attempt):
+    # full jitter: клиенты, потерявшие сервер одновременно, не возвращаются залпом
+    return random.uniform(0, min(RECONNECT_CAP, RECONNECT_BASE * 2 ** attempt))
+
+def request_frame(message):
+    # str с '/' (и quit) - команда, остальное - данные для эха
+    if isinstance(message, str):
+        if message.startswith('/') or message.lower() == 'quit':
+            return FRAME_COMMAND, message.encode()
+        message = message.encode()
+    return FRAME_DATA, bytes(message)
+
+def reply_value(frame_type, payload):
+    # эхо возвращается байтами, как было отправлено, ответ на команду - строкой
+    return payload if frame_type == FRAME_ECHO else payload.decode('utf-8', 'replace')
+
+def discard_result(future):
+    # ответ на heartbeat никто не ждет - и ошибка не должна попасть в лог asyncio
+    if not future.cancelled():
+        future.exception()
+
+def client_id_from_welcome(text):
+    _, _, number = text.rpartition('#')
+    return int(number) if number.isdigit() else None
+
+class PoolConfig:
+    # Общее для блокирующего и asyncio пулов: параметры, выбор соединения, статистика
+    def __init__(self, host, port, size, tls, compress, timeout, max_pending, on_message,
+                 max_message_size, heartbeat_interval):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.host = host
+        self.port = port
+        self.tls = tls  # TLSClient: повторные подключения возобновляют сессию
+        self.compress = compress
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.on_message = on_message  # on_message(frame_type, payload); до бинарного режима frame_type = None
+        self.max_message_size = max_message_size
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnects = 0
+
+    def welcome_client_id(self, text):
+        # вместо приветствия сервер может ответить отказом (предел соединений)
+        if text.startswith(BUSY_PREFIX):
+            raise ConnectionError(text)
+        return client_id_from_welcome(text)
+
+    def negotiation(self):
+        command = COMPRESS_COMMAND if self.compress else BINARY_COMMAND
+        return f"{command}\n".encode()
+
+    def is_ack(self, text):
+        return text == BINARY_ACK.strip() or text.startswith(COMPRESS_ACK)
+
+    def choose(self):
+        # соединение с наименьшим числом запросов в полете
+        best = None
+        for connection in self.connections:
+            if not connection.connected or len(connection.pending) >= self.max_pending:
+                continue
+            if best is None or len(connection.pending) < len(best.pending):
+                best = connection
+        return best
+
+    def check_connections(self, now):
+        # Центральный таймер пула: /heartbeat соединениям, по которым ничего не
+        # отправлялось heartbeat_interval; соединение, которое не получает ответов
+        # дольше timeout, закрывается и переподключается
+        for connection in self.connections:
+            if not connection.connected:
+                continue
+            if connection.pending and now - connection.last_progress > self.timeout:
+                log.warning("Connection %s: no reply for %ss, reconnecting", connection.index, self.timeout)
+                connection.abort()
+            elif self.heartbeat_interval and now - connection.last_sent >= self.heartbeat_interval:
+                connection.send(FRAME_COMMAND, HEARTBEAT_COMMAND.encode(), self.heartbeat_future())
+
+    def deliver_message(self, frame_type, payload):
+        if self.on_message is None:
+            return
+        try:
+            self.on_message(frame_type, payload)
+        except Exception:
+            log.exception("on_message callback failed")
+
+    def stats(self):
+        return {
+            'connections': len(self.connections),
+            'connected': sum(1 for connection in self.connections if connection.connected),
+            'in_flight': sum(len(connection.pending) for connection in self.connections),
+            'reconnects': self.reconnects,
+        }
+
+class PendingReplies:
+    # Очередь ожидающих ответа запросов соединения: ответы приходят в порядке запросов
+    def reset_pending(self):
+        self.pending = collections.deque()
+        self.connected = False
+        self.client_id = None
+        self.last_sent = time.monotonic()
+        self.last_progress = self.last_sent  # последний ответ или первый запрос в пустую очередь
+
+    def track_send(self):
+        now = time.monotonic()
+        if not self.pending:
+            self.last_progress = now
+        self.last_sent = now
+
+    def handle_frame(self, frame_type, payload):
+        frame_type, payload = self.decompressor.unpack(frame_type, payload)
+        if frame_type not in REPLY_FRAMES:
+            self.pool.deliver_message(frame_type, payload)
+            return
+        if not self.pending:
+            log.warning("Unexpected reply from server on connection %s", self.index)
+            return
+        future = self.pending.popleft()
+        self.last_progress = time.monotonic()
+        if future.done():
+            return
+        if frame_type == FRAME_BUSY:
+            future.set_exception(ServerBusyError(payload.decode('utf-8', 'replace')))
+        else:
+            future.set_result(reply_value(frame_type, payload))
+
+    def fail_pending(self):
+        pending, self.pending = self.pending, collections.deque()
+        for future in pending:
+            if not future.done():
+                future.set_exception(ConnectionError("connection to server lost"))
+
+class PooledConnection(PendingReplies):
+    # Соединение блокирующего пула: поток читает ответы и при обрыве переподключается
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.socket = None
+        self.reader = None
+        self.decompressor = None
+        self.lock = threading.Lock()  # порядок в pending = порядок отправки
+        self.reset_pending()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def run(self):
+        attempt = 0
+        was_connected = False
+        while not self.pool.closed:
+            try:
+                self.connect()
+            except (OSError, ValueError, MessageTooLargeError) as e:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                log.debug("Connection %s to %s:%s failed (%s), retry in %.2fs",
+                          self.index, self.pool.host, self.pool.port, e, delay)
+                self.pool.stopped.wait(delay)
+                continue
+            if was_connected:
+                self.pool.reconnects += 1
+            was_connected = True
+            attempt = 0
+            self.read_replies()
+            self.disconnect()
+
+    def connect(self):
+        pool = self.pool
+        sock = socket.create_connection((pool.host, pool.port), timeout=pool.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            enable_keepalive(sock)
+            if pool.tls is not None:
+                sock = pool.tls.wrap(sock, pool.host, pool.timeout)
+            reader = MessageReader(sock, pool.max_message_size)
+            welcome = reader.read_message()
+            if welcome is None:
+                raise ConnectionError("server closed the connection")
+            client_id = pool.welcome_client_id(welcome.decode('utf-8', 'replace').strip())
+            sock.sendall(pool.negotiation())
+            while True:
+                line = reader.read_message()
+                if line is None:
+                    raise ConnectionError("server closed the connection")
+                text = line.decode('utf-8', 'replace').strip()
+                if pool.is_ack(text):
+                    break
+                if text:
+                    pool.deliver_message(None, text)
+            sock.settimeout(None)
+        except BaseException:
+            sock.close()
+            raise
+
+        self.reader = reader
+        self.decompressor = FrameDecompressor(pool.max_message_size)
+        with self.lock:
+            self.socket = sock
+            self.client_id = client_id
+            self.last_sent = self.last_progress = time.monotonic()
+            self.connected = True
+        pool.connection_changed()
+
+    def read_replies(self):
+        try:
+            while True:
+                frame = self.reader.read_frame()
+                if frame is None:
+                    break
+                self.handle_frame(*frame)
+        except (OSError, ValueError, MessageTooLargeError) as e:
+            if not self.pool.closed:
+                log.debug("Connection %s lost: %s", self.index, e)
+
+    def disconnect(self):
+        with self.lock:
+            self.connected = False
+            sock, self.socket = self.socket, None
+            self.fail_pending()
+        sock.close()
+        self.pool.connection_changed()
+
+    def send(self, frame_type, payload, future):
+        with self.lock:
+            if not self.connected:
+                return False
+            self.track_send()
+            self.pending.append(future)
+            try:
+                send_buffers(self.socket, [pack_frame_header(frame_type, len(payload)), payload])
+            except OSError:
+                # поток чтения увидит обрыв и завершит остальные запросы
+                self.connected = False
+                self.shutdown()
+                return False
+        return True
+
+    def abort(self):
+        # поток чтения увидит закрытие и переподключится
+        self.shutdown()
+
+    def shutdown(self):
+        sock = self.socket
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, AttributeError):
+            pass
+
+class ClientPool(PoolConfig):
+    def __init__(self, host='localhost', port=8888, size=DEFAULT_POOL_SIZE, tls=None, compress=False,
+                 timeout=DEFAULT_TIMEOUT, max_pending=DEFAULT_MAX_PENDING, on_message=None,
+                 max_message_size=DEFAULT_MAX_MESSAGE_SIZE, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL):
+        super().__init__(host, port, size, tls, compress, timeout, max_pending, on_message,
+                         max_message_size, heartbeat_interval)
+        self.stopped = threading.Event()
+        self.condition = threading.Condition()
+        self.connections = [PooledConnection(self, index) for index in range(size)]
+
+    @property
+    def closed(self):
+        return self.stopped.is_set()
+
+    def start(self):
+        # ждет первое соединение; остальные подключаются в фоне
+        for connection in self.connections:
+            connection.thread.start()
+        monitor_thread = threading.Thread(target=self.watch_connections)
+        monitor_thread.daemon = True
+        monitor_thread.start()
+        with self.condition:
+            ready = self.condition.wait_for(
+                lambda: self.closed or any(c.connected for c in self.connections), self.timeout)
+        if not ready:
+            raise ConnectionError(f"cannot connect to {self.host}:{self.port}")
+        return self
+
+    def watch_connections(self):
+        while not self.stopped.wait(IDLE_CHECK_INTERVAL):
+            self.check_connections(time.monotonic())
+
+    def heartbeat_future(self):
+        return concurrent.futures.Future()
+
+    def connection_changed(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def submit(self, message):
+        # Отправляет запрос, не дожидаясь ответа; ответ - в возвращенном Future
+        frame_type, payload = request_frame(message)
+        future = concurrent.futures.Future()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self.closed:
+                raise ConnectionError("client pool is closed")
+            connection = self.choose()
+            if connection is not None and connection.send(frame_type, payload, future):
+                return future
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ConnectionError(f"no connection to {self.host}:{self.port} available")
+            # нет живого соединения или все заполнены: ответы освобождают место без
+            # уведомлений, поэтому ожидание короткое
+            with self.condition:
+                self.condition.wait(min(remaining, 0.01))
+
+    def request(self, message, timeout=None):
+        return self.submit(message).result(self.timeout if timeout is None else timeout)
+
+    def close(self):
+        self.stopped.set()
+        for connection in self.connections:
+            connection.shutdown()
+        for connection in self.connections:
+            if connection.thread.is_alive():
+                connection.thread.join(self.timeout)
+        self.connection_changed()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class AsyncPooledConnection(PendingReplies):
+    # Соединение asyncio-пула: задача читает ответы и при обрыве переподключается
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.reader = None
+        self.writer = None
+        self.tls = None
+        self.decompressor = None
+        self.buffer = bytearray()
+        self.start = 0  # начало непрочитанных данных в buffer
+        self.reset_pending()
+        self.task = None
+
+    async def run(self):
+        attempt = 0
+        was_connected = False
+        while not self.pool.closed:
+            try:
+                await asyncio.wait_for(self.connect(), self.pool.timeout)
+            except (OSError, ValueError, MessageTooLargeError, asyncio.TimeoutError) as e:
+                self.close_writer()
+                delay = backoff_delay(attempt)
+                attempt += 1
+                log.debug("Connection %s to %s:%s failed (%s), retry in %.2fs",
+                          self.index, self.pool.host, self.pool.port, e, delay)
+                await self.pool.sleep(delay)
+                continue
+            if was_connected:
+                self.pool.reconnects += 1
+            was_connected = True
+            attempt = 0
+            try:
+                while True:
+                    self.handle_frame(*await self.read_frame())
+            except (OSError, ValueError, MessageTooLargeError) as e:
+                if not self.pool.closed:
+                    log.debug("Connection %s lost: %s", self.index, e)
+            self.connected = False
+            self.fail_pending()
+            self.close_writer()
+            self.pool.connection_changed()
+
+    async def connect(self):
+        pool = self.pool
+        self.buffer = bytearray()
+        self.start = 0
+        self.tls = None
+        self.reader, self.writer = await asyncio.open_connection(pool.host, pool.port)
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            enable_keepalive(sock)
+        if pool.tls is not None:
+            self.tls = await pool.tls.wrap_stream(self.reader, self.writer, pool.host, pool.port,
+                                                  pool.timeout)
+        client_id = pool.welcome_client_id(await self.read_line())
+        self.write([pool.negotiation()])
+        while True:
+            text = await self.read_line()
+            if pool.is_ack(text):
+                break
+            if text:
+                pool.deliver_message(None, text)
+        self.decompressor = FrameDecompressor(pool.max_message_size)
+        self.client_id = client_id
+        self.last_sent = self.last_progress = time.monotonic()
+        self.connected = True
+        pool.connection_changed()
+
+    async def receive(self):
+        if self.start:
+            del self.buffer[:self.start]
+            self.start = 0
+        data = await self.reader.read(RECV_SIZE)
+        if not data:
+            raise ConnectionError("server closed the connection")
+        if self.tls is not None:
+            data = self.tls.decrypt(data)
+            if self.tls.peer_closed and not data:
+                raise ConnectionError("server closed the connection")
+        self.buffer += data
+
+    async def read_line(self):
+        while True:
+            end = self.buffer.find(b'\n', self.start)
+            if end >= 0:
+                line = bytes(self.buffer[self.start:end])
+                self.start = end + 1
+                return line.decode('utf-8', 'replace').strip()
+            if len(self.buffer) - self.start > self.pool.max_message_size:
+                raise MessageTooLargeError(f"message exceeds {self.pool.max_message_size} bytes")
+            await self.receive()
+
+    async def read_frame(self):
+        # разбор по смещению: пачка мелких кадров из одного read не сдвигает буфер на каждом
+        while True:
+            if len(self.buffer) - self.start >= FRAME_HEADER.size:
+                length, frame_type = FRAME_HEADER.unpack_from(self.buffer, self.start)
+                if length > self.pool.max_message_size:
+                    raise MessageTooLargeError(f"frame of {length} bytes exceeds {self.pool.max_message_size}")
+                end = self.start + FRAME_HEADER.size + length
+                if len(self.buffer) >= end:
+                    payload = bytes(self.buffer[self.start + FRAME_HEADER.size:end])
+                    self.start = end
+                    return frame_type, payload
+            await self.receive()
+
+    def write(self, buffers):
+        if self.tls is not None:
+            self.writer.write(self.tls.encrypt(buffers))
+        else:
+            self.writer.writelines(buffers)
+
+    def send(self, frame_type, payload, future):
+        if not self.connected:
+            return False
+        self.track_send()
+        self.pending.append(future)
+        self.write([pack_frame_header(frame_type, len(payload)), payload])
+        return True
+
+    def abort(self):
+        # задача чтения получит конец потока и переподключится
+        self.writer.transport.abort()
+
+    def close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class AsyncClientPool(PoolConfig):
+    # Все методы вызываются из одного цикла событий
+    def __init__(self, host='localhost', port=8888, size=DEFAULT_POOL_SIZE, tls=None, compress=False,
+                 timeout=DEFAULT_TIMEOUT, max_pending=DEFAULT_MAX_PENDING, on_message=None,
+                 max_message_size=DEFAULT_MAX_MESSAGE_SIZE, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL):
+        super().__init__(host, port, size, tls, compress, timeout, max_pending, on_message,
+                         max_message_size, heartbeat_interval)
+        self.closed = False
+        self.monitor = None
+        self.changed = None
+        self.stopping = None
+        self.connections = [AsyncPooledConnection(self, index) for index in range(size)]
+
+    async def start(self):
+        self.changed = asyncio.Event()
+        self.stopping = asyncio.Event()
+        for connection in self.connections:
+            connection.task = asyncio.create_task(connection.run())
+        self.monitor = asyncio.create_task(self.watch_connections())
+        try:
+            await asyncio.wait_for(self.wait_connected(), self.timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise ConnectionError(f"cannot connect to {self.host}:{self.port}")
+        return self
+
+    async def wait_connected(self):
+        while not any(connection.connected for connection in self.connections):
+            await self.wait_changed()
+
+    async def wait_changed(self, timeout=None):
+        self.changed.clear()
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def watch_connections(self):
+        while not self.closed:
+            await self.sleep(IDLE_CHECK_INTERVAL)
+            self.check_connections(time.monotonic())
+
+    def heartbeat_future(self):
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(discard_result)
+        return future
+
+    def connection_changed(self):
+        if self.changed is not None:
+            self.changed.set()
+
+    async def sleep(self, delay):
+        # пауза перед переподключением, прерываемая close()
+        try:
+            await asyncio.wait_for(self.stopping.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def submit(self, message):
+        # Отправляет запрос и возвращает asyncio.Future с ответом; ждет, только если все
+        # соединения заполнены или разорваны, либо буфер отправки переполнен
+        frame_type, payload = request_frame(message)
+        future = asyncio.get_running_loop().create_future()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if self.closed:
+                raise ConnectionError("client pool is closed")
+            connection = self.choose()
+            if connection is not None and connection.send(frame_type, payload, future):
+                await connection.writer.drain()
+                return future
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ConnectionError(f"no connection to {self.host}:{self.port} available")
+            await self.wait_changed(min(remaining, 0.01))
+
+    async def request(self, message, timeout=None):
+        future = await self.submit(message)
+        return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+
+    async def close(self):
+        self.closed = True
+        if self.stopping is not None:
+            self.stopping.set()
+        self.connection_changed()
+        tasks = [c.task for c in self.connections if c.task is not None]
+        if self.monitor is not None:
+            tasks.append(self.monitor)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for connection in self.connections:
+            connection.connected = False
+            connection.fail_pending()
+            connection.close_writer()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
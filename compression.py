@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import struct
+import zlib
+from framing import FRAME_HEADER, FRAME_COMPRESSED, FRAME_COMPRESSED_SHARED, MessageTooLargeError
+
+# Сжатие сообщений сервер -> клиент (zlib, raw deflate). Клиент включает его командой
+# /compress сразу после приветствия; сервер отвечает COMPRESS_ACK с порогом и дальше
+# шлет клиенту кадры бинарного режима. Сообщения короче порога идут как есть.
+#
+# TCP: payload сжатого кадра - [исходный тип: 1 байт][deflate]. У соединения один
+# потоковый контекст (FRAME_COMPRESSED, Z_SYNC_FLUSH после каждого сообщения), поэтому
+# повторы между сообщениями тоже сжимаются. Рассылки и сообщения каналов сжимаются
+# один раз без контекста (FRAME_COMPRESSED_SHARED), и результат общий для всех получателей.
+#
+# UDP: датаграммы теряются и переставляются, поэтому каждое сообщение сжимается
+# отдельно: [0xFD][deflate]. 0xFD не встречается в UTF-8, как и метки фрагментов (0xFE)
+# и надежного уровня (0xFF).
+
+COMPRESS_COMMAND = '/compress'
+COMPRESS_ACK = "Compression enabled: zlib"
+DEFAULT_COMPRESS_THRESHOLD = 512
+COMPRESS_LEVEL = 6
+DEFLATE_WBITS = -15  # raw deflate: без заголовка и контрольной суммы zlib в каждом сообщении
+COMPRESSED_MAGIC = 0xFD
+COMPRESSED_HEADER = struct.Struct('!IBB')  # заголовок кадра + исходный тип
+
+def compress_ack(threshold):
+    return f"{COMPRESS_ACK}, threshold {threshold} bytes"
+
+def deflate(data):
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, DEFLATE_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def inflate(data, max_size, decompressor=None):
+    # Ограничение размера - защита от "zip-бомбы" на стороне получателя
+    if decompressor is None:
+        decompressor = zlib.decompressobj(DEFLATE_WBITS)
+    data = decompressor.decompress(data, max_size)
+    if decompressor.unconsumed_tail:
+        raise MessageTooLargeError(f"compressed message expands beyond {max_size} bytes")
+    return data
+
+class StreamCompressor:
+    # Потоковый контекст соединения: кадры должны уходить в том порядке, в котором
+    # сжаты, поэтому frame вызывает только поток (корутина) самого клиента - для эха
+    # и ответов. Выбрасывать сжатые кадры из очереди нельзя (политика drop-oldest).
+    def __init__(self, threshold=DEFAULT_COMPRESS_THRESHOLD):
+        self.threshold = threshold
+        self.compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, DEFLATE_WBITS)
+
+    def frame(self, frame_type, payload):
+        if len(payload) < self.threshold:
+            return [FRAME_HEADER.pack(len(payload), frame_type), payload]
+        data = self.compressor.compress(payload) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return [COMPRESSED_HEADER.pack(len(data) + 1, FRAME_COMPRESSED, frame_type), data]
+
+    def shared_frame(self, outgoing, shared):
+        # shared - кэш сжатого кадра одной рассылки для всех получателей
+        text, header, payload = outgoing
+        if len(payload) < self.threshold:
+            return [header, payload]
+        if shared is None:
+            shared = {}
+        buffers = shared.get(self.threshold)
+        if buffers is None:
+            frame_type = FRAME_HEADER.unpack(header)[1]
+            data = deflate(payload)
+            buffers = shared[self.threshold] = [
+                COMPRESSED_HEADER.pack(len(data) + 1, FRAME_COMPRESSED_SHARED, frame_type), data]
+        return buffers
+
+class FrameDecompressor:
+    # Сторона клиента: разворачивает сжатые кадры в (исходный тип, payload)
+    def __init__(self, max_message_size):
+        self.max_message_size = max_message_size
+        self.decompressor = zlib.decompressobj(DEFLATE_WBITS)
+
+    def unpack(self, frame_type, payload):
+        if frame_type == FRAME_COMPRESSED:
+            return payload[0], inflate(payload[1:], self.max_message_size, self.decompressor)
+        if frame_type == FRAME_COMPRESSED_SHARED:
+            return payload[0], inflate(payload[1:], self.max_message_size)
+        return frame_type, payload
+
+def compress_datagram(data, threshold):
+    # UDP: сжатое сообщение отправляется, только если оно действительно короче
+    if len(data) < threshold:
+        return data
+    compressed = bytes((COMPRESSED_MAGIC,)) + deflate(data)
+    return compressed if len(compressed) < len(data) else data
+
+def is_compressed_datagram(data):
+    return len(data) > 1 and data[0] == COMPRESSED_MAGIC
+
+def decompress_datagram(data, max_size):
+    return inflate(data[1:], max_size)
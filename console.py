@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import logging
+import queue
+import signal
+import sys
+import threading
+import time
+
+# Вывод серверов в консоль. Вызовы log/traffic_log только кладут запись в очередь,
+# а отдельный поток пишет все накопившиеся строки одним write и один раз
+# перерисовывает приглашение "Server command: ". Записи о каждом сообщении клиента
+# (traffic_log) ограничены по частоте: лишние отбрасываются еще до создания записи,
+# а сколько их было, выводится раз в секунду.
+
+PROMPT = "Server command: "
+LOG_LEVELS = ['debug', 'info', 'warning', 'error']
+DEFAULT_LOG_RATE = 100      # записей traffic_log в секунду, 0 - без ограничения
+MAX_BATCH = 1024
+REPORT_INTERVAL = 1.0
+PREVIEW_SIZE = 200
+
+class RateLimiter:
+    # token bucket: в среднем rate записей в секунду, всплеск до rate
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.suppressed = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, float(self.rate))
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.suppressed += 1
+            return False
+
+    def take_suppressed(self):
+        with self.lock:
+            suppressed, self.suppressed = self.suppressed, 0
+        return suppressed
+
+class RateLimitedLogger(logging.Logger):
+    # Проверка лимита в isEnabledFor: лишняя запись стоит как запись ниже уровня
+    # логирования - без LogRecord и форматирования аргументов
+    limiter = None
+
+    def isEnabledFor(self, level):
+        # уровень проверяется без кэша logging: логгер создан напрямую, и сброс кэша
+        # при смене уровня (configure) до него не доходит
+        if self.disabled or level < self.getEffectiveLevel() or self.manager.disable >= level:
+            return False
+        return self.limiter is None or self.limiter.allow()
+
+    def findCaller(self, stack_info=False, stacklevel=1):
+        # формат не использует место вызова - не обходим стек ради каждого сообщения клиента
+        return "(unknown file)", 0, "(unknown function)", None
+
+log = logging.getLogger('network_app')
+# класс логгеров процесса (logging.setLoggerClass) не меняется: логгер создается сам
+# и пишет через обработчики log
+traffic_log = RateLimitedLogger('network_app.traffic')
+traffic_log.parent = log
+settings = ('info', DEFAULT_LOG_RATE, False)  # для воркеров prefork
+handler = None
+
+def preview(message):
+    # многомегабайтные сообщения в консоль целиком не выводятся
+    if len(message) <= PREVIEW_SIZE:
+        return message
+    return f"{message[:PREVIEW_SIZE]}... ({len(message)} chars)"
+
+class ConsoleHandler(logging.Handler):
+    def __init__(self, stream=None, prompt=None, limiter=None):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.prompt = prompt
+        self.limiter = limiter
+        self.records = queue.SimpleQueue()
+        self.prompted = False
+        self.next_report = time.monotonic() + REPORT_INTERVAL
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def emit(self, record):
+        # форматирование и запись - в потоке вывода
+        self.records.put(record)
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.records.get(timeout=REPORT_INTERVAL)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.records.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            stop = False
+            for record in batch:
+                if record is None:
+                    stop = True
+                    continue
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.handleError(record)
+            if self.limiter and time.monotonic() >= self.next_report:
+                self.next_report = time.monotonic() + REPORT_INTERVAL
+                suppressed = self.limiter.take_suppressed()
+                if suppressed:
+                    lines.append(self.format(logging.makeLogRecord({
+                        'name': traffic_log.name, 'levelno': logging.INFO, 'levelname': 'INFO',
+                        'msg': f"... {suppressed} client messages not shown (log rate limit)"})))
+            if lines:
+                self.write(lines)
+            if stop:
+                break
+
+    def write(self, lines):
+        text = '\n'.join(lines) + '\n'
+        if self.prompted:
+            text = '\n' + text
+        prompt = self.prompt
+        if prompt:
+            text += prompt
+        self.prompted = bool(prompt)
+        try:
+            self.stream.write(text)
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def close(self):
+        # дописать очередь перед выходом, без приглашения после последней строки
+        if self.thread.is_alive():
+            self.prompt = None
+            self.records.put(None)
+            self.thread.join(timeout=2)
+        super().close()
+
+def configure(level='info', rate=DEFAULT_LOG_RATE, headless=False):
+    global settings, handler
+    settings = (level, rate, headless)
+    limiter = RateLimiter(rate) if rate > 0 else None
+    handler = ConsoleHandler(prompt=None if headless else PROMPT, limiter=limiter)
+    if headless:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    for old in list(log.handlers):
+        log.removeHandler(old)
+        old.close()
+    log.addHandler(handler)
+    log.setLevel(level.upper())
+    log.propagate = False
+    traffic_log.limiter = limiter
+    return handler
+
+def hide_prompt():
+    # консоль администратора закрыта - после следующих строк приглашение не нужно
+    if handler is not None:
+        handler.prompt = None
+
+def wait_for_shutdown(running):
+    # --headless: консоли нет, сервер работает до SIGTERM/SIGINT (например, под systemd)
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    while running() and not stop.wait(1.0):
+        pass
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import socket
+import threading
+from console import log
+from framing import MessageReader, MessageTooLargeError
+
+# Управляющий сокет сервера (--control-socket PATH): те же команды, что и в консоли,
+# для скриптов и оркестрации без терминала. Unix-сокет, одна строка - один запрос:
+#   send 3 hello                                          - как в консоли
+#   {"command": "send", "client": 3, "message": "hello"}  - JSON
+#   [{"command": "send", ...}, {"command": "list"}]       - пачка команд
+# На каждую строку приходит одна строка JSON: результат команды или массив
+# результатов пачки в том же порядке. Поле "id" запроса копируется в результат.
+
+CONTROL_COMMANDS = ['send', 'broadcast', 'publish', 'list', 'channels', 'metrics']
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+LISTEN_BACKLOG = 64
+
+def parse_command(text):
+    # текстовая команда консоли -> запрос
+    parts = text.split(' ', 2)
+    command = parts[0].lower()
+    if command == 'send':
+        if len(parts) < 3:
+            raise ValueError("usage: send <client_id> <message>")
+        return {'command': command, 'client': parts[1], 'message': parts[2]}
+    if command == 'publish':
+        if len(parts) < 3:
+            raise ValueError("usage: publish <channel> <message>")
+        return {'command': command, 'channel': parts[1], 'message': parts[2]}
+    if command == 'broadcast':
+        return {'command': command, 'message': text[len('broadcast '):]}
+    return {'command': command}
+
+def execute_command(server, request):
+    if not isinstance(request, dict):
+        return {'ok': False, 'error': "request must be a JSON object"}
+
+    command = request.get('command')
+    try:
+        if command == 'send':
+            result = server.control_send(int(request['client']), str(request['message']))
+        elif command == 'broadcast':
+            result = server.control_broadcast(str(request['message']))
+        elif command == 'publish':
+            result = server.control_publish(str(request['channel']), str(request['message']))
+        elif command == 'list':
+            result = {'ok': True, 'clients': server.control_list()}
+        elif command == 'channels':
+            result = {'ok': True, 'channels': server.control_channels()}
+        elif command == 'metrics':
+            counters = {name if label is None else f"{name}[{label}]": value
+                        for (name, label), value in server.metrics.counter_values().items()}
+            result = {'ok': True, 'counters': counters, 'gauges': server.metrics.gauge_values()}
+        else:
+            result = {'ok': False, 'error': f"unknown command {command!r}, available: {', '.join(CONTROL_COMMANDS)}"}
+    except KeyError as e:
+        result = {'ok': False, 'error': f"missing field {e}"}
+    except (ValueError, TypeError) as e:
+        result = {'ok': False, 'error': f"bad request: {e}"}
+
+    server.metrics.inc('control_commands', label=command if command in CONTROL_COMMANDS else 'unknown')
+    result['command'] = command
+    if 'id' in request:
+        result['id'] = request['id']
+    return result
+
+class ControlServer:
+    def __init__(self, path, server):
+        self.path = path
+        self.server = server
+        self.socket = None
+        self.running = False
+
+    def start(self):
+        if os.path.exists(self.path):
+            # сокет от упавшего процесса удаляется, от работающего - нет
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise RuntimeError(f"control socket {self.path} is in use by another server")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)
+            finally:
+                probe.close()
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # команды управляют сервером - доступ только у владельца процесса
+        umask = os.umask(0o177)
+        try:
+            self.socket.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.socket.listen(LISTEN_BACKLOG)
+        self.running = True
+
+        accept_thread = threading.Thread(target=self.accept_connections)
+        accept_thread.daemon = True
+        accept_thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.socket.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def accept_connections(self):
+        while self.running:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                break
+            connection_thread = threading.Thread(target=self.handle_connection, args=(connection,))
+            connection_thread.daemon = True
+            connection_thread.start()
+
+    def handle_connection(self, connection):
+        reader = MessageReader(connection, MAX_REQUEST_SIZE)
+        replies = []
+        try:
+            for line in reader:
+                reply = self.handle_line(line)
+                if reply:
+                    replies.append(reply)
+                # ответы на все запросы из одного recv уходят одной записью
+                if replies and not reader.has_message():
+                    connection.sendall(b''.join(replies))
+                    replies = []
+        except MessageTooLargeError as e:
+            log.warning("Control connection closed: %s", e)
+        except OSError:
+            pass
+        finally:
+            connection.close()
+
+    def handle_line(self, line):
+        text = line.decode('utf-8', 'replace').strip()
+        if not text:
+            return None
+
+        if text[0] in '[{':
+            try:
+                request = json.loads(text)
+            except ValueError as e:
+                response = {'ok': False, 'error': f"invalid JSON: {e}"}
+            else:
+                if isinstance(request, list):
+                    response = [execute_command(self.server, item) for item in request]
+                else:
+                    response = execute_command(self.server, request)
+        else:
+            try:
+                response = execute_command(self.server, parse_command(text))
+            except ValueError as e:
+                response = {'ok': False, 'error': str(e), 'command': text.split(' ', 1)[0].lower()}
+        return (json.dumps(response) + '\n').encode()
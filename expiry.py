@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+
+# Индекс истечения неактивных клиентов: куча с ленивым удалением.
+# touch() только обновляет время активности (O(1)); в куче у каждого клиента одна
+# живая запись, и при ее извлечении проверяется актуальное время - если клиент успел
+# проявить активность, запись возвращается в кучу с новым сроком. Записи забытых
+# клиентов (discard) устаревают: при извлечении они выбрасываются, а если их
+# накопилось больше, чем живых, куча пересобирается.
+
+COMPACT_MIN = 64  # маленькую кучу не пересобираем
+
+class ExpiryIndex:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.last_seen = {}  # {key: float}
+        self.entries = {}    # {key: seq живой записи в куче}
+        self.heap = []       # [(deadline, seq, key)]
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def touch(self, key, now):
+        if key not in self.last_seen:
+            self.push(key, now + self.timeout)
+        self.last_seen[key] = now
+
+    def push(self, key, deadline):
+        seq = next(self.counter)
+        self.entries[key] = seq
+        heapq.heappush(self.heap, (deadline, seq, key))
+
+    def discard(self, key):
+        # запись в куче останется и будет выброшена при извлечении
+        if self.last_seen.pop(key, None) is None:
+            return
+        del self.entries[key]
+        if len(self.heap) > max(COMPACT_MIN, 2 * len(self.entries)):
+            self.heap = [entry for entry in self.heap if self.entries.get(entry[2]) == entry[1]]
+            heapq.heapify(self.heap)
+
+    def next_deadline(self):
+        return self.heap[0][0] if self.heap else None
+
+    def expire(self, now):
+        # Возвращает ключи, неактивные дольше timeout
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, seq, key = heapq.heappop(self.heap)
+            if self.entries.get(key) != seq:
+                # клиент был забыт (и, возможно, вернулся с новой записью)
+                continue
+            seen = self.last_seen[key]
+            if seen + self.timeout > now:
+                self.push(key, seen + self.timeout)
+                continue
+            del self.last_seen[key]
+            del self.entries[key]
+            expired.append(key)
+        return expired
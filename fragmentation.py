@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import collections
+import itertools
+import math
+import socket
+import struct
+import time
+
+# Фрагментация больших UDP-сообщений.
+# Фрагмент: [b'\xfeF'][версия: 1][id сообщения: 4][индекс: 2][число фрагментов: 2][данные]
+# Размер фрагмента подбирается по MTU маршрута до получателя, и сокету ставится
+# запрет фрагментации (DF), поэтому на уровне IP датаграммы не дробятся. MTU узнается
+# у ядра один раз на хост получателя (кэш ограничен) и заново - только после EMSGSIZE:
+# с DF ядро само отвергает датаграмму больше известного ему PMTU.
+# Сообщение, которое помещается в одну датаграмму, отправляется как есть.
+
+FRAGMENT_HEADER = struct.Struct('!2sBIHH')
+FRAGMENT_MAGIC = b'\xfeF'            # 0xFE не встречается в UTF-8
+FRAGMENT_VERSION = 1
+MAX_FRAGMENTS = 0xFFFF
+MAX_DATAGRAM = 65507                  # максимум payload UDP поверх IPv4
+DEFAULT_MTU = 1500
+MTU_CACHE_SIZE = 4096                 # хостов получателей с известным MTU
+DEFAULT_REASSEMBLY_BUDGET = 64 * 1024 * 1024
+DEFAULT_REASSEMBLY_TIMEOUT = 10.0
+# учетная стоимость фрагмента и сборки сверх данных (объекты и слоты словарей): без нее
+# крошечные фрагменты тысяч сборок занимали бы память мимо бюджета
+ENTRY_OVERHEAD = 128
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Linux: <linux/in.h>, <linux/in6.h>
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+IPV6_MTU = getattr(socket, 'IPV6_MTU', 24)
+
+def is_fragment(data):
+    if len(data) < FRAGMENT_HEADER.size or data[:2] != FRAGMENT_MAGIC:
+        return False
+    _, version, _, index, count = FRAGMENT_HEADER.unpack_from(data)
+    return version == FRAGMENT_VERSION and index < count
+
+def prepare_socket(sock):
+    # DF на исходящих датаграммах и буферы побольше для пачек фрагментов
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    except OSError:
+        pass
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+        except OSError:
+            pass
+
+def path_mtu(address):
+    # MTU маршрута до адреса: ядро сообщает его для подключенного UDP-сокета
+    family = socket.AF_INET6 if len(address) == 4 else socket.AF_INET
+    try:
+        probe = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            probe.connect(address)
+            if family == socket.AF_INET6:
+                return probe.getsockopt(socket.IPPROTO_IPV6, IPV6_MTU)
+            return probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        finally:
+            probe.close()
+    except OSError:
+        return DEFAULT_MTU
+
+class Fragmenter:
+    def __init__(self, overhead=0):
+        self.overhead = overhead  # заголовки уровня выше (например, надежного UDP)
+        self.mtus = collections.OrderedDict()  # {хост: mtu}, LRU: маршрут зависит от хоста, не от порта
+        self.ids = itertools.count(1)
+
+    def max_datagram(self, address):
+        host = address[0]
+        mtu = self.mtus.get(host)
+        if mtu is None:
+            mtu = self.mtus[host] = path_mtu(address)
+            if len(self.mtus) > MTU_CACHE_SIZE:
+                self.mtus.popitem(last=False)
+        else:
+            self.mtus.move_to_end(host)
+        ip_header = 48 if len(address) == 4 else 28  # IP + UDP
+        return min(mtu - ip_header, MAX_DATAGRAM) - self.overhead
+
+    def invalidate(self, address):
+        # после EMSGSIZE MTU маршрута уменьшился
+        self.mtus.pop(address[0], None)
+
+    def split(self, data, address):
+        limit = self.max_datagram(address)
+        if len(data) <= limit:
+            return [data]
+        chunk = limit - FRAGMENT_HEADER.size
+        count = math.ceil(len(data) / chunk)
+        if count > MAX_FRAGMENTS:
+            raise ValueError(f"message of {len(data)} bytes needs more than {MAX_FRAGMENTS} fragments")
+        message_id = next(self.ids) & 0xFFFFFFFF
+        view = memoryview(data)
+        return [FRAGMENT_HEADER.pack(FRAGMENT_MAGIC, FRAGMENT_VERSION, message_id, index, count)
+                + view[index * chunk:(index + 1) * chunk]
+                for index in range(count)]
+
+class PartialMessage:
+    # фрагменты - словарь {индекс: данные}, а не список на count мест: число фрагментов
+    # приходит в пакете, и под него нельзя заранее выделять память
+    __slots__ = ('fragments', 'count', 'size', 'started')
+
+    def __init__(self, count, started):
+        self.fragments = {}
+        self.count = count
+        self.size = ENTRY_OVERHEAD
+        self.started = started
+
+class Reassembler:
+    # Сборка сообщений из фрагментов. Недособранные сообщения занимают не больше
+    # max_bytes вместе с накладными расходами (при превышении выбрасываются самые
+    # старые) и живут не дольше timeout.
+    def __init__(self, max_bytes=DEFAULT_REASSEMBLY_BUDGET, timeout=DEFAULT_REASSEMBLY_TIMEOUT):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.partial = collections.OrderedDict()  # {(address, message_id): PartialMessage} по времени начала
+        self.buffered = 0
+        self.evicted = 0
+        self.completed = 0
+
+    def add(self, data, address, now=None):
+        # Возвращает собранное сообщение или None
+        _, _, message_id, index, count = FRAGMENT_HEADER.unpack_from(data)
+        key = (address, message_id)
+        partial = self.partial.get(key)
+        if partial is None:
+            if count == 0:
+                return None
+            partial = self.partial[key] = PartialMessage(count, time.time() if now is None else now)
+            self.buffered += partial.size
+        if index >= count or count != partial.count or index in partial.fragments:
+            return None
+
+        payload = data[FRAGMENT_HEADER.size:]
+        partial.fragments[index] = payload
+        partial.size += len(payload) + ENTRY_OVERHEAD
+        self.buffered += len(payload) + ENTRY_OVERHEAD
+
+        if len(partial.fragments) == count:
+            del self.partial[key]
+            self.buffered -= partial.size
+            self.completed += 1
+            return b''.join(partial.fragments[index] for index in range(count))
+
+        while self.buffered > self.max_bytes and self.partial:
+            self.evict(next(iter(self.partial)))
+        return None
+
+    def evict(self, key):
+        partial = self.partial.pop(key)
+        self.buffered -= partial.size
+        self.evicted += 1
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        while self.partial:
+            key, partial = next(iter(self.partial.items()))
+            if partial.started + self.timeout > now:
+                break
+            self.evict(key)
+
+    def stats(self):
+        return (f"reassembled: {self.completed}, incomplete: {len(self.partial)} "
+                f"({self.buffered} bytes), evicted: {self.evicted}")
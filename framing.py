@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import struct
+
+DEFAULT_MAX_MESSAGE_SIZE = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Бинарный режим: после команды /binary обе стороны переходят на кадры
+# [длина payload: 4 байта][тип: 1 байт][payload]
+FRAME_HEADER = struct.Struct('!IB')
+BINARY_COMMAND = '/binary'
+BINARY_ACK = "Binary mode enabled\n"
+
+FRAME_DATA = 1       # клиент -> сервер: данные для эха
+FRAME_COMMAND = 2    # клиент -> сервер: текстовая команда (/ping, /stats, quit ...)
+FRAME_ECHO = 3       # сервер -> клиент: эхо payload без изменений
+FRAME_REPLY = 4      # сервер -> клиент: ответ на команду
+FRAME_SERVER = 5     # сервер -> клиент: сообщение администратора
+FRAME_BROADCAST = 6  # сервер -> клиент: рассылка
+FRAME_CHANNEL = 7    # сервер -> клиент: сообщение канала, "[канал] отправитель: текст"
+FRAME_COMPRESSED = 8         # сервер -> клиент: кадр, сжатый контекстом соединения (compression.py)
+FRAME_COMPRESSED_SHARED = 9  # сервер -> клиент: кадр, сжатый отдельно (рассылки)
+FRAME_BUSY = 10              # сервер -> клиент: сообщение отклонено по лимиту (ratelimit.py)
+
+class MessageTooLargeError(Exception):
+    pass
+
+def pack_frame_header(frame_type, length):
+    return FRAME_HEADER.pack(length, frame_type)
+
+def send_buffers(sock, buffers):
+    # sendmsg может записать только часть данных - досылаем остаток без склейки буферов
+    views = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer)]
+    while views:
+        sent = sock.sendmsg(views)
+        while sent and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
+
+def send_frame(sock, frame_type, payload):
+    send_buffers(sock, [pack_frame_header(frame_type, len(payload)), payload])
+
+def encode_outgoing(frame_type, prefix, message):
+    # Сообщение кодируется один раз в обоих форматах: строкой для текстовых
+    # клиентов и кадром для бинарных
+    payload = message.encode() if isinstance(message, str) else bytes(message)
+    text = prefix.encode() + payload + b'\n'
+    header = pack_frame_header(frame_type, len(payload))
+    return text, header, payload
+
+class MessageReader:
+    # Читает сообщения, разделенные '\n', прямо в заранее выделенный буфер (recv_into).
+    # Разделитель ищется только в новых байтах, поэтому сообщение любой длины
+    # разбирается за O(n) без повторного копирования хвоста буфера.
+    # После перехода в бинарный режим тот же буфер используется для чтения кадров.
+    def __init__(self, sock, max_message_size=DEFAULT_MAX_MESSAGE_SIZE,
+                 chunk_size=DEFAULT_CHUNK_SIZE, delimiter=b'\n'):
+        self.sock = sock
+        self.max_message_size = max_message_size
+        self.chunk_size = chunk_size
+        self.delimiter = delimiter
+        self.buffer = bytearray(chunk_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0    # начало еще не отданных данных
+        self.end = 0      # конец принятых данных
+        self.scanned = 0  # до этой позиции разделителя точно нет
+
+    def __iter__(self):
+        while True:
+            message = self.read_message()
+            if message is None:
+                return
+            yield message
+
+    def has_message(self):
+        # Есть ли в буфере еще одно целое сообщение: пока есть, ответы можно копить.
+        # Начало следующего сообщения не в счет - остальное может прийти нескоро.
+        index = self.buffer.find(self.delimiter, self.scanned, self.end)
+        if index < 0:
+            self.scanned = max(self.start, self.end - len(self.delimiter) + 1)
+        return index >= 0
+
+    def has_frame(self):
+        # то же для бинарного режима
+        pending = self.end - self.start
+        if pending < FRAME_HEADER.size:
+            return False
+        length, _ = FRAME_HEADER.unpack_from(self.buffer, self.start)
+        return pending >= FRAME_HEADER.size + length
+
+    def read_message(self):
+        # Возвращает сообщение без разделителя или None, если соединение закрыто
+        while True:
+            index = self.buffer.find(self.delimiter, self.scanned, self.end)
+            if index >= 0:
+                message = bytes(self.view[self.start:index])
+                self.start = index + len(self.delimiter)
+                self.scanned = self.start
+                if self.start == self.end:
+                    self.start = self.end = self.scanned = 0
+                return message
+
+            pending = self.end - self.start
+            if pending > self.max_message_size:
+                raise MessageTooLargeError(
+                    f"message exceeds {self.max_message_size} bytes without delimiter"
+                )
+            # разделитель может оказаться разрезан между двумя recv
+            self.scanned = max(self.start, self.end - len(self.delimiter) + 1)
+
+            if not self.fill():
+                return None
+
+    def read_frame(self):
+        # Возвращает (тип, payload) или None, если соединение закрыто
+        header = self.read_exact(FRAME_HEADER.size)
+        if header is None:
+            return None
+        length, frame_type = FRAME_HEADER.unpack(header)
+        if length > self.max_message_size:
+            raise MessageTooLargeError(f"frame of {length} bytes exceeds {self.max_message_size} bytes")
+        payload = self.read_exact(length)
+        if payload is None:
+            return None
+        return frame_type, payload
+
+    def read_exact(self, size):
+        while self.end - self.start < size:
+            if self.start + size > len(self.buffer):
+                self.make_room(size)
+            if not self.fill():
+                return None
+        data = bytes(self.view[self.start:self.start + size])
+        self.start += size
+        self.scanned = self.start
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+        return data
+
+    def fill(self):
+        if self.end == len(self.buffer):
+            self.make_room()
+        received = self.sock.recv_into(self.view[self.end:])
+        if received == 0:
+            return False
+        self.end += received
+        return True
+
+    def make_room(self, need=0):
+        pending = self.end - self.start
+        if self.start > 0 and pending < len(self.buffer) // 2 and need <= len(self.buffer):
+            # достаточно сдвинуть недочитанный хвост в начало буфера
+            self.buffer[:pending] = self.view[self.start:self.end]
+        else:
+            # буфер растет геометрически, но не больше чем нужно для max_message_size
+            limit = self.max_message_size + self.chunk_size
+            size = min(max(len(self.buffer) * 2, pending + self.chunk_size), limit)
+            size = max(size, need)
+            buffer = bytearray(size)
+            buffer[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+        self.scanned -= self.start
+        self.end = pending
+        self.start = 0
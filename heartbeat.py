@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import heapq
+import itertools
+import socket
+import threading
+
+# Обнаружение мертвых собеседников. Клиенты раз в интервал простоя шлют /heartbeat,
+# сервер отвечает HEARTBEAT_REPLY: клиенту это показывает, что сервер жив, а сервер
+# отключает (TCP) или забывает (UDP) клиентов, от которых ничего не приходило дольше
+# --client-timeout. У UDP срок есть по умолчанию (DEFAULT_CLIENT_TIMEOUT): иначе
+# реестр копил бы адреса навсегда. У TCP отключение молчащих клиентов включается
+# явно - nc/telnet и клиенты без heartbeat вправе молчать. TCP keepalive
+# дополнительно находит полуоткрытые соединения на уровне ядра - в том числе у
+# клиентов, которые heartbeat не шлют.
+
+HEARTBEAT_COMMAND = '/heartbeat'
+HEARTBEAT_REPLY = 'alive'
+DEFAULT_HEARTBEAT_INTERVAL = 30.0
+DEFAULT_CLIENT_TIMEOUT = 300
+DEAD_PEER_INTERVALS = 3  # клиент: сервер молчит 3 интервала - соединение мертво
+IDLE_CHECK_INTERVAL = 1.0
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+
+def enable_keepalive(sock, idle=KEEPALIVE_IDLE, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # без этих опций (не Linux) остаются системные 2 часа до первой пробы
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+class IdleMonitor:
+    # Центральный таймер неактивных TCP-клиентов. Поток (корутина) клиента только
+    # записывает время последнего сообщения в record.last_seen, без блокировок; в куче
+    # у клиента одна запись, и клиент перепроверяется, только когда подошел его срок
+    def __init__(self, clients, timeout):
+        self.clients = clients
+        self.timeout = timeout
+        self.heap = []  # [(deadline, seq, client_id)]
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def watch(self, client_id, now):
+        with self.lock:
+            heapq.heappush(self.heap, (now + self.timeout, next(self.counter), client_id))
+
+    def expire(self, now):
+        # Возвращает клиентов, молчащих дольше timeout; отключившиеся выпадают из кучи
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, _, client_id = heapq.heappop(self.heap)
+                client_info = self.clients.get(client_id)
+                if client_info is None:
+                    continue
+                deadline = client_info.last_seen + self.timeout
+                if deadline > now:
+                    heapq.heappush(self.heap, (deadline, next(self.counter), client_id))
+                    continue
+                expired.append(client_id)
+        return expired
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Метрики сервера. Счетчики и гистограммы шардированы по потокам: каждый поток
+# пишет только в свой словарь без блокировок, при чтении шарды суммируются.
+# Так инкремент на горячем пути стоит одной операции со словарем и не теряет
+# обновлений при одновременной записи из нескольких потоков. Шарды завершившихся
+# потоков (поток на клиента в TCPServer) сливаются в общий итог.
+
+HANDLING_QUANTILES = (50, 90, 99, 99.9)
+
+class LatencyHistogram:
+    # Логарифмические корзины: 32 на каждую степень двойки (~2% точности), значения в мкс
+    SUB_BUCKETS = 32
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        micros = max(seconds * 1e6, 1.0)
+        index = int(math.log2(micros) * self.SUB_BUCKETS)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        for index, count in list(other.counts.items()):
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                # верхняя граница корзины, но не больше реального максимума
+                return min(2 ** ((index + 1) / self.SUB_BUCKETS) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(50) * 1000, 3),
+            'p90_ms': round(self.percentile(90) * 1000, 3),
+            'p99_ms': round(self.percentile(99) * 1000, 3),
+            'p999_ms': round(self.percentile(99.9) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3)
+        }
+
+class Metrics:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.counter_shards = []    # [(поток, {(имя, метка): значение})]
+        self.histogram_shards = []  # [(поток, {имя: LatencyHistogram})]
+        self.retired_counters = {}
+        self.retired_histograms = {}
+        self.gauges = {}            # {имя: функция без аргументов}
+        self.external = {}          # {источник: (счетчики, гистограммы, gauges)} - снимки других процессов
+        self.started = time.time()
+
+    def counters(self):
+        shard = getattr(self.local, 'counters', None)
+        if shard is None:
+            shard = self.local.counters = {}
+            with self.lock:
+                self.retire()
+                self.counter_shards.append((threading.current_thread(), shard))
+        return shard
+
+    def histograms(self):
+        shard = getattr(self.local, 'histograms', None)
+        if shard is None:
+            shard = self.local.histograms = {}
+            with self.lock:
+                self.retire()
+                self.histogram_shards.append((threading.current_thread(), shard))
+        return shard
+
+    def retire(self):
+        # вызывается под self.lock: в шарды завершившихся потоков уже никто не пишет
+        alive = []
+        for thread, shard in self.counter_shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                continue
+            for key, value in shard.items():
+                self.retired_counters[key] = self.retired_counters.get(key, 0) + value
+        self.counter_shards = alive
+
+        alive = []
+        for thread, shard in self.histogram_shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                continue
+            for name, histogram in shard.items():
+                self.retired_histograms.setdefault(name, LatencyHistogram()).merge(histogram)
+        self.histogram_shards = alive
+
+    def inc(self, name, value=1, label=None):
+        shard = self.counters()
+        key = (name, label)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, seconds):
+        shard = self.histograms()
+        histogram = shard.get(name)
+        if histogram is None:
+            histogram = shard[name] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def snapshot(self):
+        # для передачи в другой процесс (воркеры prefork -> мастер)
+        return (self.counter_values(),
+                {name: self.histogram(name) for name in self.histogram_names()},
+                self.gauge_values())
+
+    def set_external(self, source, snapshot):
+        with self.lock:
+            self.external[source] = snapshot
+
+    def counter_values(self):
+        with self.lock:
+            self.retire()
+            totals = dict(self.retired_counters)
+            shards = [shard for thread, shard in self.counter_shards]
+            shards += [counters for counters, histograms, gauges in self.external.values()]
+        for shard in shards:
+            for key, value in list(shard.items()):
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def counter(self, name, label=None):
+        return self.counter_values().get((name, label), 0)
+
+    def histogram(self, name):
+        total = LatencyHistogram()
+        with self.lock:
+            self.retire()
+            if name in self.retired_histograms:
+                total.merge(self.retired_histograms[name])
+            shards = [shard for thread, shard in self.histogram_shards]
+            shards += [histograms for counters, histograms, gauges in self.external.values()]
+        for shard in shards:
+            histogram = shard.get(name)
+            if histogram is not None:
+                total.merge(histogram)
+        return total
+
+    def histogram_names(self):
+        with self.lock:
+            names = set(self.retired_histograms)
+            for thread, shard in self.histogram_shards:
+                names.update(list(shard))
+            for counters, histograms, gauges in self.external.values():
+                names.update(histograms)
+        return sorted(names)
+
+    def gauge_values(self):
+        values = {}
+        with self.lock:
+            external = list(self.external.values())
+        for counters, histograms, gauges in external:
+            for name, value in gauges.items():
+                values[name] = values.get(name, 0) + value
+        for name, function in list(self.gauges.items()):
+            try:
+                values[name] = values.get(name, 0) + function()
+            except Exception:
+                continue
+        return values
+
+    def render_text(self):
+        lines = [f"Uptime: {time.time() - self.started:.0f}s"]
+        for (name, label), value in sorted(self.counter_values().items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            lines.append(f"  {name}{f'[{label}]' if label is not None else ''}: {value}")
+        for name, value in sorted(self.gauge_values().items()):
+            lines.append(f"  {name}: {value}")
+        for name in self.histogram_names():
+            summary = self.histogram(name).summary()
+            lines.append(f"  {name}: count {summary['count']}, p50 {summary['p50_ms']}ms, "
+                         f"p99 {summary['p99_ms']}ms, p999 {summary['p999_ms']}ms, max {summary['max_ms']}ms")
+        return '\n'.join(lines)
+
+    def render_prometheus(self):
+        lines = []
+        counters = {}
+        for (name, label), value in self.counter_values().items():
+            counters.setdefault(name, []).append((label, value))
+        for name in sorted(counters):
+            metric = f"{self.prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for label, value in sorted(counters[name], key=lambda item: str(item[0])):
+                labels = f'{{kind="{label}"}}' if label is not None else ''
+                lines.append(f"{metric}{labels} {value}")
+        for name, value in sorted(self.gauge_values().items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        for name in self.histogram_names():
+            histogram = self.histogram(name)
+            metric = f"{self.prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for quantile in HANDLING_QUANTILES:
+                lines.append(f'{metric}{{quantile="{quantile / 100:g}"}} {histogram.percentile(quantile):.6f}')
+            lines.append(f"{metric}_sum {histogram.total:.6f}")
+            lines.append(f"{metric}_count {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, host, port):
+        # Prometheus-совместимая текстовая выдача на GET /metrics
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
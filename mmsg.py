@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+from errno import EAGAIN, EINTR
+import os
+import socket
+import struct
+
+# Пакетные прием и отправка UDP через recvmmsg(2)/sendmmsg(2): один системный вызов
+# на много датаграмм. Если libc их не предоставляет (не Linux), используются циклы
+# recvfrom_into/sendto.
+
+MAX_BATCH = 1024  # UIO_MAXIOV
+MSG_WAITFORONE = 0x10000
+SOCKADDR_STORAGE_SIZE = 128
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+def load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        libc.sendmmsg.restype = ctypes.c_int
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.recvmmsg.restype = ctypes.c_int
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+libc = load_libc()
+HAVE_SENDMMSG = libc is not None
+HAVE_RECVMMSG = libc is not None
+
+def pack_sockaddr(address):
+    # Кодирует адрес из recvfrom в struct sockaddr_in / sockaddr_in6
+    if len(address) == 2:
+        return (struct.pack('=H', socket.AF_INET) + struct.pack('!H', address[1])
+                + socket.inet_pton(socket.AF_INET, address[0]) + b'\0' * 8)
+    host, port, flowinfo, scope_id = address
+    return (struct.pack('=H', socket.AF_INET6) + struct.pack('!HI', port, flowinfo)
+            + socket.inet_pton(socket.AF_INET6, host) + struct.pack('=I', scope_id))
+
+def unpack_sockaddr(raw):
+    family = struct.unpack_from('=H', raw)[0]
+    if family == socket.AF_INET:
+        port = struct.unpack_from('!H', raw, 2)[0]
+        return socket.inet_ntop(socket.AF_INET, raw[4:8]), port
+    port, flowinfo = struct.unpack_from('!HI', raw, 2)
+    scope_id = struct.unpack_from('=I', raw, 24)[0]
+    return socket.inet_ntop(socket.AF_INET6, raw[8:24]), port, flowinfo, scope_id
+
+class SockaddrCache:
+    # Упакованные адреса клиентов переиспользуются между рассылками
+    def __init__(self):
+        self.cache = {}
+
+    def get(self, address):
+        packed = self.cache.get(address)
+        if packed is None:
+            raw = pack_sockaddr(address)
+            packed = ctypes.create_string_buffer(raw, len(raw))
+            self.cache[address] = packed
+        return packed
+
+    def discard(self, address):
+        self.cache.pop(address, None)
+
+def sendmmsg(sock, datagrams, addresses=None, on_error=None):
+    # datagrams: [(data, address)]. Возвращает число отправленных датаграмм.
+    # on_error(index, error) вызывается при ошибке отправки датаграммы index и возвращает
+    # индекс, с которого продолжить; без него ошибка прерывает отправку всей пачки
+    if not datagrams:
+        return 0
+    if not HAVE_SENDMMSG:
+        sent_total = 0
+        index = 0
+        while index < len(datagrams):
+            data, address = datagrams[index]
+            try:
+                sock.sendto(data, address)
+            except OSError as e:
+                if on_error is None:
+                    raise
+                index = on_error(index, e)
+                continue
+            sent_total += 1
+            index += 1
+        return sent_total
+
+    if addresses is None:
+        addresses = SockaddrCache()
+    sent_total = 0
+    offset = 0
+    while offset < len(datagrams):
+        chunk = datagrams[offset:offset + MAX_BATCH]
+        count = len(chunk)
+        messages = (mmsghdr * count)()
+        vectors = (iovec * count)()
+        keep = []  # буферы должны жить до конца системного вызова
+        payloads = {}
+        for index, (data, address) in enumerate(chunk):
+            # одинаковый payload (рассылка) передается ядру одним и тем же буфером
+            buffer = payloads.get(id(data))
+            if buffer is None:
+                buffer = ctypes.c_char_p(bytes(data))
+                payloads[id(data)] = buffer
+                keep.append(data)
+            name = addresses.get(address)
+            vectors[index].iov_base = ctypes.cast(buffer, ctypes.c_void_p)
+            vectors[index].iov_len = len(data)
+            header = messages[index].msg_hdr
+            header.msg_name = ctypes.cast(name, ctypes.c_void_p)
+            header.msg_namelen = len(name.raw)
+            header.msg_iov = ctypes.pointer(vectors[index])
+            header.msg_iovlen = 1
+
+        done = 0
+        while done < count:
+            result = libc.sendmmsg(sock.fileno(),
+                                   ctypes.addressof(messages) + done * ctypes.sizeof(mmsghdr),
+                                   count - done, 0)
+            if result < 0:
+                errno = ctypes.get_errno()
+                error = OSError(errno, os.strerror(errno))
+                if on_error is None:
+                    raise error
+                break
+            done += result
+        sent_total += done
+        if done < count:
+            # ошибка на датаграмме offset + done: остаток пачки собирается заново
+            offset = on_error(offset + done, error)
+        else:
+            offset += count
+    return sent_total
+
+
+class RecvBatch:
+    # Заранее выделенные буферы для приема до batch_size датаграмм за один вызов
+    def __init__(self, batch_size=64, buffer_size=2048):
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.data = bytearray(batch_size * buffer_size)
+        self.view = memoryview(self.data)
+        if HAVE_RECVMMSG:
+            self.storage = (ctypes.c_char * (batch_size * buffer_size)).from_buffer(self.data)
+            self.names = ctypes.create_string_buffer(batch_size * SOCKADDR_STORAGE_SIZE)
+            self.vectors = (iovec * batch_size)()
+            self.messages = (mmsghdr * batch_size)()
+            base = ctypes.addressof(self.storage)
+            names = ctypes.addressof(self.names)
+            for index in range(batch_size):
+                self.vectors[index].iov_base = base + index * buffer_size
+                self.vectors[index].iov_len = buffer_size
+                header = self.messages[index].msg_hdr
+                header.msg_iov = ctypes.pointer(self.vectors[index])
+                header.msg_iovlen = 1
+                header.msg_name = names + index * SOCKADDR_STORAGE_SIZE
+
+    def receive(self, sock, wait=True):
+        # Возвращает [(bytes, address)]. При wait=True ждет хотя бы одну датаграмму,
+        # затем забирает без ожидания все, что уже пришло
+        if not HAVE_RECVMMSG:
+            return self.receive_loop(sock, wait)
+
+        for index in range(self.batch_size):
+            header = self.messages[index].msg_hdr
+            header.msg_namelen = SOCKADDR_STORAGE_SIZE
+            header.msg_flags = 0
+        flags = MSG_WAITFORONE if wait else socket.MSG_DONTWAIT
+        count = libc.recvmmsg(sock.fileno(), ctypes.addressof(self.messages), self.batch_size, flags, None)
+        if count < 0:
+            errno = ctypes.get_errno()
+            if errno in (EAGAIN, EINTR):
+                return []
+            raise OSError(errno, os.strerror(errno))
+
+        datagrams = []
+        names = ctypes.addressof(self.names)
+        for index in range(count):
+            message = self.messages[index]
+            offset = index * self.buffer_size
+            raw_name = ctypes.string_at(names + index * SOCKADDR_STORAGE_SIZE, message.msg_hdr.msg_namelen)
+            datagrams.append((bytes(self.view[offset:offset + message.msg_len]), unpack_sockaddr(raw_name)))
+        return datagrams
+
+    def receive_loop(self, sock, wait):
+        datagrams = []
+        flags = 0 if wait else socket.MSG_DONTWAIT
+        for index in range(self.batch_size):
+            buffer = self.view[index * self.buffer_size:(index + 1) * self.buffer_size]
+            try:
+                size, address = sock.recvfrom_into(buffer, self.buffer_size, flags)
+            except (BlockingIOError, InterruptedError):
+                break
+            datagrams.append((bytes(buffer[:size]), address))
+            flags = socket.MSG_DONTWAIT
+        return datagrams
@@ -1,35 +1,196 @@
 #!/usr/bin/env python3
 
 import argparse
-from tcp_communication import TCPServer, TCPClient
+import console
+from framing import DEFAULT_MAX_MESSAGE_SIZE
+from compression import DEFAULT_COMPRESS_THRESHOLD
+from tls import TLSClient, server_context
+from heartbeat import DEFAULT_CLIENT_TIMEOUT, DEFAULT_HEARTBEAT_INTERVAL
+from ratelimit import AdmissionControl
+from outbound import DEFAULT_MAX_QUEUE_BYTES, DEFAULT_MAX_QUEUE_MESSAGES, DEFAULT_POLICY, POLICIES
+from bench import Benchmark, DEFAULT_LARGE_SIZE, SCENARIOS
+from capture import CaptureAnalysis, DEFAULT_FLOWS, DEFAULT_MESSAGES
+from recording import INDEX_SUFFIX, PROTOCOL_UDP, read_protocol
+from replay import Replay
+from tcp_communication import TCPServer, TCPClient, DEFAULT_BACKLOG
+from tcp_async import AsyncTCPServer
+from tcp_prefork import PreforkTCPServer
 from udp_communication import UDPServer, UDPClient
 
 def main():
     parser = argparse.ArgumentParser(description='Network Application - TCP/UDP Client/Server')
-    parser.add_argument('--mode', choices=['tcp-server', 'tcp-client', 'udp-server', 'udp-client'],
+    parser.add_argument('--mode', choices=['tcp-server', 'tcp-server-async', 'tcp-server-prefork', 'tcp-client', 'udp-server', 'udp-client', 'bench', 'analyze', 'replay'],
                        required=True, help='Operation mode')
     parser.add_argument('--host', default='localhost', help='Host address')
     parser.add_argument('--port', type=int, default=8888, help='Port number')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_BACKLOG,
+                       help=f"Listen backlog for TCP servers (default: {DEFAULT_BACKLOG})")
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Worker processes for tcp-server-prefork (default: CPU count)')
+    parser.add_argument('--max-message-size', type=int, default=DEFAULT_MAX_MESSAGE_SIZE,
+                       help='Maximum size of one TCP message in bytes')
+    parser.add_argument('--max-queue-bytes', type=int, default=DEFAULT_MAX_QUEUE_BYTES,
+                       help='Per-client outbound queue limit in bytes')
+    parser.add_argument('--max-queue-messages', type=int, default=DEFAULT_MAX_QUEUE_MESSAGES,
+                       help='Per-client outbound queue limit in messages')
+    parser.add_argument('--queue-policy', choices=POLICIES, default=DEFAULT_POLICY,
+                       help='What to do when a client falls behind and its queue is full')
+    parser.add_argument('--udp-batch', type=int, default=0,
+                       help='udp-server: receive/send up to N datagrams per system call (recvmmsg/sendmmsg)')
+    parser.add_argument('--client-timeout', type=float, default=None,
+                       help=f"Servers: disconnect (TCP) or forget (UDP) clients silent for this many seconds, "
+                            f"0 - never (default: {DEFAULT_CLIENT_TIMEOUT} for udp-server, never for TCP servers)")
+    parser.add_argument('--heartbeat-interval', type=float, default=DEFAULT_HEARTBEAT_INTERVAL,
+                       help=f"tcp-client/udp-client: send /heartbeat after this many idle seconds and detect "
+                            f"a dead server, 0 - off (default: {DEFAULT_HEARTBEAT_INTERVAL:g})")
+    parser.add_argument('--reliable', action='store_true',
+                       help='udp: ordered delivery with acknowledgements and retransmissions')
+    parser.add_argument('--loss', type=float, default=0.0,
+                       help='udp --reliable: drop this fraction of outgoing packets (testing)')
+    parser.add_argument('--binary', action='store_true',
+                       help='Switch tcp-client to length-prefixed binary frames after welcome')
+    parser.add_argument('--compress', action='store_true',
+                       help='tcp-client/udp-client: ask the server to zlib-compress large messages')
+    parser.add_argument('--compress-threshold', type=int, default=DEFAULT_COMPRESS_THRESHOLD,
+                       help='Servers: compress messages of at least this many bytes for clients that ask')
+    parser.add_argument('--tls-cert', default=None,
+                       help='TCP servers: serve TLS with this certificate (PEM)')
+    parser.add_argument('--tls-key', default=None,
+                       help='TCP servers: private key for --tls-cert (if not in the same file)')
+    parser.add_argument('--tls', action='store_true',
+                       help='tcp-client/bench/replay: connect over TLS, resuming sessions on reconnect')
+    parser.add_argument('--tls-ca', default=None,
+                       help='tcp-client/bench/replay: trust this CA or self-signed certificate instead of the system store')
+    parser.add_argument('--rate-limit', type=float, default=0,
+                       help='Servers: messages per second per client, 0 - no limit')
+    parser.add_argument('--rate-limit-bytes', type=float, default=0,
+                       help='Servers: bytes per second per client, 0 - no limit')
+    parser.add_argument('--global-rate-limit', type=float, default=0,
+                       help='Servers: messages per second for the whole server, excess answered "Server busy"')
+    parser.add_argument('--global-rate-limit-bytes', type=float, default=0,
+                       help='Servers: bytes per second for the whole server, excess answered "Server busy"')
+    parser.add_argument('--max-connections', type=int, default=0,
+                       help='Servers: reject clients beyond this many, 0 - no limit')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                       help='Serve Prometheus-style metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--headless', action='store_true',
+                       help='Servers: no interactive console, run until SIGTERM/SIGINT (for systemd)')
+    parser.add_argument('--control-socket', default=None,
+                       help='Servers: accept send/broadcast/publish/list/channels/metrics commands on this Unix socket')
+    parser.add_argument('--log-level', choices=console.LOG_LEVELS, default='info',
+                       help='Servers: minimum level of console log messages')
+    parser.add_argument('--log-rate', type=int, default=console.DEFAULT_LOG_RATE,
+                       help='Servers: log at most N client messages per second, 0 - no limit')
+    parser.add_argument('--bench-target', choices=['tcp', 'udp'], default='tcp',
+                       help='bench: protocol of the running server')
+    parser.add_argument('--bench-scenarios', default='ping,echo,churn,large',
+                       help=f"bench: comma-separated scenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument('--bench-clients', type=int, default=10, help='bench: concurrent clients')
+    parser.add_argument('--bench-duration', type=float, default=5.0, help='bench: seconds per scenario')
+    parser.add_argument('--bench-size', type=int, default=64, help='bench: echo message size in bytes')
+    parser.add_argument('--bench-window', type=int, default=16, help='bench: echo messages in flight per client')
+    parser.add_argument('--bench-large-size', type=int, default=DEFAULT_LARGE_SIZE,
+                       help='bench: message size for the large scenario')
+    parser.add_argument('--bench-output', default=None, help='bench: save results to this JSON file')
+    parser.add_argument('--capture', nargs='+', default=None,
+                       help='analyze: pcapng/pcap files (default: the captures in net_dump)')
+    parser.add_argument('--analyze-port', type=int, action='append', default=None,
+                       help='analyze: only flows with this port, may be repeated (default: all TCP/UDP)')
+    parser.add_argument('--analyze-flows', type=int, default=DEFAULT_FLOWS,
+                       help=f"analyze: report details of this many largest flows (default: {DEFAULT_FLOWS})")
+    parser.add_argument('--analyze-messages', type=int, default=DEFAULT_MESSAGES,
+                       help=f"analyze: show the first N messages of each reported flow (default: {DEFAULT_MESSAGES})")
+    parser.add_argument('--analyze-output', default=None, help='analyze: save the report to this JSON file')
+    parser.add_argument('--record', default=None,
+                       help='Servers: append every inbound message to this traffic log for --mode replay '
+                            '(tcp-server-prefork writes FILE.<worker> per worker)')
+    parser.add_argument('--replay-log', nargs='+', default=None,
+                       help='replay: traffic logs written with --record (several are merged by time)')
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                       help='replay: speed relative to the recording, 0 - as fast as possible')
+    parser.add_argument('--replay-start', type=float, default=0.0,
+                       help='replay: skip this many seconds from the start of the recording')
     
     args = parser.parse_args()
     
     port = args.port
     # меняем порт для udp соединения, чтобы не было конфликтов с tcp соединением
-    if args.mode.startswith('udp') and args.port == 8888:
+    if (args.mode.startswith('udp') or args.mode == 'bench' and args.bench_target == 'udp') and args.port == 8888:
         port = 8889
+    if args.mode == 'replay':
+        # индексы попадают в список при подстановке вроде traffic.log.*
+        replay_logs = [path for path in args.replay_log or [] if not path.endswith(INDEX_SUFFIX)]
+        if not replay_logs:
+            parser.error("--mode replay requires --replay-log")
+        try:
+            if read_protocol(replay_logs[0]) == PROTOCOL_UDP and args.port == 8888:
+                port = 8889
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    if 'server' in args.mode:
+        console.configure(args.log_level, args.log_rate, args.headless)
+    tls_context = server_context(args.tls_cert, args.tls_key) if args.tls_cert else None
+    tls_client = TLSClient(args.tls_ca) if args.tls or args.tls_ca else None
+    limits = (args.rate_limit, args.rate_limit_bytes, args.global_rate_limit, args.global_rate_limit_bytes,
+              args.max_connections)
+    admission = AdmissionControl(*limits) if any(limits) else None
+    client_timeout = args.client_timeout
+    if client_timeout is None:
+        # молчащих TCP-клиентов сервер по умолчанию не отключает
+        client_timeout = DEFAULT_CLIENT_TIMEOUT if args.mode == 'udp-server' else 0
     
     if args.mode == 'tcp-server':
-        server = TCPServer(args.host, port)
+        server = TCPServer(args.host, port, args.max_message_size, args.max_queue_bytes,
+                           args.max_queue_messages, args.queue_policy, args.metrics_port,
+                           args.headless, args.control_socket, args.compress_threshold, tls_context,
+                           client_timeout, args.backlog, admission, args.record)
+        server.start()
+    elif args.mode == 'tcp-server-async':
+        server = AsyncTCPServer(args.host, port, args.backlog, args.max_message_size,
+                                args.max_queue_bytes, args.max_queue_messages, args.queue_policy,
+                                args.metrics_port, args.headless, args.control_socket,
+                                args.compress_threshold, tls_context, client_timeout, admission,
+                                args.record)
+        server.start()
+    elif args.mode == 'tcp-server-prefork':
+        server = PreforkTCPServer(args.host, port, args.workers, args.backlog,
+                                  args.max_message_size, args.max_queue_bytes,
+                                  args.max_queue_messages, args.queue_policy, args.metrics_port,
+                                  args.headless, args.control_socket, args.compress_threshold,
+                                  tls_context, client_timeout, admission, args.record)
         server.start()
     elif args.mode == 'tcp-client':
-        client = TCPClient(args.host, port)
+        client = TCPClient(args.host, port, args.max_message_size, args.binary, args.compress,
+                           tls_client, args.heartbeat_interval)
         client.start()
     elif args.mode == 'udp-server':
-        server = UDPServer(args.host, port)
+        server = UDPServer(args.host, port, args.udp_batch, client_timeout,
+                           args.reliable, args.loss, args.metrics_port, args.headless,
+                           args.control_socket, args.compress_threshold, admission, args.record)
         server.start()
     elif args.mode == 'udp-client':
-        client = UDPClient(args.host, port)
+        client = UDPClient(args.host, port, args.reliable, args.loss, args.compress,
+                           args.heartbeat_interval)
         client.start()
+    elif args.mode == 'bench':
+        benchmark = Benchmark(args.host, port, args.bench_target,
+                              [name.strip() for name in args.bench_scenarios.split(',') if name.strip()],
+                              args.bench_clients, args.bench_duration, args.bench_size,
+                              args.bench_window, args.bench_large_size, args.bench_output,
+                              tls_client)
+        benchmark.start()
+    elif args.mode == 'analyze':
+        analysis = CaptureAnalysis(args.capture, args.analyze_port, args.analyze_flows,
+                                   args.analyze_messages, args.analyze_output)
+        analysis.start()
+    elif args.mode == 'replay':
+        try:
+            replay = Replay(args.host, port, replay_logs, args.replay_speed, args.replay_start,
+                            tls_client)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        replay.start()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+
+import asyncio
+import collections
+import os
+import select
+import selectors
+import socket
+import threading
+
+DEFAULT_MAX_QUEUE_BYTES = 4 * 1024 * 1024
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') else 1024
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+# отложенная (коалесцированная) запись все равно выполняется при таком объеме очереди
+COALESCE_BYTES = 64 * 1024
+COALESCE_MESSAGES = IOV_MAX // 2
+
+class QueueOverflowError(Exception):
+    pass
+
+POLICY_BLOCK = 'block'
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_DISCONNECT = 'disconnect'
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DISCONNECT)
+
+DEFAULT_MAX_QUEUE_MESSAGES = 65536
+DEFAULT_POLICY = POLICY_DISCONNECT
+DEFAULT_BLOCK_TIMEOUT = 10.0
+
+class Outbox:
+    # Очередь исходящих сообщений одного клиента. Сообщение - список memoryview на общие
+    # буферы: сообщение рассылки кодируется один раз и не копируется для каждого клиента.
+    # Отправка неблокирующая (MSG_DONTWAIT), остаток досылает поток BroadcastEngine.
+    # Пока в очереди есть данные, новые сообщения только добавляются, и следующий flush
+    # отправляет их все одним sendmsg.
+    # С TLS очередь хранит открытый текст и шифрует его при отправке (tls.py): так порядок
+    # записей TLS совпадает с порядком отправки, а drop-oldest выбрасывает только
+    # еще не зашифрованные сообщения.
+    def __init__(self, engine, sock, key=None, max_queue_bytes=DEFAULT_MAX_QUEUE_BYTES,
+                 max_queue_messages=DEFAULT_MAX_QUEUE_MESSAGES, policy=DEFAULT_POLICY,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT, tls=None):
+        self.engine = engine
+        self.sock = sock
+        self.key = key
+        self.fd = sock.fileno()
+        self.max_queue_bytes = max_queue_bytes
+        self.max_queue_messages = max_queue_messages
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.messages = collections.deque()
+        self.queued_bytes = 0
+        self.head_started = False  # первое сообщение уже отправлено частично
+        self.waiting_write = False  # остаток очереди ждет готовности сокета в BroadcastEngine
+        self.tls = tls
+        self.encrypted = bytearray()  # TLS: зашифрованный, но еще не отправленный остаток
+        self.dropped_messages = 0
+        self.lock = threading.RLock()
+        self.space = threading.Condition(self.lock)
+        self.lagging = False
+        self.closed = False
+
+    def depth(self):
+        return len(self.messages), self.queued_bytes
+
+    def push(self, buffers, flush=True):
+        views = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer)]
+        size = sum(len(view) for view in views)
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("connection is closed")
+            self.make_room(size)
+            self.messages.append(views)
+            self.queued_bytes += size
+            # если очередь уже ждет готовности сокета, сообщение уйдет вместе с ней
+            if not flush:
+                flush = (self.queued_bytes >= COALESCE_BYTES
+                         or len(self.messages) >= COALESCE_MESSAGES)
+            if flush and not self.waiting_write:
+                self.flush()
+            else:
+                self.update_lagging()
+
+    def is_full(self, size):
+        # Пустая очередь принимает сообщение любого размера
+        if not self.messages:
+            return False
+        return (self.queued_bytes + size > self.max_queue_bytes
+                or len(self.messages) >= self.max_queue_messages)
+
+    def make_room(self, size):
+        if not self.is_full(size):
+            return
+        if self.policy == POLICY_DROP_OLDEST:
+            # частично отправленное сообщение выбросить нельзя - поток бы развалился
+            keep = 1 if self.head_started else 0
+            while self.is_full(size) and len(self.messages) > keep:
+                dropped = self.messages[keep]
+                del self.messages[keep]
+                self.queued_bytes -= sum(len(view) for view in dropped)
+                self.dropped_messages += 1
+            if not self.is_full(size):
+                return
+        elif self.policy == POLICY_BLOCK:
+            if self.space.wait_for(lambda: self.closed or not self.is_full(size), self.block_timeout):
+                if self.closed:
+                    raise ConnectionError("connection is closed")
+                return
+        raise QueueOverflowError(
+            f"outbound queue is over {self.max_queue_bytes} bytes / {self.max_queue_messages} messages"
+        )
+
+    def flush(self):
+        # Возвращает True, если очередь опустела
+        with self.lock:
+            try:
+                if self.tls is not None:
+                    self.send_encrypted()
+                else:
+                    self.send_plain()
+            except OSError:
+                self.close_locked()
+                self.engine.connection_failed(self)
+                return True
+
+            self.update_lagging()
+            self.space.notify_all()
+            if self.messages or self.encrypted:
+                if not self.waiting_write:
+                    self.waiting_write = True
+                    self.engine.want_write(self)
+                return False
+            self.waiting_write = False
+            return True
+
+    def send_plain(self):
+        while self.messages and not self.closed:
+            batch = []
+            for message in self.messages:
+                if len(batch) + len(message) > IOV_MAX:
+                    break
+                batch.extend(message)
+            try:
+                sent = self.sock.sendmsg(batch, [], MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            self.consume(sent)
+
+    def send_encrypted(self):
+        while (self.messages or self.encrypted) and not self.closed:
+            if not self.encrypted:
+                # следующая порция шифруется, только когда предыдущая ушла целиком,
+                # иначе очередь не ограничивала бы медленного клиента
+                plaintext = [view for message in self.messages for view in message]
+                self.messages.clear()
+                self.encrypted = bytearray(self.tls.encrypt(plaintext))
+                self.queued_bytes = len(self.encrypted)
+            try:
+                sent = self.sock.send(self.encrypted, MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            del self.encrypted[:sent]
+            self.queued_bytes -= sent
+
+    def consume(self, sent):
+        self.queued_bytes -= sent
+        while sent:
+            head = self.messages[0]
+            while head and sent >= len(head[0]):
+                sent -= len(head.pop(0))
+            if head and sent:
+                head[0] = head[0][sent:]
+                sent = 0
+            if head:
+                self.head_started = True
+            else:
+                self.messages.popleft()
+                self.head_started = False
+
+    def update_lagging(self):
+        self.lagging = (self.queued_bytes > self.max_queue_bytes // 2
+                        or len(self.messages) > self.max_queue_messages // 2)
+
+    def drain(self, timeout):
+        # Блокирующая досылка очереди, например перед закрытием соединения по quit
+        poller = select.poll()
+        poller.register(self.fd, select.POLLOUT)
+        with self.lock:
+            while not self.flush():
+                if not poller.poll(timeout * 1000):
+                    return False
+            return True
+
+    def close_locked(self):
+        self.closed = True
+        self.messages.clear()
+        self.encrypted.clear()
+        self.queued_bytes = 0
+        self.space.notify_all()
+
+    def close(self):
+        with self.lock:
+            self.close_locked()
+        # поток движка снимет сокет с epoll
+        self.engine.want_write(self)
+
+class BroadcastEngine:
+    # Один поток на весь сервер ждет готовности сокетов к записи (epoll) и досылает
+    # очереди клиентов, которые не смогли принять данные сразу
+    def __init__(self, on_failure=None, max_queue_bytes=DEFAULT_MAX_QUEUE_BYTES,
+                 max_queue_messages=DEFAULT_MAX_QUEUE_MESSAGES, policy=DEFAULT_POLICY):
+        self.on_failure = on_failure
+        self.max_queue_bytes = max_queue_bytes
+        self.max_queue_messages = max_queue_messages
+        self.policy = policy
+        self.selector = selectors.DefaultSelector()
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup()
+        if self.thread:
+            self.thread.join(timeout=2)
+
+    def register(self, sock, key=None, tls=None):
+        return Outbox(self, sock, key, self.max_queue_bytes, self.max_queue_messages, self.policy,
+                      tls=tls)
+
+    def want_write(self, outbox):
+        with self.pending_lock:
+            self.pending.add(outbox)
+        self.wakeup()
+
+    def connection_failed(self, outbox):
+        if self.on_failure:
+            self.on_failure(outbox)
+
+    def wakeup(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def run(self):
+        while self.running:
+            with self.pending_lock:
+                pending, self.pending = self.pending, set()
+            for outbox in pending:
+                if outbox.closed:
+                    self.unregister(outbox)
+                    continue
+                try:
+                    self.selector.register(outbox.fd, selectors.EVENT_WRITE, outbox)
+                except KeyError:
+                    # дескриптор мог достаться новому соединению после закрытия старого
+                    if self.selector.get_key(outbox.fd).data is not outbox:
+                        self.selector.unregister(outbox.fd)
+                        self.selector.register(outbox.fd, selectors.EVENT_WRITE, outbox)
+                except (ValueError, OSError):
+                    continue
+
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.fileobj is self.wakeup_reader:
+                    try:
+                        while self.wakeup_reader.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+
+                outbox = key.data
+                if outbox.closed or outbox.flush():
+                    self.unregister(outbox)
+
+    def unregister(self, outbox):
+        try:
+            if self.selector.get_key(outbox.fd).data is outbox:
+                self.selector.unregister(outbox.fd)
+        except (KeyError, ValueError, OSError):
+            pass
+
+class AsyncOutbox:
+    # Та же очередь для asyncio-сервера. Транспорту отдается не больше high_water байт,
+    # остальное ждет здесь, чтобы к очереди можно было применить политику переполнения.
+    def __init__(self, writer, max_queue_bytes=DEFAULT_MAX_QUEUE_BYTES,
+                 max_queue_messages=DEFAULT_MAX_QUEUE_MESSAGES, policy=DEFAULT_POLICY,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT, high_water=64 * 1024):
+        self.writer = writer
+        self.transport = writer.transport
+        self.transport.set_write_buffer_limits(high=high_water)
+        self.max_queue_bytes = max_queue_bytes
+        self.max_queue_messages = max_queue_messages
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.messages = collections.deque()
+        self.queued_bytes = 0
+        self.dropped_messages = 0
+        self.binary = False
+        self.compressor = None
+        self.closed = False
+        self.ready = asyncio.Event()
+        self.space = asyncio.Event()
+        self.order = asyncio.Lock()
+        self.task = asyncio.ensure_future(self.run())
+
+    def depth(self):
+        return len(self.messages), self.queued_bytes + self.transport.get_write_buffer_size()
+
+    @property
+    def lagging(self):
+        queued_messages, queued_bytes = self.depth()
+        return (queued_bytes > self.max_queue_bytes // 2
+                or queued_messages > self.max_queue_messages // 2)
+
+    def is_full(self, size):
+        if not self.messages:
+            return False
+        _, queued_bytes = self.depth()
+        return (queued_bytes + size > self.max_queue_bytes
+                or len(self.messages) >= self.max_queue_messages)
+
+    async def push_outgoing(self, outgoing, shared=None):
+        # Формат выбирается под той же блокировкой, что и переключение в бинарный режим;
+        # возвращает отправленные буферы
+        text, header, payload = outgoing
+        async with self.order:
+            if not self.binary:
+                buffers = [text]
+            elif self.compressor is None:
+                buffers = [header, payload]
+            else:
+                buffers = self.compressor.shared_frame(outgoing, shared)
+            await self.push_locked(buffers)
+        return buffers
+
+    async def switch_binary(self, ack, compressor=None):
+        async with self.order:
+            await self.push_locked([ack])
+            self.binary = True
+            self.compressor = compressor
+
+    async def push(self, buffers):
+        async with self.order:
+            await self.push_locked(buffers)
+
+    async def push_locked(self, buffers):
+        size = sum(len(buffer) for buffer in buffers)
+        if self.closed:
+            raise ConnectionError("connection is closed")
+        if self.is_full(size):
+            if self.policy == POLICY_DROP_OLDEST:
+                while self.is_full(size) and self.messages:
+                    dropped = self.messages.popleft()
+                    self.queued_bytes -= sum(len(buffer) for buffer in dropped)
+                    self.dropped_messages += 1
+            elif self.policy == POLICY_BLOCK:
+                try:
+                    await asyncio.wait_for(self.wait_space(size), self.block_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if self.is_full(size):
+                raise QueueOverflowError(
+                    f"outbound queue is over {self.max_queue_bytes} bytes / {self.max_queue_messages} messages"
+                )
+        self.messages.append(buffers)
+        self.queued_bytes += size
+        self.ready.set()
+
+    async def wait_space(self, size):
+        while self.is_full(size) and not self.closed:
+            self.space.clear()
+            await self.space.wait()
+
+    async def run(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.messages and not self.closed:
+                    # все накопленные сообщения уходят в транспорт одной записью
+                    batch = []
+                    while self.messages:
+                        message = self.messages.popleft()
+                        self.queued_bytes -= sum(len(buffer) for buffer in message)
+                        batch.extend(message)
+                    self.writer.writelines(batch)
+                    self.space.set()
+                    await self.writer.drain()
+                    self.space.set()
+        except (ConnectionError, OSError):
+            self.close()
+
+    async def drain(self, timeout):
+        async with self.order:
+            try:
+                await asyncio.wait_for(self.wait_empty(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_empty(self):
+        while self.messages:
+            self.space.clear()
+            await self.space.wait()
+        await self.writer.drain()
+
+    def close(self):
+        self.closed = True
+        self.messages.clear()
+        self.queued_bytes = 0
+        self.ready.set()
+        self.space.set()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+# Ограничение нагрузки (admission control). Лимиты - ведра токенов на сообщения и на
+# байты в секунду, отдельно для каждого клиента и общие для сервера, плюс предел числа
+# соединений. Превышение лимита клиента у TCP приостанавливает чтение его соединения
+# (отправителя тормозит сам TCP), у UDP - отклоняет сообщение. Превышение общего
+# лимита отклоняет сообщение ответом "Server busy" - сервер сбрасывает лишнюю
+# нагрузку, а не копит ее в очередях.
+
+BUSY_PREFIX = "Server busy"
+TOO_MANY_CONNECTIONS = f"{BUSY_PREFIX}: too many connections"
+BURST_SECONDS = 1.0  # емкость ведра - лимит за столько секунд
+
+def busy_message(reason):
+    if reason == 'max_connections':
+        return TOO_MANY_CONNECTIONS
+    return f"{BUSY_PREFIX}: {reason.replace('_', ' ')} limit exceeded, message dropped"
+
+class TokenBucket:
+    # Пополняется лениво при обращении - без таймеров. Сообщение проходит, если
+    # баланс положительный, и может увести его в минус: сообщение больше емкости ведра
+    # не блокируется навсегда, а следующие ждут, пока долг не погасится
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate * BURST_SECONDS
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        self.refill(now)
+        return 0.0 if self.tokens > 0 else (1 - self.tokens) / self.rate
+
+class RateLimiter:
+    # Пара ведер: сообщения и байты в секунду, 0 - без лимита
+    def __init__(self, messages=0, size=0, shared=False):
+        self.messages = TokenBucket(messages) if messages else None
+        self.bytes = TokenBucket(size) if size else None
+        # общий лимит потокового TCP-сервера меняют потоки всех клиентов
+        self.lock = threading.Lock() if shared else None
+
+    def wait_time(self):
+        # (секунд до разрешения, исчерпанное ведро)
+        now = time.monotonic()
+        if self.messages is not None:
+            wait = self.messages.wait_time(now)
+            if wait:
+                return wait, 'messages'
+        if self.bytes is not None:
+            wait = self.bytes.wait_time(now)
+            if wait:
+                return wait, 'bytes'
+        return 0.0, None
+
+    def take(self, size):
+        if self.messages is not None:
+            self.messages.tokens -= 1
+        if self.bytes is not None:
+            self.bytes.tokens -= size
+
+    def try_take(self, size):
+        # None - сообщение пропущено, иначе исчерпанное ведро
+        if self.lock is None:
+            return self.try_take_locked(size)
+        with self.lock:
+            return self.try_take_locked(size)
+
+    def try_take_locked(self, size):
+        wait, bucket = self.wait_time()
+        if wait:
+            return bucket
+        self.take(size)
+        return None
+
+class AdmissionControl:
+    def __init__(self, client_messages=0, client_bytes=0, global_messages=0, global_bytes=0,
+                 max_connections=0):
+        self.client_messages = client_messages
+        self.client_bytes = client_bytes
+        self.global_messages = global_messages
+        self.global_bytes = global_bytes
+        self.max_connections = max_connections
+        self.total = RateLimiter(global_messages, global_bytes, shared=True) \
+            if global_messages or global_bytes else None
+
+    def per_worker(self, workers):
+        # у prefork каждый воркер ограничивает свою долю общего лимита
+        return AdmissionControl(self.client_messages, self.client_bytes,
+                                self.global_messages / workers, self.global_bytes / workers,
+                                self.max_connections)
+
+    def client_limiter(self):
+        if not self.client_messages and not self.client_bytes:
+            return None
+        return RateLimiter(self.client_messages, self.client_bytes)
+
+    def over_capacity(self, connected):
+        return bool(self.max_connections) and connected >= self.max_connections
+
+    def admit(self, size):
+        # общий лимит сервера: None или причина отказа ('global_messages', 'global_bytes')
+        if self.total is None:
+            return None
+        bucket = self.total.try_take(size)
+        return None if bucket is None else f"global_{bucket}"
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import bisect
+import os
+import struct
+import threading
+import time
+from console import log
+
+# Запись входящего трафика сервера (--record) для воспроизведения (--mode replay).
+# Журнал только дописывается:
+#   заголовок: [b'NETREC'][версия: 1][протокол: b't' - TCP, b'u' - UDP]
+#   запись:    [время, мкс: 8][id клиента: 4][событие: 1][тип кадра: 1][длина: 4][payload]
+# Тип кадра 0 - строка TCP без '\n' или сообщение UDP (после сборки фрагментов), иначе
+# тип кадра бинарного режима (framing.py). Рядом лежит индекс <журнал>.idx: раз в
+# секунду записи - пара (время, смещение записи в журнале); по нему воспроизведение
+# начинается с нужного момента, не читая журнал с начала. Сервер, перезапущенный с
+# тем же --record, продолжает журнал, сначала отрезав оборванную при аварии запись.
+
+RECORD_MAGIC = b'NETREC'
+RECORD_VERSION = 1
+PROTOCOL_TCP = b't'
+PROTOCOL_UDP = b'u'
+LOG_HEADER_SIZE = len(RECORD_MAGIC) + 2
+RECORD_HEADER = struct.Struct('!QIBBI')
+INDEX_ENTRY = struct.Struct('!QQ')
+INDEX_SUFFIX = '.idx'
+INDEX_INTERVAL = 1_000_000  # мкс между записями индекса
+FLUSH_INTERVAL = 1.0        # сброс и fsync: при аварии теряется не больше секунды журнала
+WRITE_BUFFER = 1024 * 1024
+
+EVENT_CONNECT = 1
+EVENT_MESSAGE = 2
+EVENT_DISCONNECT = 3
+
+def log_header(protocol):
+    return RECORD_MAGIC + bytes((RECORD_VERSION,)) + protocol
+
+def read_protocol(path):
+    with open(path, 'rb') as f:
+        header = f.read(LOG_HEADER_SIZE)
+    if len(header) < LOG_HEADER_SIZE or not header.startswith(RECORD_MAGIC):
+        raise ValueError(f"{path} is not a traffic log")
+    if header[len(RECORD_MAGIC)] != RECORD_VERSION:
+        raise ValueError(f"{path}: unsupported traffic log version {header[len(RECORD_MAGIC)]}")
+    return header[-1:]
+
+def read_index(path):
+    # [(время, смещение)]; оборванная последняя запись индекса не читается
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    return [INDEX_ENTRY.unpack_from(data, position)
+            for position in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+
+def repair_log(path):
+    # После аварии журнал может кончаться оборванной записью, а индекс - указывать за
+    # его конец. Продолжение журнала после обрывка сдвинуло бы разбор всех следующих
+    # записей, поэтому оба файла обрезаются до последней целой записи. Проверяется
+    # только хвост - от последней записи индекса. Возвращает число отрезанных байт.
+    size = os.path.getsize(path)
+    entries = read_index(path)
+    valid = [entry for entry in entries if LOG_HEADER_SIZE <= entry[1] < size]
+    offset = valid[-1][1] if valid else LOG_HEADER_SIZE
+    with open(path, 'r+b') as f:
+        while True:
+            f.seek(offset)
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            end = offset + RECORD_HEADER.size + RECORD_HEADER.unpack(header)[4]
+            if end > size:
+                break
+            offset = end
+        if offset < size:
+            f.truncate(offset)
+    valid = [entry for entry in valid if entry[1] < offset]
+    index_size = os.path.getsize(path + INDEX_SUFFIX) if os.path.exists(path + INDEX_SUFFIX) else 0
+    if index_size != len(valid) * INDEX_ENTRY.size:
+        with open(path + INDEX_SUFFIX, 'wb') as f:
+            f.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in valid))
+    return size - offset
+
+class Recorder:
+    # Пишут потоки (корутины) всех клиентов: запись попадает в буфер файла под
+    # блокировкой, на диск буфер сбрасывает отдельный поток раз в FLUSH_INTERVAL
+    def __init__(self, path, protocol):
+        self.path = path
+        if os.path.exists(path) and os.path.getsize(path):
+            if read_protocol(path) != protocol:
+                raise ValueError(f"{path} is a log of another protocol")
+            dropped = repair_log(path)
+            if dropped:
+                log.warning("Traffic log %s ended with a partial record, truncated %s bytes", path, dropped)
+        self.file = open(path, 'ab', buffering=WRITE_BUFFER)
+        self.index = open(path + INDEX_SUFFIX, 'ab')
+        self.offset = self.file.tell()
+        if not self.offset:
+            self.file.write(log_header(protocol))
+            self.offset = LOG_HEADER_SIZE
+        self.next_index = 0
+        self.records = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_periodically)
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def connect(self, client_id):
+        self.write(client_id, EVENT_CONNECT, 0, b'')
+
+    def message(self, client_id, payload, frame_type=0):
+        self.write(client_id, EVENT_MESSAGE, frame_type, payload)
+
+    def disconnect(self, client_id):
+        self.write(client_id, EVENT_DISCONNECT, 0, b'')
+
+    def write(self, client_id, event, frame_type, payload):
+        now = time.time_ns() // 1000
+        with self.lock:
+            if self.file is None:
+                return
+            if now >= self.next_index:
+                self.index.write(INDEX_ENTRY.pack(now, self.offset))
+                self.next_index = now + INDEX_INTERVAL
+            # запись - одним буфером: заголовок и payload не расходятся по разным сбросам
+            self.file.write(RECORD_HEADER.pack(now, client_id, event, frame_type, len(payload)) + payload)
+            self.offset += RECORD_HEADER.size + len(payload)
+            self.records += 1
+
+    def flush_periodically(self):
+        while not self.stopped.wait(FLUSH_INTERVAL):
+            with self.lock:
+                if self.file is None:
+                    return
+                # индекс не должен указывать дальше того, что уже на диске
+                self.file.flush()
+                self.index.flush()
+                descriptors = (self.file.fileno(), self.index.fileno())
+            # fsync - без блокировки, потоки клиентов тем временем пишут в буфер
+            try:
+                for descriptor in descriptors:
+                    os.fsync(descriptor)
+            except OSError:
+                # файл закрыли между сбросом и fsync
+                return
+
+    def close(self):
+        self.stopped.set()
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.close()
+            self.index.close()
+            self.file = None
+
+class TrafficLog:
+    # Чтение журнала по порядку; оборванная последняя запись (сервер упал) пропускается
+    def __init__(self, path):
+        self.path = path
+        self.protocol = read_protocol(path)
+
+    def seek_offset(self, start):
+        # смещение последней записи индекса не позже start (мкс) - чтение начнется с нее
+        entries = read_index(self.path)
+        # индекс продолженного журнала тоже упорядочен по времени
+        position = bisect.bisect_right([when for when, _ in entries], start) - 1
+        if position < 0:
+            return LOG_HEADER_SIZE
+        return min(entries[position][1], os.path.getsize(self.path))
+
+    def first_time(self):
+        for record in self.records():
+            return record[0]
+        return None
+
+    def records(self, start=None):
+        # (время, мкс; id клиента; событие; тип кадра; payload)
+        with open(self.path, 'rb') as f:
+            f.seek(LOG_HEADER_SIZE if start is None else self.seek_offset(start))
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    return
+                when, client_id, event, frame_type, length = RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                if start is None or when >= start:
+                    yield when, client_id, event, frame_type, payload
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import threading
+
+# Общий реестр клиентов для TCP и UDP серверов: поиск и по id, и по адресу за O(1).
+# Поток приема и поток команд администратора меняют реестр одновременно,
+# поэтому все изменения и снимки делаются под блокировкой.
+
+class ClientRecord:
+    # __slots__ вместо словаря на каждого клиента
+    __slots__ = ('id', 'address', 'last_seen', 'socket', 'writer', 'binary', 'outbox', 'worker',
+                 'compressor', 'compressed', 'limiter')
+
+    def __init__(self, client_id, address, last_seen=0.0, socket=None, writer=None,
+                 binary=False, outbox=None, worker=None):
+        self.id = client_id
+        self.address = address
+        self.last_seen = last_seen
+        self.socket = socket
+        self.writer = writer
+        self.binary = binary
+        self.outbox = outbox
+        self.worker = worker
+        self.compressor = None  # TCP: контекст сжатия соединения (compression.py)
+        self.compressed = False  # UDP: клиент принимает сжатые датаграммы
+        self.limiter = None  # лимиты клиента на сообщения и байты (ratelimit.py)
+
+class ClientRegistry:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.by_id = {}       # {client_id: ClientRecord}
+        self.by_address = {}  # {address: client_id}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, client_id):
+        return client_id in self.by_id
+
+    def __getitem__(self, client_id):
+        return self.by_id[client_id]
+
+    def add(self, client_id, address, **fields):
+        record = ClientRecord(client_id, address, **fields)
+        with self.lock:
+            self.by_id[client_id] = record
+            self.by_address[address] = client_id
+        return record
+
+    def get(self, client_id):
+        return self.by_id.get(client_id)
+
+    def get_by_address(self, address):
+        with self.lock:
+            client_id = self.by_address.get(address)
+            return None if client_id is None else self.by_id.get(client_id)
+
+    def pop(self, client_id):
+        with self.lock:
+            record = self.by_id.pop(client_id, None)
+            if record is not None and self.by_address.get(record.address) == client_id:
+                del self.by_address[record.address]
+            return record
+
+    def pop_address(self, address):
+        with self.lock:
+            client_id = self.by_address.get(address)
+            return None if client_id is None else self.pop(client_id)
+
+    def ids(self):
+        with self.lock:
+            return list(self.by_id)
+
+    def records(self):
+        with self.lock:
+            return list(self.by_id.values())
+
+    def items(self):
+        with self.lock:
+            return list(self.by_id.items())
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+import collections
+import random
+import struct
+import threading
+import time
+
+# Надежная упорядоченная доставка поверх UDP (--reliable).
+# Пакет: [0xFF][тип: 1 байт][сессия: 4][seq: 4][base: 4][ack: 4][sack: 4][payload]
+#   сессия - своя у каждого канала: новый канал к тому же адресу (сервер забыл клиента
+#          и принял его снова) нумерует пакеты с нуля, и получатель, увидев новую
+#          сессию, сбрасывает прием, а не отбрасывает seq 0.. как повторы
+#   base - младший неподтвержденный seq отправителя: получатель, потерявший
+#          состояние (клиент истек на сервере), продолжает прием с этого номера
+#   ack  - все seq < ack получены (кумулятивное подтверждение)
+#   sack - бит i: получен seq ack + 1 + i (выборочное подтверждение)
+# Подтверждения едут вместе с данными, если есть что отправить, иначе отдельным ACK.
+# Первый байт 0xFF не встречается в UTF-8, поэтому обычные текстовые датаграммы
+# и пакеты надежного уровня различаются на одном сокете.
+
+RELIABLE_HEADER = struct.Struct('!BBIIIII')
+RELIABLE_MAGIC = 0xFF
+PACKET_DATA = 1
+PACKET_ACK = 2
+
+SACK_BITS = 32
+MAX_WINDOW = SACK_BITS          # пакетов в полете на одного получателя
+INITIAL_CWND = 4.0
+INITIAL_RTO = 0.5
+MIN_RTO = 0.1
+MAX_RTO = 3.0
+MAX_RETRIES = 8                 # таймаутов подряд без подтверждений - получатель недоступен
+DUPLICATE_THRESHOLD = 3         # столько более поздних пакетов подтверждено - пакет потерян
+TICK_INTERVAL = 0.02
+RETIRED_SESSIONS = 4            # сколько прежних сессий собеседника помнить
+
+def is_reliable_packet(data):
+    return len(data) >= RELIABLE_HEADER.size and data[0] == RELIABLE_MAGIC
+
+class PendingPacket:
+    __slots__ = ('payload', 'sent_time', 'retransmitted')
+
+    def __init__(self, payload, sent_time):
+        self.payload = payload
+        self.sent_time = sent_time
+        self.retransmitted = False
+
+class ReliableChannel:
+    # Состояние обмена с одним адресом: окно отправки и буфер переупорядочивания
+    def __init__(self):
+        self.session = random.getrandbits(32)
+        self.peer_session = None
+        self.retired = collections.deque(maxlen=RETIRED_SESSIONS)
+        self.reset_send()
+        self.reset_receive()
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = INITIAL_RTO
+        self.closing = False
+
+    def reset_send(self):
+        self.next_seq = 0
+        self.unacked = collections.OrderedDict()  # {seq: PendingPacket} по возрастанию seq
+        self.lost = set()  # seq из unacked, потерянные по RTO: уходят повторно, когда позволит окно
+        self.queue = collections.deque()
+        self.cwnd = INITIAL_CWND
+        self.ssthresh = float(MAX_WINDOW)
+        self.recovery_seq = 0
+        self.retries = 0
+
+    def reset_receive(self):
+        self.expected = 0
+        self.out_of_order = {}
+        self.ack_pending = False
+
+    def sack_bits(self):
+        bits = 0
+        for seq in self.out_of_order:
+            offset = seq - self.expected - 1
+            if 0 <= offset < SACK_BITS:
+                bits |= 1 << offset
+        return bits
+
+    def update_rtt(self, sample):
+        # RFC 6298
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+            self.srtt = 0.875 * self.srtt + 0.125 * sample
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    def on_acked(self, packet, now, lost=False):
+        # по алгоритму Карна RTT меряется только по пакетам без повторной отправки;
+        # потерянный по RTO, но подтвержденный до повтора пакет тоже не годится - его
+        # подтверждение могло задержаться на несколько RTO
+        if not packet.retransmitted and not lost:
+            self.update_rtt(now - packet.sent_time)
+        elif self.srtt is not None:
+            # подтвержден повтор - связь есть: удвоение RTO снимается, иначе после
+            # таймаута, пока в полете одни повторы, RTO не вернулся бы без замеров RTT
+            self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+        if self.cwnd < self.ssthresh:
+            self.cwnd += 1.0
+        else:
+            self.cwnd += 1.0 / self.cwnd
+        self.cwnd = min(self.cwnd, float(MAX_WINDOW))
+
+    def on_loss(self):
+        # одно снижение окна на окно потерь (fast recovery)
+        if self.unacked and next(iter(self.unacked)) >= self.recovery_seq:
+            self.ssthresh = max(self.cwnd / 2, 2.0)
+            self.cwnd = self.ssthresh
+            self.recovery_seq = self.next_seq
+
+    def in_flight(self):
+        return len(self.unacked) - len(self.lost)
+
+    def idle(self):
+        return not self.unacked and not self.queue
+
+class ReliableEndpoint:
+    def __init__(self, sock, loss=0.0):
+        self.sock = sock
+        self.loss = loss  # доля исходящих пакетов, отбрасываемых для проверки (0..1)
+        self.channels = {}  # {address: ReliableChannel}
+        self.lock = threading.RLock()
+        self.packets_sent = 0
+        self.retransmissions = 0
+        self.simulated_losses = 0
+        self.delivered = 0
+        self.duplicates = 0
+
+    def has_channel(self, address):
+        return address in self.channels
+
+    def transmit(self, channel, address, packet_type, seq=0, payload=b''):
+        base = next(iter(channel.unacked), channel.next_seq)
+        header = RELIABLE_HEADER.pack(RELIABLE_MAGIC, packet_type, channel.session, seq, base,
+                                      channel.expected, channel.sack_bits())
+        channel.ack_pending = False
+        self.packets_sent += 1
+        if self.loss and random.random() < self.loss:
+            self.simulated_losses += 1
+            return
+        self.sock.sendto(header + payload, address)
+
+    def send(self, address, payload, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                channel = self.channels[address] = ReliableChannel()
+            # адрес снова в работе (клиент вернулся до удаления канала)
+            channel.closing = False
+            channel.queue.append(bytes(payload))
+            self.pump(channel, address, now)
+
+    def pump(self, channel, address, now):
+        # сначала повторы потерянного по RTO, затем отправка из очереди - пока позволяют
+        # окно перегрузки и размер SACK
+        if channel.lost:
+            for seq in [seq for seq in channel.unacked if seq in channel.lost]:
+                if channel.in_flight() >= int(channel.cwnd):
+                    return
+                self.retransmit(channel, address, seq, channel.unacked[seq], now)
+        while channel.queue:
+            base = next(iter(channel.unacked), channel.next_seq)
+            if len(channel.unacked) >= int(channel.cwnd) or channel.next_seq - base >= MAX_WINDOW:
+                break
+            seq = channel.next_seq
+            channel.next_seq += 1
+            packet = PendingPacket(channel.queue.popleft(), now)
+            channel.unacked[seq] = packet
+            self.transmit(channel, address, PACKET_DATA, seq, packet.payload)
+
+    def retransmit(self, channel, address, seq, packet, now):
+        channel.lost.discard(seq)
+        packet.sent_time = now
+        packet.retransmitted = True
+        self.retransmissions += 1
+        self.transmit(channel, address, PACKET_DATA, seq, packet.payload)
+
+    def receive(self, data, address, now=None):
+        # Возвращает payload, которые теперь можно доставить по порядку
+        now = time.time() if now is None else now
+        _, packet_type, session, seq, base, ack, sack = RELIABLE_HEADER.unpack_from(data)
+        payload = bytes(data[RELIABLE_HEADER.size:])
+        with self.lock:
+            channel = self.channels.get(address)
+            if channel is None:
+                if packet_type != PACKET_DATA:
+                    return []
+                channel = self.channels[address] = ReliableChannel()
+            if session in channel.retired:
+                # запоздавший пакет прежнего канала собеседника
+                return []
+            if channel.peer_session != session:
+                if channel.peer_session is not None:
+                    channel.retired.append(channel.peer_session)
+                # у другой стороны новый канал: ее нумерация началась заново. Отправка
+                # не сбрасывается - неподтвержденное уйдет повторно, а новый получатель
+                # начнет прием с base
+                channel.reset_receive()
+                channel.peer_session = session
+
+            self.process_ack(channel, address, ack, sack, now)
+
+            delivered = []
+            if packet_type == PACKET_DATA:
+                channel.ack_pending = True
+                if base > channel.expected:
+                    # все до base отправитель уже считает доставленным
+                    channel.expected = base
+                    channel.out_of_order = {key: value for key, value in channel.out_of_order.items()
+                                            if key >= base}
+                    while channel.expected in channel.out_of_order:
+                        delivered.append(channel.out_of_order.pop(channel.expected))
+                        channel.expected += 1
+                if seq < channel.expected or seq in channel.out_of_order:
+                    self.duplicates += 1
+                elif seq == channel.expected:
+                    delivered.append(payload)
+                    channel.expected += 1
+                    while channel.expected in channel.out_of_order:
+                        delivered.append(channel.out_of_order.pop(channel.expected))
+                        channel.expected += 1
+                elif seq - channel.expected <= SACK_BITS:
+                    channel.out_of_order[seq] = payload
+                self.delivered += len(delivered)
+
+            self.pump(channel, address, now)
+            return delivered
+
+    def process_ack(self, channel, address, ack, sack, now):
+        acked = [seq for seq in channel.unacked if seq < ack]
+        highest = ack - 1
+        for offset in range(SACK_BITS):
+            if sack >> offset & 1:
+                seq = ack + 1 + offset
+                highest = seq
+                if seq in channel.unacked:
+                    acked.append(seq)
+        if not acked:
+            return
+        channel.retries = 0
+        for seq in acked:
+            lost = seq in channel.lost
+            channel.lost.discard(seq)
+            channel.on_acked(channel.unacked.pop(seq), now, lost)
+
+        # пакет, после которого подтверждено DUPLICATE_THRESHOLD более поздних, считается потерянным
+        srtt = channel.srtt or INITIAL_RTO
+        for seq, packet in list(channel.unacked.items()):
+            if seq + DUPLICATE_THRESHOLD > highest:
+                break
+            if now - packet.sent_time >= srtt:
+                channel.on_loss()
+                self.retransmit(channel, address, seq, packet, now)
+
+    def tick(self, now=None):
+        # Повторы по таймауту и отложенные ACK. Возвращает адреса, признанные недоступными.
+        now = time.time() if now is None else now
+        failed = []
+        with self.lock:
+            for address, channel in list(self.channels.items()):
+                if channel.ack_pending:
+                    self.transmit(channel, address, PACKET_ACK)
+
+                # ждущие повтора после прошлого RTO - уже не в полете, их срок не считается
+                expired = [seq for seq, packet in channel.unacked.items()
+                           if seq not in channel.lost and now - packet.sent_time >= channel.rto]
+                if expired:
+                    channel.retries += 1
+                    if channel.retries > MAX_RETRIES:
+                        del self.channels[address]
+                        if not channel.closing:
+                            failed.append(address)
+                        continue
+                    channel.ssthresh = max(channel.cwnd / 2, 2.0)
+                    channel.cwnd = 1.0
+                    channel.recovery_seq = channel.next_seq
+                    channel.rto = min(channel.rto * 2, MAX_RTO)
+                    # окно сжалось до одного пакета: повторяется самый ранний, остальные
+                    # уйдут по мере подтверждений
+                    channel.lost.update(expired)
+                    self.pump(channel, address, now)
+
+                if channel.closing and channel.idle():
+                    del self.channels[address]
+        return failed
+
+    def next_timeout(self):
+        # Пока есть неподтвержденные данные или отложенные ACK, нужен частый tick
+        with self.lock:
+            for channel in self.channels.values():
+                if channel.ack_pending or channel.unacked:
+                    return TICK_INTERVAL
+        return None
+
+    def close(self, address):
+        # канал удаляется, когда все отправленное будет подтверждено
+        with self.lock:
+            channel = self.channels.get(address)
+            if channel is not None:
+                channel.closing = True
+
+    def flush(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                if all(channel.idle() for channel in self.channels.values()):
+                    return True
+            time.sleep(TICK_INTERVAL / 2)
+        return False
+
+    def channel_info(self, address):
+        channel = self.channels.get(address)
+        if channel is None:
+            return None
+        srtt = (channel.srtt or 0) * 1000
+        return f"rtt {srtt:.1f}ms, cwnd {channel.cwnd:.1f}, in flight {len(channel.unacked)}"
+
+    def stats(self):
+        return (f"packets sent: {self.packets_sent}, retransmitted: {self.retransmissions}, "
+                f"simulated loss: {self.simulated_losses}, delivered: {self.delivered}, "
+                f"duplicates: {self.duplicates}")
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import asyncio
+import heapq
+import socket
+import time
+from framing import pack_frame_header
+from fragmentation import Fragmenter, prepare_socket
+from recording import TrafficLog, PROTOCOL_UDP, EVENT_CONNECT, EVENT_MESSAGE, EVENT_DISCONNECT
+from tls import RECV_SIZE
+
+# Воспроизведение записанного трафика (--record) на работающем сервере: каждый
+# записанный клиент - отдельное соединение (у UDP - свой сокет), сообщения уходят с
+# теми же интервалами, что в записи, в --replay-speed раз быстрее или без пауз (0).
+# Ответы сервера не разбираются, только считаются.
+
+CLIENT_QUEUE = 1000      # сообщений в очереди клиента, дальше ждет весь диспетчер
+YIELD_EVERY = 100        # без пауз (скорость 0) диспетчер отдает управление раз в столько записей
+PROGRESS_INTERVAL = 5.0
+CONNECT_TIMEOUT = 10.0
+CLOSE_TIMEOUT = 2.0      # ожидание ответов на последние сообщения перед закрытием
+UDP_LINGER = 0.2         # UDP-сокет закрывается, когда ответы не приходят столько секунд
+
+class ReplayStats:
+    def __init__(self):
+        self.clients = 0
+        self.messages = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.errors = 0
+        self.skipped = 0  # сообщения клиентов, которые не смогли подключиться
+        self.max_lag = 0.0
+        self.last_sent = None  # темп считается до последней отправки, без ожидания ответов
+
+class TCPReplayClient:
+    def __init__(self, replay, client_id):
+        self.replay = replay
+        self.client_id = client_id
+        self.queue = asyncio.Queue(CLIENT_QUEUE)
+        self.reader = None
+        self.writer = None
+        self.tls = None
+        self.receiving = None
+
+    async def connect(self):
+        replay = self.replay
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(replay.host, replay.port), CONNECT_TIMEOUT)
+        sock = self.writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if replay.tls is not None:
+            self.tls = await replay.tls.wrap_stream(self.reader, self.writer, replay.host, replay.port)
+        self.receiving = asyncio.ensure_future(self.receive())
+
+    async def receive(self):
+        # ответы только считаются; у TLS расшифровка нужна еще и для билетов сессии
+        try:
+            while True:
+                data = await self.reader.read(RECV_SIZE)
+                if not data:
+                    break
+                if self.tls is not None:
+                    data = self.tls.decrypt(data)
+                self.replay.stats.bytes_in += len(data)
+        except (ConnectionError, OSError):
+            pass
+
+    async def send(self, frame_type, payload):
+        # тип кадра 0 - текстовая строка, иначе кадр бинарного режима
+        if frame_type:
+            buffers = [pack_frame_header(frame_type, len(payload)), payload]
+        else:
+            buffers = [payload, b'\n']
+        if self.tls is not None:
+            self.writer.write(self.tls.encrypt(buffers))
+        else:
+            self.writer.writelines(buffers)
+        await self.writer.drain()
+        return sum(len(buffer) for buffer in buffers)
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            # половинное закрытие: сервер дочитает и ответит, потом закроет сам
+            self.writer.write_eof()
+            await asyncio.wait_for(self.receiving, CLOSE_TIMEOUT)
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            pass
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+class UDPReplayProtocol(asyncio.DatagramProtocol):
+    def __init__(self, stats):
+        self.stats = stats
+        self.received = 0
+
+    def datagram_received(self, data, address):
+        self.stats.bytes_in += len(data)
+        self.received += 1
+
+    def error_received(self, exc):
+        self.stats.errors += 1
+
+class UDPReplayClient:
+    def __init__(self, replay, client_id):
+        self.replay = replay
+        self.client_id = client_id
+        self.queue = asyncio.Queue(CLIENT_QUEUE)
+        self.transport = None
+        self.protocol = None
+
+    async def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        prepare_socket(sock)
+        sock.connect(self.replay.address)
+        self.transport, self.protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: UDPReplayProtocol(self.replay.stats), sock=sock)
+
+    async def send(self, frame_type, payload):
+        # записано собранное сообщение - большое снова режется на фрагменты
+        size = 0
+        for datagram in self.replay.fragmenter.split(payload, self.replay.address):
+            self.transport.sendto(datagram)
+            size += len(datagram)
+        return size
+
+    async def close(self):
+        if self.transport is None:
+            return
+        # конца потока у UDP нет - ждем, пока ответы перестанут приходить
+        waited = 0.0
+        while waited < CLOSE_TIMEOUT:
+            received = self.protocol.received
+            await asyncio.sleep(UDP_LINGER)
+            waited += UDP_LINGER
+            if self.protocol.received == received:
+                break
+        self.transport.close()
+
+class Replay:
+    def __init__(self, host='localhost', port=8888, logs=None, speed=1.0, start=0.0, tls=None):
+        self.host = host
+        self.port = port
+        # журналы воркеров prefork (<путь>.<номер>) сливаются по времени записи
+        self.logs = [TrafficLog(path) for path in logs]
+        self.protocol = self.logs[0].protocol
+        if any(log.protocol != self.protocol for log in self.logs):
+            raise ValueError("cannot replay TCP and UDP logs together")
+        self.speed = speed  # 0 - без пауз
+        self.start_offset = start
+        self.tls = tls if self.protocol != PROTOCOL_UDP else None
+        self.address = (socket.gethostbyname(host), port)
+        self.fragmenter = Fragmenter()
+        self.stats = ReplayStats()
+        self.clients = {}
+        self.tasks = []
+        self.span = 0.0
+
+    def start(self):
+        target = 'UDP' if self.protocol == PROTOCOL_UDP else 'TCP'
+        speed = f"{self.speed:g}x" if self.speed else 'max speed'
+        print(f"Replay: {len(self.logs)} log(s) to {target} server at {self.host}:{self.port}, {speed}")
+        started = time.time()
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            print("Replay interrupted")
+        self.print_summary(time.time() - started, (self.stats.last_sent or started) - started)
+
+    async def run(self):
+        progress = asyncio.ensure_future(self.report_progress())
+        try:
+            await self.dispatch()
+            # клиенты, которые не отключились до конца записи
+            for client in self.clients.values():
+                await client.queue.put(None)
+            await asyncio.gather(*self.tasks)
+        finally:
+            progress.cancel()
+
+    async def dispatch(self):
+        first = min((when for when in (log.first_time() for log in self.logs) if when is not None),
+                    default=None)
+        if first is None:
+            return
+        start = first + int(self.start_offset * 1_000_000)
+        records = heapq.merge(*(log.records(start) for log in self.logs), key=lambda record: record[0])
+        loop = asyncio.get_running_loop()
+        began = loop.time()
+        first_seen = None
+        count = 0
+        for when, client_id, event, frame_type, payload in records:
+            if first_seen is None:
+                first_seen = when
+            self.span = (when - first_seen) / 1_000_000
+            count += 1
+            if self.speed:
+                delay = self.span / self.speed - (loop.time() - began)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.stats.max_lag = max(self.stats.max_lag, -delay)
+            elif count % YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+
+            client = self.clients.get(client_id)
+            if event == EVENT_CONNECT:
+                # повторный id - сервер перезапускался, пока писал журнал
+                if client is not None:
+                    await client.queue.put(None)
+                self.open_client(client_id)
+            elif event == EVENT_MESSAGE:
+                if client is None:
+                    # подключился раньше --replay-start
+                    client = self.open_client(client_id)
+                await client.queue.put((frame_type, payload))
+            elif event == EVENT_DISCONNECT and client is not None:
+                del self.clients[client_id]
+                await client.queue.put(None)
+
+    def open_client(self, client_id):
+        if self.protocol == PROTOCOL_UDP:
+            client = UDPReplayClient(self, client_id)
+        else:
+            client = TCPReplayClient(self, client_id)
+        self.clients[client_id] = client
+        self.stats.clients += 1
+        self.tasks.append(asyncio.ensure_future(self.run_client(client)))
+        return client
+
+    async def run_client(self, client):
+        connected = False
+        try:
+            await client.connect()
+            connected = True
+        except (OSError, asyncio.TimeoutError) as e:
+            self.stats.errors += 1
+            print(f"Replay client #{client.client_id} failed to connect: {e}")
+        while True:
+            item = await client.queue.get()
+            if item is None:
+                break
+            if not connected:
+                # очередь все равно разбирается, чтобы не держать диспетчер
+                self.stats.skipped += 1
+                continue
+            try:
+                self.stats.bytes_out += await client.send(*item)
+                self.stats.messages += 1
+                self.stats.last_sent = time.time()
+            except (ConnectionError, OSError) as e:
+                self.stats.errors += 1
+                print(f"Replay client #{client.client_id} lost connection: {e}")
+                connected = False
+        await client.close()
+
+    async def report_progress(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            print(f"  {self.span:.1f}s of recording replayed, {self.stats.messages} messages, "
+                  f"{len(self.clients)} clients connected, lag {self.stats.max_lag * 1000:.1f}ms max",
+                  flush=True)
+
+    def print_summary(self, elapsed, sending):
+        stats = self.stats
+        print(f"Replayed {stats.messages} messages from {stats.clients} clients in {elapsed:.2f}s "
+              f"({stats.messages / sending if sending else 0:.1f} msg/s), recording span {self.span:.2f}s")
+        print(f"  sent {stats.bytes_out} bytes, received {stats.bytes_in} bytes, "
+              f"errors {stats.errors}, skipped {stats.skipped}")
+        if self.speed:
+            print(f"  max lag behind schedule: {stats.max_lag * 1000:.1f}ms")
+        if self.tls is not None:
+            print(f"TLS handshakes: {self.tls.full} full, {self.tls.resumed} resumed")
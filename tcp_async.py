@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+import asyncio
+import resource
+import threading
+import time
+from framing import (
+    DEFAULT_MAX_MESSAGE_SIZE, FRAME_HEADER, BINARY_COMMAND, BINARY_ACK,
+    FRAME_DATA, FRAME_COMMAND, FRAME_ECHO, FRAME_REPLY, FRAME_SERVER, FRAME_BROADCAST,
+    FRAME_CHANNEL, FRAME_BUSY, encode_outgoing
+)
+from outbound import (
+    AsyncOutbox, QueueOverflowError, DEFAULT_MAX_QUEUE_BYTES, DEFAULT_MAX_QUEUE_MESSAGES,
+    DEFAULT_POLICY, POLICY_DROP_OLDEST, POLICY_DISCONNECT
+)
+from compression import COMPRESS_COMMAND, DEFAULT_COMPRESS_THRESHOLD, StreamCompressor, compress_ack
+from console import log, traffic_log, preview
+from tcp_communication import TCPServer, DEFAULT_BACKLOG
+from tls import HANDSHAKE_TIMEOUT
+from heartbeat import IDLE_CHECK_INTERVAL, enable_keepalive
+from ratelimit import TOO_MANY_CONNECTIONS, busy_message
+
+class AsyncTCPServer(TCPServer):
+    # Один поток с event loop обслуживает все соединения вместо потока на клиента
+    def __init__(self, host='localhost', port=8888, backlog=DEFAULT_BACKLOG,
+                 max_message_size=DEFAULT_MAX_MESSAGE_SIZE, max_queue_bytes=DEFAULT_MAX_QUEUE_BYTES,
+                 max_queue_messages=DEFAULT_MAX_QUEUE_MESSAGES, queue_policy=DEFAULT_POLICY,
+                 metrics_port=None, headless=False, control_socket=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD, tls_context=None,
+                 client_timeout=0, admission=None, record_path=None):
+        super().__init__(host, port, max_message_size, max_queue_bytes,
+                         max_queue_messages, queue_policy, metrics_port, headless, control_socket,
+                         compress_threshold, tls_context, client_timeout, backlog, admission,
+                         record_path)
+        self.loop = None
+        self.server = None
+        self.loop_thread = None
+        self.reuse_port = False
+        self.tasks = []
+
+    def start(self):
+        try:
+            self.raise_fd_limit()
+            self.loop = asyncio.new_event_loop()
+            self.server = self.loop.run_until_complete(self.create_server())
+            log.info("TCP Server (async) listening on %s:%s%s", self.host, self.port,
+                     " (TLS)" if self.tls_context else "")
+            self.start_recording()
+            self.start_metrics_endpoint()
+            self.start_control()
+            self.start_idle_monitor()
+            self.print_commands()
+
+            self.loop_thread = threading.Thread(target=self.loop.run_forever)
+            self.loop_thread.daemon = True
+            self.loop_thread.start()
+
+            self.serve_admin()
+
+        except Exception as e:
+            log.error("TCP Server error: %s", e)
+        finally:
+            self.running = False
+            self.stop_control()
+            self.shutdown()
+            log.info("TCP Server stopped")
+
+    def shutdown(self):
+        if not self.loop:
+            return
+        if self.loop_thread and self.loop_thread.is_alive():
+            future = asyncio.run_coroutine_threadsafe(self.close_all(), self.loop)
+            try:
+                future.result(timeout=5)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join(timeout=5)
+        else:
+            self.loop.run_until_complete(self.close_all())
+        self.loop.close()
+        self.stop_recording()
+
+    async def create_server(self):
+        return await asyncio.start_server(
+            self.handle_connection, self.host, self.port,
+            backlog=self.backlog, limit=self.max_message_size,
+            reuse_address=True, reuse_port=self.reuse_port or None
+        )
+
+    async def close_all(self):
+        # фоновые задачи (таймеры) отменяются, иначе при закрытии loop они остаются
+        # незавершенными
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.server:
+            self.server.close()
+        for client_id in self.clients.ids():
+            self.remove_client(client_id)
+
+    def start_idle_monitor(self):
+        # таймер - задача event loop, клиенты отключаются в том же потоке, что и обслуживаются
+        if self.idle is not None:
+            self.start_task(self.watch_idle_async())
+
+    def start_task(self, coroutine):
+        self.tasks.append(self.loop.create_task(coroutine))
+
+    async def watch_idle_async(self):
+        while self.running:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL)
+            for client_id in self.idle.expire(time.perf_counter()):
+                self.drop_idle(client_id)
+
+    def raise_fd_limit(self):
+        # Для 10k+ соединений нужен лимит файловых дескрипторов выше стандартных 1024
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if hard == resource.RLIM_INFINITY or soft < hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        # отклоненное соединение не расходует id: номера клиентов в list и логе идут подряд
+        if self.over_capacity():
+            self.reject_connection(writer, client_address)
+            return
+        client_id = self.next_client_id()
+        self.metrics.inc('connections_accepted')
+        if self.tls_context is not None and not await self.accept_tls(client_id, writer, client_address):
+            return
+
+        log.info("[New TCP client #%s from %s]", client_id, client_address)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            enable_keepalive(sock)
+
+        self.add_client(client_id, writer, client_address)
+
+        try:
+            client_info = self.clients[client_id]
+            await self.write(client_id, [self.welcome_message(client_id).encode()])
+
+            while self.running:
+                try:
+                    line = await reader.readuntil(b'\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    self.metrics.inc('connections_dropped', label='message_too_large')
+                    log.warning("[Client %s] message exceeds %s bytes, closing connection", client_id, self.max_message_size)
+                    break
+
+                started = time.perf_counter()
+                client_info.last_seen = started
+                self.metrics.inc('messages_in')
+                self.metrics.inc('bytes_in', len(line))
+                if self.recorder is not None:
+                    self.recorder.message(client_id, line[:-1])
+                if self.admission is not None:
+                    reason = await self.admit(client_info, len(line))
+                    if reason is not None:
+                        await self.write(client_id, [(busy_message(reason) + "\n").encode()])
+                        continue
+                try:
+                    message = line.decode('utf-8').strip()
+                except UnicodeDecodeError as e:
+                    self.metrics.inc('decode_errors')
+                    traffic_log.warning("[Client %s] UTF-8 decode error: %s", client_id, e)
+                    continue
+
+                if not message:
+                    continue
+
+                traffic_log.info("[Client %s] %s", client_id, preview(message))
+
+                if message.lower() in (BINARY_COMMAND, COMPRESS_COMMAND):
+                    await self.enable_binary(client_id, compress=message.lower() == COMPRESS_COMMAND)
+                    await self.handle_frames(client_id, reader)
+                    break
+
+                response = self.process_message(client_id, message)
+                await self.write(client_id, [response.encode()])
+                self.metrics.observe('message_handling', time.perf_counter() - started)
+                if message.lower() == 'quit':
+                    await self.clients[client_id].outbox.drain(timeout=1.0)
+                    break
+
+        except QueueOverflowError as e:
+            self.metrics.inc('connections_dropped', label='queue_overflow')
+            log.warning("[Client %s] %s, closing connection", client_id, e)
+        except ConnectionResetError:
+            self.metrics.inc('connections_dropped', label='reset')
+            log.info("[Client %s disconnected unexpectedly]", client_id)
+        except Exception as e:
+            if self.running:
+                log.error("Error with client %s: %s", client_id, e)
+        finally:
+            self.remove_client(client_id)
+
+    def reject_connection(self, writer, client_address):
+        self.count_rejected(client_address)
+        if self.tls_context is None:
+            writer.write((TOO_MANY_CONNECTIONS + "\n").encode())
+        writer.close()
+
+    async def admit(self, client_info, size):
+        if client_info.limiter is not None:
+            await self.throttle(client_info, size)
+        return self.shed(size)
+
+    async def throttle(self, client_info, size):
+        # корутина клиента не читает соединение, остальные клиенты обслуживаются
+        while True:
+            wait, bucket = client_info.limiter.wait_time()
+            if not wait:
+                break
+            self.metrics.inc('throttled', label=f"client_{bucket}")
+            await asyncio.sleep(wait)
+        client_info.limiter.take(size)
+
+    async def accept_tls(self, client_id, writer, client_address):
+        # TLS включается до первого await в handle_connection: чтение сокета еще не
+        # началось, и ClientHello не попадет в буфер StreamReader мимо SSL
+        started = time.perf_counter()
+        try:
+            await writer.start_tls(self.tls_context, ssl_handshake_timeout=HANDSHAKE_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, ConnectionError) as e:
+            self.metrics.inc('connections_dropped', label='tls_handshake')
+            log.warning("[Client %s] TLS handshake with %s failed: %s", client_id, client_address, e)
+            writer.transport.abort()
+            return False
+        self.count_handshake(time.perf_counter() - started, writer.get_extra_info('ssl_object').session_reused)
+        return True
+
+    async def enable_binary(self, client_id, compress=False):
+        client_info = self.clients[client_id]
+        self.metrics.inc('commands', label=COMPRESS_COMMAND if compress else BINARY_COMMAND)
+        if compress:
+            client_info.compressor = StreamCompressor(self.compress_threshold)
+            # выброшенный из очереди кадр сломал бы контекст сжатия у клиента
+            if client_info.outbox.policy == POLICY_DROP_OLDEST:
+                client_info.outbox.policy = POLICY_DISCONNECT
+            ack = compress_ack(self.compress_threshold) + "\n"
+        else:
+            ack = BINARY_ACK
+        await client_info.outbox.switch_binary(ack.encode(), client_info.compressor)
+        client_info.binary = True
+
+    async def handle_frames(self, client_id, reader):
+        client_info = self.clients[client_id]
+        while self.running:
+            try:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                length, frame_type = FRAME_HEADER.unpack(header)
+                if length > self.max_message_size:
+                    self.metrics.inc('connections_dropped', label='message_too_large')
+                    log.warning("[Client %s] frame of %s bytes exceeds %s bytes, closing connection", client_id, length, self.max_message_size)
+                    break
+                payload = await reader.readexactly(length)
+            except asyncio.IncompleteReadError:
+                break
+            started = time.perf_counter()
+            client_info.last_seen = started
+            self.metrics.inc('messages_in')
+            self.metrics.inc('bytes_in', FRAME_HEADER.size + length)
+            if self.recorder is not None:
+                self.recorder.message(client_id, payload, frame_type)
+            if self.admission is not None:
+                reason = await self.admit(client_info, FRAME_HEADER.size + length)
+                if reason is not None:
+                    await self.write_frame(client_id, FRAME_BUSY, busy_message(reason).encode())
+                    continue
+
+            if frame_type == FRAME_DATA:
+                traffic_log.info("[Client %s] binary data, %s bytes", client_id, len(payload))
+                await self.write_frame(client_id, FRAME_ECHO, payload)
+                self.metrics.observe('message_handling', time.perf_counter() - started)
+            elif frame_type == FRAME_COMMAND:
+                message = payload.decode('utf-8', 'replace').strip()
+                traffic_log.info("[Client %s] %s", client_id, preview(message))
+
+                response = self.process_message(client_id, message).rstrip('\n').encode()
+                await self.write_frame(client_id, FRAME_REPLY, response)
+                self.metrics.observe('message_handling', time.perf_counter() - started)
+                if message.lower() == 'quit':
+                    await self.clients[client_id].outbox.drain(timeout=1.0)
+                    break
+            else:
+                traffic_log.warning("[Client %s] unknown frame type %s", client_id, frame_type)
+
+    # Методы ниже вызываются только из потока event loop
+    def add_client(self, client_id, writer, client_address):
+        self.track_client(self.clients.add(client_id, client_address, writer=writer,
+                                           outbox=AsyncOutbox(writer, self.max_queue_bytes,
+                                                              self.max_queue_messages, self.queue_policy)))
+
+    def remove_client(self, client_id):
+        client_info = self.clients.pop(client_id)
+        if client_info is None:
+            return
+        self.channels.remove_client(client_id)
+        self.metrics.inc('connections_closed')
+        if self.recorder is not None:
+            self.recorder.disconnect(client_id)
+        client_info.outbox.close()
+        try:
+            client_info.writer.close()
+        except Exception:
+            pass
+        log.info("[Client %s disconnected]", client_id)
+
+    async def write(self, client_id, buffers):
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            raise ConnectionError(f"client #{client_id} is disconnected")
+        await client_info.outbox.push(buffers)
+        self.count_outgoing(buffers)
+
+    async def write_frame(self, client_id, frame_type, payload):
+        # контекст сжатия использует только корутина этого клиента - порядок кадров сохраняется
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            raise ConnectionError(f"client #{client_id} is disconnected")
+        buffers = self.frame_buffers(client_info.compressor, frame_type, payload)
+        await client_info.outbox.push(buffers)
+        self.count_outgoing(buffers, FRAME_HEADER.size + len(payload))
+
+    async def push_outgoing(self, client_id, outgoing, shared=None):
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            return
+        try:
+            buffers = await client_info.outbox.push_outgoing(outgoing, shared)
+            text, header, payload = outgoing
+            self.count_outgoing(buffers, len(header) + len(payload) if buffers[0] is not text else None)
+        except QueueOverflowError as e:
+            self.metrics.inc('connections_dropped', label='queue_overflow')
+            log.warning("[Client %s] %s, closing connection", client_id, e)
+            self.remove_client(client_id)
+        except ConnectionError:
+            self.remove_client(client_id)
+
+    def write_to_client(self, client_id, outgoing, shared=None):
+        asyncio.ensure_future(self.push_outgoing(client_id, outgoing, shared))
+
+    def write_to_all(self, outgoing):
+        self.write_to_ids(self.clients.ids(), outgoing)
+
+    def write_to_ids(self, client_ids, outgoing):
+        # сжатый кадр рассылки общий для всех получателей со сжатием
+        shared = {}
+        for client_id in client_ids:
+            self.write_to_client(client_id, outgoing, shared)
+
+    # Команды администратора приходят из основного потока или управляющего сокета
+    # и передаются в event loop
+    def control_send(self, client_id, message):
+        if client_id not in self.clients:
+            return {'ok': False, 'error': f"Client #{client_id} not found"}
+
+        outgoing = encode_outgoing(FRAME_SERVER, "Server: ", message)
+        self.loop.call_soon_threadsafe(self.write_to_client, client_id, outgoing)
+        return {'ok': True, 'client': client_id}
+
+    def control_broadcast(self, message):
+        outgoing = encode_outgoing(FRAME_BROADCAST, "Broadcast from server: ", message)
+        self.loop.call_soon_threadsafe(self.write_to_all, outgoing)
+        return {'ok': True, 'delivered': len(self.clients)}
+
+    def deliver_channel(self, channel, text):
+        # вызывается и из event loop (команда клиента), и из потока администратора
+        members = self.channels.members(channel)
+        if members:
+            outgoing = encode_outgoing(FRAME_CHANNEL, "", text)
+            self.loop.call_soon_threadsafe(self.write_to_ids, members, outgoing)
+        return len(members)
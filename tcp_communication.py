@@ -3,133 +3,522 @@
 import socket
 import threading
 import time
+from framing import (
+    MessageReader, MessageTooLargeError, DEFAULT_MAX_MESSAGE_SIZE,
+    BINARY_COMMAND, BINARY_ACK, FRAME_HEADER, FRAME_DATA, FRAME_COMMAND, FRAME_ECHO, FRAME_REPLY,
+    FRAME_SERVER, FRAME_BROADCAST, FRAME_CHANNEL, FRAME_BUSY, pack_frame_header, send_frame, encode_outgoing
+)
+from compression import COMPRESS_COMMAND, COMPRESS_ACK, DEFAULT_COMPRESS_THRESHOLD, StreamCompressor, FrameDecompressor, compress_ack
+from channels import CHANNEL_COMMANDS, ChannelIndex, channel_command, channel_message
+from outbound import (
+    BroadcastEngine, QueueOverflowError, DEFAULT_MAX_QUEUE_BYTES, DEFAULT_MAX_QUEUE_MESSAGES,
+    DEFAULT_POLICY, POLICY_DROP_OLDEST, POLICY_DISCONNECT
+)
+from control import ControlServer
+from console import log, traffic_log, preview, hide_prompt, wait_for_shutdown
+from metrics import Metrics
+from registry import ClientRegistry
+from tls import TLSConnection
+from heartbeat import (
+    HEARTBEAT_COMMAND, HEARTBEAT_REPLY, DEFAULT_HEARTBEAT_INTERVAL,
+    DEAD_PEER_INTERVALS, IDLE_CHECK_INTERVAL, IdleMonitor, enable_keepalive
+)
+from client_pool import backoff_delay
+from ratelimit import TOO_MANY_CONNECTIONS, busy_message
+from recording import Recorder, PROTOCOL_TCP
+
+DEFAULT_BACKLOG = 4096
 
 class TCPServer:
-    def __init__(self, host='localhost', port=8888):
+    def __init__(self, host='localhost', port=8888, max_message_size=DEFAULT_MAX_MESSAGE_SIZE,
+                 max_queue_bytes=DEFAULT_MAX_QUEUE_BYTES, max_queue_messages=DEFAULT_MAX_QUEUE_MESSAGES,
+                 queue_policy=DEFAULT_POLICY, metrics_port=None, headless=False, control_socket=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD, tls_context=None,
+                 client_timeout=0, backlog=DEFAULT_BACKLOG, admission=None,
+                 record_path=None):
         self.host = host
         self.port = port
+        self.backlog = backlog
+        self.max_message_size = max_message_size
+        self.max_queue_bytes = max_queue_bytes
+        self.max_queue_messages = max_queue_messages
+        self.queue_policy = queue_policy
         self.socket = None
         self.client_count = 0
-        self.clients = {}
+        self.clients = ClientRegistry()
+        self.channels = ChannelIndex()
         self.running = True
+        self.engine = None
+        self.metrics_port = metrics_port
+        self.headless = headless
+        self.control_socket = control_socket
+        self.control = None
+        self.compress_threshold = compress_threshold
+        self.tls_context = tls_context
+        self.client_timeout = client_timeout
+        self.idle = IdleMonitor(self.clients, client_timeout) if client_timeout else None
+        self.admission = admission  # AdmissionControl или None - без ограничений
+        self.record_path = record_path
+        self.recorder = None
+        self.metrics = Metrics('tcp_server')
+        self.register_gauges()
         
+    def register_gauges(self):
+        self.metrics.gauge('clients_connected', self.connected_count)
+        self.metrics.gauge('queued_messages', lambda: sum(self.queue_depth(client_info)[0]
+                                                          for client_info in self.clients.records()))
+        self.metrics.gauge('queued_bytes', lambda: sum(self.queue_depth(client_info)[1]
+                                                       for client_info in self.clients.records()))
+        self.metrics.gauge('lagging_clients', lambda: sum(1 for client_info in self.clients.records()
+                                                          if self.is_lagging(client_info)))
+        self.metrics.gauge('channels', lambda: len(self.channels))
+        self.metrics.gauge('subscriptions', self.channels.subscription_count)
+
+    def start_metrics_endpoint(self):
+        if self.metrics_port:
+            self.metrics.serve('127.0.0.1', self.metrics_port)
+            log.info("Metrics available at http://127.0.0.1:%s/metrics", self.metrics_port)
+
+    def start_control(self):
+        if self.control_socket:
+            self.control = ControlServer(self.control_socket, self)
+            self.control.start()
+            log.info("Control socket listening on %s", self.control_socket)
+
+    def stop_control(self):
+        if self.control:
+            self.control.stop()
+
+    def start_recording(self):
+        if self.record_path:
+            self.recorder = Recorder(self.record_path, PROTOCOL_TCP)
+            log.info("Recording inbound traffic to %s", self.record_path)
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            log.info("Recorded %s events to %s", self.recorder.records, self.record_path)
+
     def start(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.socket.bind((self.host, self.port))
-            self.socket.listen(5)
-            print(f"TCP Server listening on {self.host}:{self.port}")
-            print("Server commands:")
-            print("  send <client_id> <message>  - Send message to specific client")
-            print("  broadcast <message>         - Send message to all clients")
-            print("  list                        - Show connected clients")
-            print("  quit                        - Exit server")
-            print("-" * 50)
-            print("Server command: ", end="", flush=True)
+            self.socket.listen(self.backlog)
+            self.engine = BroadcastEngine(self.connection_failed, self.max_queue_bytes,
+                                          self.max_queue_messages, self.queue_policy)
+            self.engine.start()
+            log.info("TCP Server listening on %s:%s%s", self.host, self.port, " (TLS)" if self.tls_context else "")
+            self.start_recording()
+            self.start_metrics_endpoint()
+            self.start_control()
+            self.start_idle_monitor()
+            self.print_commands()
             
             accept_thread = threading.Thread(target=self.accept_clients)
             accept_thread.daemon = True
             accept_thread.start()
 
-            self.server_commands()
+            self.serve_admin()
                 
         except Exception as e:
-            print(f"TCP Server error: {e}")
+            log.error("TCP Server error: %s", e)
         finally:
             self.running = False
+            self.stop_control()
             if self.socket:
                 self.socket.close()
-            for client_id in list(self.clients.keys()):
+            for client_id in self.clients.ids():
                 self.remove_client(client_id)
-            print("TCP Server stopped")
+            self.stop_recording()
+            if self.engine:
+                self.engine.stop()
+            log.info("TCP Server stopped")
     
+    def print_commands(self):
+        # через тот же вывод, что и события, чтобы справка не обгоняла строку о запуске
+        if self.headless:
+            return
+        log.info("Server commands:\n"
+                 "  send <client_id> <message>  - Send message to specific client\n"
+                 "  broadcast <message>         - Send message to all clients\n"
+                 "  publish <channel> <message>  - Send message to channel subscribers\n"
+                 "  list                        - Show connected clients\n"
+                 "  channels                    - Show channels and subscriber counts\n"
+                 "  metrics                     - Show server metrics\n"
+                 "  quit                        - Exit server\n" + "-" * 50)
+
+    def start_idle_monitor(self):
+        if self.idle is not None:
+            idle_thread = threading.Thread(target=self.watch_idle)
+            idle_thread.daemon = True
+            idle_thread.start()
+
+    def watch_idle(self):
+        # Один таймер на все соединения: отключает клиентов, от которых ничего не
+        # приходило дольше client_timeout (в том числе полуоткрытые соединения)
+        while self.running:
+            time.sleep(IDLE_CHECK_INTERVAL)
+            for client_id in self.idle.expire(time.perf_counter()):
+                self.drop_idle(client_id)
+
+    def drop_idle(self, client_id):
+        self.metrics.inc('connections_dropped', label='idle')
+        log.info("[Client %s] silent for %gs, closing connection", client_id, self.client_timeout)
+        self.remove_client(client_id)
+
+    def track_client(self, client_info):
+        # last_seen - perf_counter последнего сообщения, тот же отсчет, что у замеров
+        client_info.last_seen = time.perf_counter()
+        if self.idle is not None:
+            self.idle.watch(client_info.id, client_info.last_seen)
+        if self.admission is not None:
+            client_info.limiter = self.admission.client_limiter()
+        if self.recorder is not None:
+            self.recorder.connect(client_info.id)
+
+    def admit(self, client_info, size):
+        # None - обработать сообщение, иначе причина отказа для ответа busy
+        if client_info.limiter is not None:
+            self.throttle(client_info, size)
+        return self.shed(size)
+
+    def shed(self, size):
+        # общий лимит сервера: лишнее отклоняется сразу, а не копится в очередях
+        reason = self.admission.admit(size)
+        if reason is not None:
+            self.metrics.inc('throttled', label=reason)
+        return reason
+
+    def throttle(self, client_info, size):
+        # Лимит клиента: поток не читает соединение, пока ведро не пополнится, -
+        # отправителя тормозит переполненное окно TCP, а не очередь сервера
+        while True:
+            wait, bucket = client_info.limiter.wait_time()
+            if not wait:
+                break
+            self.metrics.inc('throttled', label=f"client_{bucket}")
+            time.sleep(wait)
+        client_info.limiter.take(size)
+
+    def over_capacity(self):
+        return self.admission is not None and self.admission.over_capacity(self.connected_count())
+
+    def count_rejected(self, client_address):
+        self.metrics.inc('connections_rejected', label='max_connections')
+        log.warning("Connection from %s rejected: %s connections already open",
+                    client_address, self.admission.max_connections)
+
+    def serve_admin(self):
+        if self.headless:
+            wait_for_shutdown(lambda: self.running)
+        else:
+            self.server_commands()
+            hide_prompt()
+
     def accept_clients(self):
         while self.running:
             try:
                 client_socket, client_address = self.socket.accept()
-                self.client_count += 1
-                client_id = self.client_count
-                
-                print(f"\n[New TCP client #{client_id} from {client_address}]")
-                print("Server command: ", end="", flush=True)
-                
-                self.clients[client_id] = {
-                    'socket': client_socket,
-                    'address': client_address
-                }
-                
+                if self.over_capacity():
+                    self.reject_connection(client_socket, client_address)
+                    continue
+                enable_keepalive(client_socket)
+                client_id = self.next_client_id()
+                self.metrics.inc('connections_accepted')
+
+                # handshake TLS идет в потоке клиента, чтобы не задерживать accept
                 client_thread = threading.Thread(
-                    target=self.handle_client, 
+                    target=self.serve_client,
                     args=(client_id, client_socket, client_address)
                 )
                 client_thread.daemon = True
                 client_thread.start()
                 
-                welcome_msg = f"Welcome to TCP Server! You are client #{client_id}\n"
-                client_socket.send(welcome_msg.encode())
-                
             except Exception as e:
                 if self.running:
-                    print(f"Error accepting client: {e}")
+                    log.error("Error accepting client: %s", e)
     
+    def reject_connection(self, client_socket, client_address):
+        # сверх max_connections: короткий отказ вместо потока на клиента; по TLS
+        # открытый текст клиент не поймет - соединение просто закрывается
+        self.count_rejected(client_address)
+        try:
+            if self.tls_context is None:
+                client_socket.setblocking(False)
+                client_socket.send((TOO_MANY_CONNECTIONS + "\n").encode())
+        except OSError:
+            pass
+        client_socket.close()
+
+    def serve_client(self, client_id, client_socket, client_address):
+        tls = None
+        if self.tls_context is not None:
+            tls = self.accept_tls(client_id, client_socket, client_address)
+            if tls is None:
+                return
+
+        log.info("[New TCP client #%s from %s]", client_id, client_address)
+        # клиент попадает в реестр (и под рассылки) только после handshake
+        self.track_client(self.clients.add(client_id, client_address, socket=client_socket,
+                                           outbox=self.engine.register(client_socket, client_id, tls)))
+        try:
+            self.write(client_id, [self.welcome_message(client_id).encode()])
+        except Exception:
+            self.remove_client(client_id)
+            return
+        self.handle_client(client_id, tls or client_socket, client_address)
+
+    def accept_tls(self, client_id, client_socket, client_address):
+        tls = TLSConnection(client_socket, self.tls_context, server_side=True)
+        try:
+            tls.handshake()
+        except (OSError, ValueError) as e:
+            self.metrics.inc('connections_dropped', label='tls_handshake')
+            log.warning("[Client %s] TLS handshake with %s failed: %s", client_id, client_address, e)
+            client_socket.close()
+            return None
+        self.count_handshake(tls.handshake_time, tls.session_reused)
+        return tls
+
+    def count_handshake(self, seconds, resumed):
+        self.metrics.observe('tls_handshake', seconds)
+        self.metrics.inc('tls_handshakes', label='resumed' if resumed else 'full')
+
     def handle_client(self, client_id, client_socket, client_address):
+        # client_socket - сокет или TLSConnection с тем же интерфейсом чтения
         try:
-            buffer = b""  # Буфер накопления данных
-            
-            while self.running:
-                data = client_socket.recv(1024)
-                if not data:
+            reader = MessageReader(client_socket, self.max_message_size)
+            client_info = self.clients.get(client_id)
+            if client_info is None:
+                return
+
+            for message_bytes in reader:
+                if not self.running:
                     break
-                    
-                buffer += data
-                
-                while b'\n' in buffer:
-                    message_bytes, buffer = buffer.split(b'\n', 1)
-                    
-                    try:
-                        message = message_bytes.decode('utf-8').strip()
-                        if message:
-                            print(f"\n[Client {client_id}] {message}")
-                            print("Server command: ", end="", flush=True)
-
-                            if message.lower() == 'quit':
-                                client_socket.send(b"Goodbye!\n")
-                                return
-                            elif message.lower() == '/ping':
-                                client_socket.send(b"pong\n")
-                            elif message.lower() == '/stats':
-                                response = f"Server stats: Clients connected: {len(self.clients)}\n"
-                                client_socket.send(response.encode())
-                            elif message.lower() == '/help':
-                                response = "Available commands: /help, /stats, /ping, quit\n"
-                                client_socket.send(response.encode())
-                            else:
-                                response = f"Echo: {message}\n"
-                                client_socket.send(response.encode())
-                    except UnicodeDecodeError as e:
-                        print(f"\n[Client {client_id}] UTF-8 decode error: {e}")
-                        print("Server command: ", end="", flush=True)
-                        
+
+                started = time.perf_counter()
+                client_info.last_seen = started
+                self.metrics.inc('messages_in')
+                self.metrics.inc('bytes_in', len(message_bytes) + 1)
+                # пишется все входящее, в том числе то, что затем отклонит лимит
+                if self.recorder is not None:
+                    self.recorder.message(client_id, message_bytes)
+                if self.admission is not None:
+                    reason = self.admit(client_info, len(message_bytes) + 1)
+                    if reason is not None:
+                        self.write(client_id, [(busy_message(reason) + "\n").encode()], flush=not reader.has_message())
+                        continue
+                try:
+                    message = message_bytes.decode('utf-8').strip()
+                    if message:
+                        traffic_log.info("[Client %s] %s", client_id, preview(message))
+
+                        if message.lower() in (BINARY_COMMAND, COMPRESS_COMMAND):
+                            self.enable_binary(client_id, compress=message.lower() == COMPRESS_COMMAND)
+                            self.handle_frames(client_id, client_socket, reader)
+                            return
+
+                        response = self.process_message(client_id, message)
+                        # ответы на пачку сообщений из одного recv уходят одной записью
+                        self.write(client_id, [response.encode()], flush=not reader.has_message())
+                        self.metrics.observe('message_handling', time.perf_counter() - started)
+                        if message.lower() == 'quit':
+                            self.clients[client_id].outbox.drain(timeout=1.0)
+                            return
+                except UnicodeDecodeError as e:
+                    self.metrics.inc('decode_errors')
+                    traffic_log.warning("[Client %s] UTF-8 decode error: %s", client_id, e)
+
+        except MessageTooLargeError as e:
+            self.metrics.inc('connections_dropped', label='message_too_large')
+            log.warning("[Client %s] %s, closing connection", client_id, e)
+        except QueueOverflowError as e:
+            self.metrics.inc('connections_dropped', label='queue_overflow')
+            log.warning("[Client %s] %s, closing connection", client_id, e)
         except ConnectionResetError:
-            print(f"\n[Client {client_id} disconnected unexpectedly]")
-            print("Server command: ", end="", flush=True)
+            self.metrics.inc('connections_dropped', label='reset')
+            log.info("[Client %s disconnected unexpectedly]", client_id)
         except Exception as e:
             if self.running:
-                print(f"\nError with client {client_id}: {e}")
-                print("Server command: ", end="", flush=True)
+                log.error("Error with client %s: %s", client_id, e)
         finally:
             self.remove_client(client_id)
     
+    def enable_binary(self, client_id, compress=False):
+        # Флаг меняется под той же блокировкой, что и отправка, чтобы рассылка
+        # не вклинила текстовую строку после подтверждения
+        client_info = self.clients[client_id]
+        self.metrics.inc('commands', label=COMPRESS_COMMAND if compress else BINARY_COMMAND)
+        with client_info.outbox.lock:
+            if compress:
+                client_info.outbox.push([(compress_ack(self.compress_threshold) + "\n").encode()])
+                client_info.compressor = StreamCompressor(self.compress_threshold)
+                # выброшенный из очереди кадр сломал бы контекст сжатия у клиента
+                if client_info.outbox.policy == POLICY_DROP_OLDEST:
+                    client_info.outbox.policy = POLICY_DISCONNECT
+            else:
+                client_info.outbox.push([BINARY_ACK.encode()])
+            client_info.binary = True
+
+    def handle_frames(self, client_id, client_socket, reader):
+        client_info = self.clients[client_id]
+        while self.running:
+            frame = reader.read_frame()
+            if frame is None:
+                break
+            frame_type, payload = frame
+            started = time.perf_counter()
+            client_info.last_seen = started
+            self.metrics.inc('messages_in')
+            self.metrics.inc('bytes_in', FRAME_HEADER.size + len(payload))
+            if self.recorder is not None:
+                self.recorder.message(client_id, payload, frame_type)
+            if self.admission is not None:
+                reason = self.admit(client_info, FRAME_HEADER.size + len(payload))
+                if reason is not None:
+                    self.write_frame(client_id, FRAME_BUSY, busy_message(reason).encode(), flush=not reader.has_frame())
+                    continue
+
+            if frame_type == FRAME_DATA:
+                # Эхо отправляется как есть, без декодирования payload
+                traffic_log.info("[Client %s] binary data, %s bytes", client_id, len(payload))
+                self.write_frame(client_id, FRAME_ECHO, payload, flush=not reader.has_frame())
+                self.metrics.observe('message_handling', time.perf_counter() - started)
+            elif frame_type == FRAME_COMMAND:
+                message = payload.decode('utf-8', 'replace').strip()
+                traffic_log.info("[Client %s] %s", client_id, preview(message))
+
+                response = self.process_message(client_id, message).rstrip('\n').encode()
+                self.write_frame(client_id, FRAME_REPLY, response, flush=not reader.has_frame())
+                self.metrics.observe('message_handling', time.perf_counter() - started)
+                if message.lower() == 'quit':
+                    self.clients[client_id].outbox.drain(timeout=1.0)
+                    break
+            else:
+                traffic_log.warning("[Client %s] unknown frame type %s", client_id, frame_type)
+
+    def write(self, client_id, buffers, flush=True):
+        # Все записи клиенту идут через его очередь, поэтому сообщения не перемешиваются
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            raise ConnectionError(f"client #{client_id} is disconnected")
+        client_info.outbox.push(buffers, flush)
+        self.count_outgoing(buffers)
+
+    def write_frame(self, client_id, frame_type, payload, flush=True):
+        # Эхо и ответы сжимаются контекстом соединения. Им пользуется только поток
+        # этого клиента, поэтому кадры попадают в очередь в порядке сжатия
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            raise ConnectionError(f"client #{client_id} is disconnected")
+        buffers = self.frame_buffers(client_info.compressor, frame_type, payload)
+        client_info.outbox.push(buffers, flush)
+        self.count_outgoing(buffers, FRAME_HEADER.size + len(payload))
+
+    def frame_buffers(self, compressor, frame_type, payload):
+        if compressor is None:
+            return [pack_frame_header(frame_type, len(payload)), payload]
+        return compressor.frame(frame_type, payload)
+
+    def count_outgoing(self, buffers, size=None):
+        # size - размер кадра до сжатия
+        sent = sum(len(buffer) for buffer in buffers)
+        self.metrics.inc('messages_out')
+        self.metrics.inc('bytes_out', sent)
+        if size is not None and size > sent:
+            self.metrics.inc('compression_saved_bytes', size - sent)
+
+    def deliver(self, client_info, outgoing, shared=None):
+        # Буферы outgoing общие для всех получателей, для клиента выбирается только формат;
+        # shared - кэш сжатого кадра для всех получателей со сжатием
+        text, header, payload = outgoing
+        with client_info.outbox.lock:
+            if not client_info.binary:
+                buffers = [text]
+            elif client_info.compressor is None:
+                buffers = [header, payload]
+            else:
+                buffers = client_info.compressor.shared_frame(outgoing, shared)
+            client_info.outbox.push(buffers)
+        self.count_outgoing(buffers, len(header) + len(payload) if client_info.binary else None)
+
+    def is_lagging(self, client_info):
+        return client_info.outbox.lagging
+
+    def queue_depth(self, client_info):
+        return client_info.outbox.depth()
+
+    def connection_failed(self, outbox):
+        self.metrics.inc('connections_dropped', label='write_failed')
+        self.remove_client(outbox.key)
+
+    def next_client_id(self):
+        self.client_count += 1
+        return self.client_count
+
+    def connected_count(self):
+        return len(self.clients)
+
+    def welcome_message(self, client_id):
+        return f"Welcome to TCP Server! You are client #{client_id}\n"
+
+    def process_message(self, client_id, message):
+        command = message.lower()
+        self.metrics.inc('commands', label=self.command_kind(command))
+        if command == 'quit':
+            return "Goodbye!\n"
+        elif command == '/ping':
+            return "pong\n"
+        elif command == HEARTBEAT_COMMAND:
+            return HEARTBEAT_REPLY + "\n"
+        elif command == '/stats':
+            return self.stats_message(client_id)
+        elif command == '/help':
+            return ("Available commands: /help, /stats, /ping, /heartbeat, /binary, /compress, /subscribe <channel>, "
+                    "/unsubscribe <channel>, /publish <channel> <message>, /channels, quit\n")
+        elif command == COMPRESS_COMMAND:
+            return "Compression is negotiated right after welcome: send /compress instead of /binary\n"
+        elif command.split(' ', 1)[0] in CHANNEL_COMMANDS:
+            return channel_command(self.channels, client_id, message, self.publish) + "\n"
+        else:
+            return f"Echo: {message}\n"
+
+    def command_kind(self, command):
+        name = command.split(' ', 1)[0]
+        if name in ('quit', '/ping', HEARTBEAT_COMMAND, '/stats', '/help', COMPRESS_COMMAND) or name in CHANNEL_COMMANDS:
+            return name
+        return 'unknown' if command.startswith('/') else 'echo'
+
+    def stats_message(self, client_id):
+        client_info = self.clients.get(client_id)
+        queued_messages, queued_bytes = self.queue_depth(client_info) if client_info else (0, 0)
+        counters = self.metrics.counter_values()
+        handling = self.metrics.histogram('message_handling')
+        return (f"Server stats: Clients connected: {self.connected_count()}, "
+                f"your queue: {queued_messages} messages / {queued_bytes} bytes, "
+                f"messages in/out: {counters.get(('messages_in', None), 0)}/{counters.get(('messages_out', None), 0)}, "
+                f"bytes in/out: {counters.get(('bytes_in', None), 0)}/{counters.get(('bytes_out', None), 0)}, "
+                f"handling p99: {handling.percentile(99) * 1000:.3f}ms\n")
+
     def remove_client(self, client_id):
-        if client_id in self.clients:
+        client_info = self.clients.pop(client_id)
+        if client_info is not None:
+            self.channels.remove_client(client_id)
+            self.metrics.inc('connections_closed')
+            if self.recorder is not None:
+                self.recorder.disconnect(client_id)
+            client_info.outbox.close()
             try:
-                self.clients[client_id]['socket'].close()
+                # shutdown будит поток клиента, заблокированный в recv
+                client_info.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                client_info.socket.close()
             except:
                 pass
-            del self.clients[client_id]
-            print(f"\n[Client {client_id} disconnected]")
-            print("Server command: ", end="", flush=True)
+            log.info("[Client %s disconnected]", client_id)
     
     def server_commands(self):
         while self.running:
@@ -156,82 +545,176 @@ class TCPServer:
                     message = command[10:]
                     self.broadcast_to_all(message)
                     print("Server command: ", end="", flush=True)
+                elif command.startswith('publish '):
+                    parts = command.split(' ', 2)
+                    if len(parts) >= 3:
+                        self.publish_to_channel(parts[1], parts[2])
+                    else:
+                        print("Usage: publish <channel> <message>")
+                    print("Server command: ", end="", flush=True)
                 elif command == 'list':
                     self.list_clients()
                     print("Server command: ", end="", flush=True)
+                elif command == 'channels':
+                    self.list_channels()
+                    print("Server command: ", end="", flush=True)
+                elif command == 'metrics':
+                    print(self.metrics.render_text())
+                    print("Server command: ", end="", flush=True)
                 else:
-                    print("Unknown command. Available: send, broadcast, list, quit")
+                    print("Unknown command. Available: send, broadcast, publish, list, channels, metrics, quit")
                     print("Server command: ", end="", flush=True)
                     
             except Exception as e:
                 print(f"Error: {e}")
                 print("Server command: ", end="", flush=True)
     
+    # Команды администратора: control_* возвращают результат в виде словаря
+    # (его же получает управляющий сокет), методы ниже выводят его в консоль
     def send_to_client(self, client_id, message):
-        if not self.clients:
+        result = self.control_send(client_id, message)
+        print(f"Sent to client #{client_id}: {message}" if result['ok'] else result['error'])
+
+    def broadcast_to_all(self, message):
+        result = self.control_broadcast(message)
+        if not result['delivered'] and not result.get('dropped'):
             print("No clients connected")
             return
-        
-        if client_id not in self.clients:
-            print(f"Client #{client_id} not found")
+        print(f"Broadcasted to {result['delivered']} clients: {message}")
+        if result.get('dropped') or result.get('lagging'):
+            print(f"  dropped slow/disconnected: {result['dropped']}, lagging: {result['lagging']}")
+
+    def list_clients(self):
+        clients = self.control_list()
+        if not clients:
+            print("No clients connected")
             return
-            
+
+        print("Connected clients:")
+        for client in clients:
+            mode = " [binary]" if client['binary'] else ""
+            if client['compressed']:
+                mode += " [compressed]"
+            if client['lagging']:
+                mode += " [lagging]"
+            print(f"  {client['id']}. {client['address']}{mode} "
+                  f"(queue: {client['queued_messages']} messages, {client['queued_bytes']} bytes)")
+
+    def publish_to_channel(self, channel, message):
+        result = self.control_publish(channel, message)
+        print(f"Published to {channel}: {result['delivered']} subscribers")
+
+    def list_channels(self):
+        channels = self.control_channels()
+        if not channels:
+            print("No channels")
+            return
+
+        print("Channels:")
+        for channel, subscribers in sorted(channels.items()):
+            print(f"  {channel}: {subscribers} subscribers")
+
+    def control_send(self, client_id, message):
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            return {'ok': False, 'error': f"Client #{client_id} not found"}
+
         try:
-            client_socket = self.clients[client_id]['socket']
-            full_message = f"Server: {message}\n"
-            client_socket.send(full_message.encode())
-            print(f"Sent to client #{client_id}: {message}")
+            self.deliver(client_info, encode_outgoing(FRAME_SERVER, "Server: ", message))
         except Exception as e:
-            print(f"Error sending to client #{client_id}: {e}")
             self.remove_client(client_id)
-    
-    def broadcast_to_all(self, message):
-        if not self.clients:
-            print("No clients connected")
-            return
-            
-        full_message = f"Broadcast from server: {message}\n"
+            return {'ok': False, 'error': f"Error sending to client #{client_id}: {e}"}
+        return {'ok': True, 'client': client_id}
+
+    def control_broadcast(self, message):
+        outgoing = encode_outgoing(FRAME_BROADCAST, "Broadcast from server: ", message)
+        delivered, dropped = self.deliver_to(self.clients.ids(), outgoing)
+        lagging = sum(1 for client_info in self.clients.records() if self.is_lagging(client_info))
+        return {'ok': True, 'delivered': delivered, 'dropped': dropped, 'lagging': lagging}
+
+    def control_publish(self, channel, message):
+        delivered = self.publish(channel, channel_message(channel, "Server", message))
+        return {'ok': True, 'channel': channel, 'delivered': delivered}
+
+    def control_channels(self):
+        return self.channels.counts()
+
+    def publish(self, channel, text):
+        # Возвращает число подписчиков, которым ушло сообщение
+        self.metrics.inc('channel_messages')
+        return self.deliver_channel(channel, text)
+
+    def deliver_channel(self, channel, text):
+        # Сообщение кодируется один раз и ставится в очереди только подписчиков канала
+        outgoing = encode_outgoing(FRAME_CHANNEL, "", text)
+        delivered, dropped = self.deliver_to(self.channels.members(channel), outgoing)
+        return delivered
+
+    def deliver_to(self, client_ids, outgoing):
+        # Возвращает (доставлено, отключено из-за ошибки записи)
+        delivered = 0
         disconnected_clients = []
-        
-        for client_id, client_info in self.clients.items():
+        shared = {}
+        for client_id in client_ids:
+            client_info = self.clients.get(client_id)
+            if client_info is None:
+                continue
             try:
-                client_info['socket'].send(full_message.encode())
+                self.deliver(client_info, outgoing, shared)
+                delivered += 1
             except Exception as e:
                 disconnected_clients.append(client_id)
-        
+
         for client_id in disconnected_clients:
             self.remove_client(client_id)
-            
-        print(f"Broadcasted to {len(self.clients)} clients: {message}")
-    
-    def list_clients(self):
-        if not self.clients:
-            print("No clients connected")
-            return
-        
-        print("Connected clients:")
-        for client_id, client_info in self.clients.items():
-            print(f"  {client_id}. {client_info['address']}")
+        return delivered, len(disconnected_clients)
+
+    def control_list(self):
+        clients = []
+        for client_id, client_info in sorted(self.clients.items()):
+            queued_messages, queued_bytes = self.queue_depth(client_info)
+            clients.append({'id': client_id, 'address': client_info.address,
+                            'binary': bool(client_info.binary), 'compressed': client_info.compressor is not None,
+                            'lagging': self.is_lagging(client_info),
+                            'queued_messages': queued_messages, 'queued_bytes': queued_bytes})
+        return clients
 
 class TCPClient:
-    def __init__(self, host='localhost', port=8888):
+    def __init__(self, host='localhost', port=8888, max_message_size=DEFAULT_MAX_MESSAGE_SIZE,
+                 binary=False, compress=False, tls=None, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL):
         self.host = host
         self.port = port
+        self.tls = tls  # TLSClient: контекст и кэш сессий для возобновления
+        self.max_message_size = max_message_size
+        self.compress = compress
+        self.binary = binary or compress  # сжатые сообщения приходят кадрами
+        self.binary_active = False
+        self.decompressor = FrameDecompressor(max_message_size)
+        self.heartbeat_interval = heartbeat_interval
+        self.send_lock = threading.Lock()  # поток ввода и поток heartbeat пишут в один сокет
+        self.last_sent = 0.0
+        self.last_received = 0.0
+        self.connected = False
         self.running = True
         self.socket = None
         
     def start(self):
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
-            print(f"Connected to TCP server at {self.host}:{self.port}")
+            self.connect()
             print("Type 'quit' to exit, '/ping' to test connection")
+            if self.binary:
+                print("Binary framing requested, '/sendfile <path>' sends a file as one message")
             print("Client is now listening for server messages...")
             print("Enter message: ", end="", flush=True)
             
             listen_thread = threading.Thread(target=self.listen_messages)
             listen_thread.daemon = True
             listen_thread.start()
+
+            if self.heartbeat_interval:
+                heartbeat_thread = threading.Thread(target=self.send_heartbeats)
+                heartbeat_thread.daemon = True
+                heartbeat_thread.start()
             
             self.send_messages()
                 
@@ -242,40 +725,157 @@ class TCPClient:
             if self.socket:
                 self.socket.close()
             print("TCP Client stopped")
-    
+
+    def connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect((self.host, self.port))
+            print(f"Connected to TCP server at {self.host}:{self.port}")
+            if self.tls is not None:
+                sock = self.tls.wrap(sock, self.host)
+                print(f"{sock.version}, {'resumed session' if sock.session_reused else 'full handshake'}, "
+                      f"{sock.handshake_time * 1000:.1f}ms")
+            self.binary_active = False
+            self.decompressor = FrameDecompressor(self.max_message_size)
+            self.last_sent = self.last_received = time.monotonic()
+            if self.binary:
+                # Все, что отправлено после /binary (/compress), сервер уже читает как кадры
+                command = COMPRESS_COMMAND if self.compress else BINARY_COMMAND
+                sock.sendall(f"{command}\n".encode())
+        except BaseException:
+            sock.close()
+            raise
+        self.socket = sock
+        self.connected = True
+
+    def reconnect(self):
+        # Сервер пропал: переподключение с экспоненциальной задержкой и разбросом,
+        # пока пользователь не введет quit
+        self.connected = False
+        self.socket.close()
+        attempt = 0
+        while self.running:
+            delay = backoff_delay(attempt)
+            attempt += 1
+            print(f"\nReconnecting in {delay:.1f}s...")
+            time.sleep(delay)
+            try:
+                self.connect()
+                print("Enter message: ", end="", flush=True)
+                return True
+            except OSError as e:
+                print(f"Reconnect failed: {e}")
+        return False
+
+    def send_heartbeats(self):
+        # /heartbeat после heartbeat_interval без отправки - сервер не отключит молчащего
+        # пользователя; если от сервера ничего нет DEAD_PEER_INTERVALS интервалов,
+        # соединение закрывается, и поток чтения переподключается
+        while self.running:
+            time.sleep(min(IDLE_CHECK_INTERVAL, self.heartbeat_interval))
+            now = time.monotonic()
+            if not self.connected:
+                continue
+            if now - self.last_received > DEAD_PEER_INTERVALS * self.heartbeat_interval:
+                print("\nServer is not responding, closing connection")
+                self.last_received = now
+                try:
+                    self.socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            elif now - self.last_sent >= self.heartbeat_interval:
+                try:
+                    self.send_message(HEARTBEAT_COMMAND)
+                except OSError:
+                    pass
+
     def listen_messages(self):
-        buffer = b"" # Буфер накопления данных
-        
+        reader = MessageReader(self.socket, self.max_message_size)
+
         while self.running:
             try:
-                data = self.socket.recv(1024)
-                if not data:
+                if self.binary_active:
+                    frame = reader.read_frame()
+                    if frame is None:
+                        print("\nServer closed the connection")
+                        if not self.reconnect():
+                            break
+                        reader = MessageReader(self.socket, self.max_message_size)
+                        continue
+                    self.last_received = time.monotonic()
+                    self.show_frame(*frame)
+                    continue
+
+                message_bytes = reader.read_message()
+                if message_bytes is None:
                     print("\nServer closed the connection")
-                    self.running = False
-                    break
-                    
-                buffer += data
+                    if not self.reconnect():
+                        break
+                    reader = MessageReader(self.socket, self.max_message_size)
+                    continue
 
-                while b'\n' in buffer:
-                    message_bytes, buffer = buffer.split(b'\n', 1)
-                    
-                    try:
-                        message = message_bytes.decode('utf-8').strip()
-                        if message:
-                            print(f"\n>>> {message}")
-                            print("Enter message: ", end="", flush=True)
-                    except UnicodeDecodeError:
-                        print(f"\n>>> [Invalid UTF-8 data received]")
+                self.last_received = time.monotonic()
+                try:
+                    message = message_bytes.decode('utf-8').strip()
+                    if message and message != HEARTBEAT_REPLY:
+                        print(f"\n>>> {message}")
                         print("Enter message: ", end="", flush=True)
-                    
-            except ConnectionResetError:
-                print("\nConnection reset by server")
+                        if self.binary and (message == BINARY_ACK.strip() or message.startswith(COMPRESS_ACK)):
+                            self.binary_active = True
+                except UnicodeDecodeError:
+                    print(f"\n>>> [Invalid UTF-8 data received]")
+                    print("Enter message: ", end="", flush=True)
+
+            except MessageTooLargeError as e:
+                print(f"\nError receiving message: {e}")
                 self.running = False
                 break
+            except ConnectionResetError:
+                print("\nConnection reset by server")
+                if not self.reconnect():
+                    break
+                reader = MessageReader(self.socket, self.max_message_size)
             except Exception as e:
                 if self.running:
                     print(f"\nError receiving message: {e}")
     
+    def show_frame(self, frame_type, payload):
+        frame_type, payload = self.decompressor.unpack(frame_type, payload)
+        if frame_type == FRAME_REPLY and payload == HEARTBEAT_REPLY.encode():
+            return
+        prefixes = {
+            FRAME_ECHO: "Echo: ",
+            FRAME_REPLY: "",
+            FRAME_SERVER: "Server: ",
+            FRAME_BROADCAST: "Broadcast from server: ",
+            FRAME_CHANNEL: "",
+            FRAME_BUSY: ""
+        }
+        try:
+            text = payload.decode('utf-8')
+        except UnicodeDecodeError:
+            text = f"[binary data, {len(payload)} bytes]"
+        print(f"\n>>> {prefixes.get(frame_type, f'[frame {frame_type}] ')}{text}")
+        print("Enter message: ", end="", flush=True)
+
+    def send_message(self, message):
+        with self.send_lock:
+            if not self.binary:
+                self.socket.sendall((message + '\n').encode())
+            elif message.startswith('/') or message.lower() == 'quit':
+                send_frame(self.socket, FRAME_COMMAND, message.encode())
+            else:
+                send_frame(self.socket, FRAME_DATA, message.encode())
+            self.last_sent = time.monotonic()
+
+    def send_file(self, path):
+        with open(path, 'rb') as f:
+            payload = f.read()
+        with self.send_lock:
+            send_frame(self.socket, FRAME_DATA, payload)
+            self.last_sent = time.monotonic()
+        print(f"Sent {len(payload)} bytes from {path}")
+
     def send_messages(self):
         while self.running:
             try:
@@ -283,12 +883,15 @@ class TCPClient:
                 
                 if message.lower() == 'quit':
                     self.running = False
-                    self.socket.send((message + '\n').encode())
+                    self.send_message(message)
                     break
                 elif message.lower() == '/ping':
-                    self.socket.send((message + '\n').encode())
+                    self.send_message(message)
+                elif self.binary and message.startswith('/sendfile '):
+                    self.send_file(message[len('/sendfile '):].strip())
+                    print("Enter message: ", end="", flush=True)
                 elif message.strip():
-                    self.socket.send((message + '\n').encode())
+                    self.send_message(message)
                     print("Enter message: ", end="", flush=True)
                 
             except Exception as e:
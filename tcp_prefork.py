@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import console
+from console import log
+from framing import DEFAULT_MAX_MESSAGE_SIZE, FRAME_SERVER, FRAME_BROADCAST, encode_outgoing
+from compression import DEFAULT_COMPRESS_THRESHOLD
+from outbound import DEFAULT_MAX_QUEUE_BYTES, DEFAULT_MAX_QUEUE_MESSAGES, DEFAULT_POLICY
+from tcp_communication import TCPServer, DEFAULT_BACKLOG
+from tcp_async import AsyncTCPServer
+
+METRICS_REPORT_INTERVAL = 1.0
+
+class PreforkWorker(AsyncTCPServer):
+    # Воркер принимает соединения на общем порту (SO_REUSEPORT), а о своих клиентах
+    # сообщает мастеру через очередь событий
+    def __init__(self, index, host, port, backlog, max_message_size, max_queue_bytes,
+                 max_queue_messages, queue_policy, compress_threshold, tls_context, client_timeout,
+                 admission, record_path, next_id, connected, events, commands):
+        # каждый воркер пишет свой журнал <путь>.<номер>, воспроизведение сливает их по времени
+        super().__init__(host, port, backlog, max_message_size, max_queue_bytes,
+                         max_queue_messages, queue_policy, compress_threshold=compress_threshold,
+                         tls_context=tls_context, client_timeout=client_timeout, admission=admission,
+                         record_path=record_path and f"{record_path}.{index}")
+        self.index = index
+        self.next_id = next_id
+        self.connected = connected
+        self.events = events
+        self.commands = commands
+        self.reuse_port = True
+
+    def run(self):
+        try:
+            self.raise_fd_limit()
+            self.loop = asyncio.new_event_loop()
+            self.server = self.loop.run_until_complete(self.create_server())
+            self.start_recording()
+        except Exception as e:
+            self.events.put(('error', self.index, str(e)))
+            return
+
+        self.events.put(('ready', self.index, os.getpid()))
+        self.start_task(self.report_metrics())
+        self.start_idle_monitor()
+
+        command_thread = threading.Thread(target=self.read_commands)
+        command_thread.daemon = True
+        command_thread.start()
+
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.running = False
+            self.loop.run_until_complete(self.close_all())
+            self.loop.close()
+            self.stop_recording()
+            # Мастер может уже не читать очередь событий - не ждем ее сброса при выходе
+            self.events.cancel_join_thread()
+
+    async def report_metrics(self):
+        # метрики воркера периодически отправляются мастеру, он показывает сумму
+        while self.running:
+            await asyncio.sleep(METRICS_REPORT_INTERVAL)
+            self.events.put(('metrics', self.index, self.metrics.snapshot()))
+            self.events.put(('channels', self.index, self.channels.counts()))
+            self.events.put(('queues', self.index, self.queue_depths()))
+
+    def queue_depths(self):
+        # только клиенты с непустой очередью: у остальных мастер покажет нули, а отчет
+        # воркера с тысячами простаивающих клиентов остается маленьким
+        depths = {}
+        for client_id, client_info in self.clients.items():
+            queued_messages, queued_bytes = self.queue_depth(client_info)
+            if queued_messages or queued_bytes:
+                depths[client_id] = (queued_messages, queued_bytes, self.is_lagging(client_info))
+        return depths
+
+    def read_commands(self):
+        while True:
+            command = self.commands.get()
+            if command[0] == 'stop':
+                console.hide_prompt()
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                break
+            elif command[0] == 'send':
+                self.loop.call_soon_threadsafe(self.write_to_client, command[1], command[2])
+            elif command[0] == 'broadcast':
+                self.loop.call_soon_threadsafe(self.write_to_all, command[1])
+            elif command[0] == 'publish':
+                self.deliver_channel(command[1], command[2])
+
+    def publish(self, channel, text):
+        # Подписчики канала есть и у других воркеров - им сообщение передает мастер
+        delivered = super().publish(channel, text)
+        self.events.put(('publish', self.index, channel, text))
+        return delivered
+
+    def next_client_id(self):
+        with self.next_id.get_lock():
+            self.next_id.value += 1
+            return self.next_id.value
+
+    def connected_count(self):
+        return self.connected.value
+
+    def add_client(self, client_id, writer, client_address):
+        super().add_client(client_id, writer, client_address)
+        with self.connected.get_lock():
+            self.connected.value += 1
+        self.events.put(('join', client_id, client_address, self.index))
+
+    def remove_client(self, client_id):
+        if client_id not in self.clients:
+            return
+        super().remove_client(client_id)
+        with self.connected.get_lock():
+            self.connected.value -= 1
+        self.events.put(('leave', client_id))
+
+def run_worker(index, host, port, backlog, max_message_size, max_queue_bytes,
+               max_queue_messages, queue_policy, compress_threshold, tls_context, client_timeout,
+               admission, record_path, next_id, connected, events, commands, log_settings):
+    # поток вывода мастера не переживает fork - у воркера свой
+    console.configure(*log_settings)
+    worker = PreforkWorker(index, host, port, backlog, max_message_size, max_queue_bytes,
+                           max_queue_messages, queue_policy, compress_threshold, tls_context,
+                           client_timeout, admission, record_path, next_id, connected, events, commands)
+    worker.run()
+    logging.shutdown()
+
+class PreforkTCPServer(TCPServer):
+    # Мастер-процесс: запускает воркеров, держит общий реестр клиентов и принимает
+    # команды администратора
+    def __init__(self, host='localhost', port=8888, workers=None, backlog=DEFAULT_BACKLOG,
+                 max_message_size=DEFAULT_MAX_MESSAGE_SIZE, max_queue_bytes=DEFAULT_MAX_QUEUE_BYTES,
+                 max_queue_messages=DEFAULT_MAX_QUEUE_MESSAGES, queue_policy=DEFAULT_POLICY,
+                 metrics_port=None, headless=False, control_socket=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD, tls_context=None,
+                 client_timeout=0, admission=None, record_path=None):
+        super().__init__(host, port, max_message_size, max_queue_bytes,
+                         max_queue_messages, queue_policy, metrics_port, headless, control_socket,
+                         compress_threshold, tls_context, client_timeout, backlog, admission,
+                         record_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = []
+        self.commands = []
+        self.events = None
+        self.next_id = None
+        self.connected = None
+        self.channel_counts = {}  # {воркер: {канал: подписчиков}} из периодических отчетов
+        self.client_queues = {}   # {воркер: {клиент: (сообщений, байт, отстает)}} оттуда же
+
+    def start(self):
+        try:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+
+            self.events = multiprocessing.Queue()
+            self.next_id = multiprocessing.Value('q', 0)
+            self.connected = multiprocessing.Value('q', 0)
+
+            for index in range(self.workers):
+                commands = multiprocessing.Queue()
+                process = multiprocessing.Process(
+                    target=run_worker,
+                    args=(index, self.host, self.port, self.backlog,
+                          self.max_message_size, self.max_queue_bytes,
+                          self.max_queue_messages, self.queue_policy, self.compress_threshold,
+                          # контекст наследуется при fork: у воркеров общий ключ билетов,
+                          # и сессия возобновляется, даже если соединение попало к другому воркеру
+                          self.tls_context, self.client_timeout,
+                          # предел соединений общий (счетчик connected), а общий лимит
+                          # сообщений делится между воркерами
+                          self.admission and self.admission.per_worker(self.workers), self.record_path,
+                          self.next_id, self.connected, self.events, commands, console.settings)
+                )
+                process.daemon = True
+                process.start()
+                self.processes.append(process)
+                self.commands.append(commands)
+
+            self.wait_workers()
+
+            log.info("TCP Server (prefork, %s workers) listening on %s:%s%s", self.workers, self.host, self.port,
+                     " (TLS)" if self.tls_context else "")
+            self.start_metrics_endpoint()
+            self.start_control()
+            self.print_commands()
+
+            events_thread = threading.Thread(target=self.read_events)
+            events_thread.daemon = True
+            events_thread.start()
+
+            self.serve_admin()
+
+        except Exception as e:
+            log.error("TCP Server error: %s", e)
+        finally:
+            self.running = False
+            self.stop_control()
+            self.stop_workers()
+            log.info("TCP Server stopped")
+
+    def wait_workers(self):
+        ready = 0
+        while ready < self.workers:
+            event = self.events.get(timeout=10)
+            if event[0] == 'error':
+                raise RuntimeError(f"worker {event[1]} failed to start: {event[2]}")
+            elif event[0] == 'ready':
+                ready += 1
+
+    def stop_workers(self):
+        for commands in self.commands:
+            commands.put(('stop',))
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def read_events(self):
+        while self.running:
+            try:
+                event = self.events.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            if event[0] == 'join':
+                _, client_id, client_address, worker = event
+                self.clients.add(client_id, client_address, worker=worker)
+                self.client_count = max(self.client_count, client_id)
+            elif event[0] == 'leave':
+                self.clients.pop(event[1])
+            elif event[0] == 'metrics':
+                self.metrics.set_external(f"worker{event[1]}", event[2])
+            elif event[0] == 'channels':
+                self.channel_counts[event[1]] = event[2]
+            elif event[0] == 'queues':
+                self.client_queues[event[1]] = event[2]
+            elif event[0] == 'publish':
+                _, origin, channel, text = event
+                for index, commands in enumerate(self.commands):
+                    if index != origin:
+                        commands.put(('publish', channel, text))
+
+    def register_gauges(self):
+        # очереди клиентов живут в воркерах - их значения приходят в снимках метрик
+        pass
+
+    def connected_count(self):
+        return self.connected.value
+
+    def remove_client(self, client_id):
+        self.clients.pop(client_id)
+
+    def control_send(self, client_id, message):
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            return {'ok': False, 'error': f"Client #{client_id} not found"}
+
+        outgoing = encode_outgoing(FRAME_SERVER, "Server: ", message)
+        self.commands[client_info.worker].put(('send', client_id, outgoing))
+        return {'ok': True, 'client': client_id}
+
+    def control_broadcast(self, message):
+        outgoing = encode_outgoing(FRAME_BROADCAST, "Broadcast from server: ", message)
+        for commands in self.commands:
+            commands.put(('broadcast', outgoing))
+        return {'ok': True, 'delivered': len(self.clients)}
+
+    def publish(self, channel, text):
+        # Каналы живут в воркерах; число подписчиков - по последним отчетам воркеров
+        self.metrics.inc('channel_messages')
+        for commands in self.commands:
+            commands.put(('publish', channel, text))
+        return self.control_channels().get(channel, 0)
+
+    def control_channels(self):
+        channels = {}
+        for counts in list(self.channel_counts.values()):
+            for channel, subscribers in counts.items():
+                channels[channel] = channels.get(channel, 0) + subscribers
+        return channels
+
+    def control_list(self):
+        # очереди клиентов живут в воркерах - глубина по их последним отчетам
+        clients = []
+        for client_id, client_info in sorted(self.clients.items()):
+            depths = self.client_queues.get(client_info.worker, {})
+            queued_messages, queued_bytes, lagging = depths.get(client_id, (0, 0, False))
+            clients.append({'id': client_id, 'address': client_info.address, 'worker': client_info.worker,
+                            'lagging': lagging, 'queued_messages': queued_messages,
+                            'queued_bytes': queued_bytes})
+        return clients
+
+    def list_clients(self):
+        clients = self.control_list()
+        if not clients:
+            print("No clients connected")
+            return
+
+        print("Connected clients:")
+        for client in clients:
+            mode = " [lagging]" if client['lagging'] else ""
+            print(f"  {client['id']}. {client['address']} (worker {client['worker']}){mode} "
+                  f"(queue: {client['queued_messages']} messages, {client['queued_bytes']} bytes)")
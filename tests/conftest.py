@@ -0,0 +1,71 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import pytest
+
+# модули приложения лежат в корне репозитория, а не в пакете
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class ServerProcess:
+    # network_app.py --headless в отдельном процессе: сервер целиком, как в работе
+    def __init__(self, mode, *options):
+        self.port = free_port()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, 'network_app.py'), '--mode', mode, '--host', '127.0.0.1',
+             '--port', str(self.port), '--headless', *options],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # вывод читается все время работы, иначе сервер встанет на заполненном pipe
+        self.lines = []
+        self.listening = threading.Event()
+        reader = threading.Thread(target=self.read_output)
+        reader.daemon = True
+        reader.start()
+        if not self.listening.wait(10) or self.process.poll() is not None:
+            self.stop()
+            raise RuntimeError(f"{mode} server did not start:\n{self.output}")
+
+    def read_output(self):
+        for line in self.process.stdout:
+            self.lines.append(line.decode('utf-8', 'replace'))
+            if 'listening on' in self.lines[-1]:
+                self.listening.set()
+        self.listening.set()
+
+    @property
+    def output(self):
+        return ''.join(self.lines)
+
+    def connect(self):
+        sock = socket.create_connection(('127.0.0.1', self.port), timeout=5)
+        return sock, sock.makefile('rb')
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        return self.output
+
+@pytest.fixture
+def server():
+    # server('tcp-server', '--max-connections', '1') запускает сервер; остановка - после теста
+    servers = []
+    def start(mode, *options):
+        servers.append(ServerProcess(mode, *options))
+        return servers[-1]
+    yield start
+    for process in servers:
+        process.stop()
@@ -0,0 +1,34 @@
+from channels import MAX_CHANNELS_PER_CLIENT, ChannelIndex, channel_command
+
+def test_subscribe_and_remove_client():
+    channels = ChannelIndex()
+    assert channels.subscribe(1, 'news') and channels.subscribe(2, 'news')
+    assert not channels.subscribe(1, 'news')
+    channels.subscribe(1, 'sport')
+    assert sorted(channels.members('news')) == [1, 2] and channels.channels_of(1) == ['news', 'sport']
+    assert channels.subscription_count() == 3
+    assert channels.remove_client(1) == ['news', 'sport']
+    # пустые каналы не хранятся
+    assert channels.counts() == {'news': 1} and len(channels) == 1
+    assert channels.unsubscribe(2, 'news') and not channels.unsubscribe(2, 'news')
+    assert len(channels) == 0 and not channels.memberships
+
+def test_channel_limit_per_client():
+    channels = ChannelIndex()
+    for index in range(MAX_CHANNELS_PER_CLIENT):
+        channels.subscribe(1, f"channel-{index}")
+    reply = channel_command(channels, 1, '/subscribe extra', None)
+    assert reply.startswith("Cannot subscribe to extra")
+    assert 'extra' not in channels.subscribers
+
+def test_commands_publish_to_channel():
+    channels = ChannelIndex()
+    published = []
+    publish = lambda channel, text: published.append((channel, text))
+    assert channel_command(channels, 7, '/channels', publish) == "You are not subscribed to any channel"
+    assert channel_command(channels, 7, '/subscribe news', publish) == "Subscribed to news"
+    assert channel_command(channels, 7, '/publish news hello there', publish) == "Published to news"
+    assert published == [('news', "[news] Client #7: hello there")]
+    assert channel_command(channels, 7, '/publish news', publish) == "Usage: /publish <channel> <message>"
+    assert channel_command(channels, 7, '/subscribe', publish) == "Usage: /subscribe <channel>"
+    assert channel_command(channels, 7, '/unsubscribe sport', publish) == "Not subscribed to sport"
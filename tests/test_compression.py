@@ -0,0 +1,48 @@
+import random
+import pytest
+from compression import (
+    StreamCompressor, FrameDecompressor, compress_datagram, decompress_datagram, deflate, inflate,
+    is_compressed_datagram
+)
+from framing import FRAME_DATA, FRAME_HEADER, MessageTooLargeError
+
+def split_frame(buffers):
+    data = b''.join(buffers)
+    size, frame_type = FRAME_HEADER.unpack_from(data)
+    return frame_type, data[FRAME_HEADER.size:]
+
+def test_stream_frames_share_context():
+    compressor = StreamCompressor(threshold=16)
+    decompressor = FrameDecompressor(1 << 20)
+    message = b'repeated payload ' * 100
+    first = split_frame(compressor.frame(FRAME_DATA, message))
+    second = split_frame(compressor.frame(FRAME_DATA, message))
+    # повтор уже сжатого сообщения в том же контексте заметно короче
+    assert len(second[1]) < len(first[1]) < len(message)
+    assert decompressor.unpack(*first) == (FRAME_DATA, message)
+    assert decompressor.unpack(*second) == (FRAME_DATA, message)
+    assert split_frame(compressor.frame(FRAME_DATA, b'short')) == (FRAME_DATA, b'short')
+
+def test_shared_frame_compressed_once():
+    payload = b'broadcast ' * 100
+    outgoing = ('text', FRAME_HEADER.pack(len(payload), FRAME_DATA), payload)
+    shared = {}
+    first = StreamCompressor(threshold=64).shared_frame(outgoing, shared)
+    second = StreamCompressor(threshold=64).shared_frame(outgoing, shared)
+    assert first is second
+    assert FrameDecompressor(1 << 20).unpack(*split_frame(first)) == (FRAME_DATA, payload)
+
+def test_inflate_limits_size():
+    bomb = deflate(b'\0' * 100000)
+    assert inflate(bomb, 100000) == b'\0' * 100000
+    with pytest.raises(MessageTooLargeError):
+        inflate(bomb, 1000)
+
+def test_datagram_compressed_only_when_shorter():
+    text = b'hello ' * 200
+    compressed = compress_datagram(text, 512)
+    assert is_compressed_datagram(compressed) and len(compressed) < len(text)
+    assert decompress_datagram(compressed, 65507) == text
+    assert compress_datagram(b'short', 512) == b'short'
+    noise = random.Random(1).randbytes(1000)
+    assert compress_datagram(noise, 512) == noise
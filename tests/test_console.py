@@ -0,0 +1,38 @@
+import logging
+import console
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+def test_logger_class_of_process_is_untouched():
+    assert logging.getLoggerClass() is logging.Logger
+    assert type(logging.getLogger('some.library')) is logging.Logger
+    assert logging.logThreads and logging.logProcesses
+
+def test_traffic_log_is_rate_limited_and_follows_level():
+    handler = Collect()
+    console.log.addHandler(handler)
+    level = console.log.level
+    try:
+        console.log.setLevel(logging.INFO)
+        console.traffic_log.limiter = console.RateLimiter(3)
+        for index in range(10):
+            console.traffic_log.info("message %s", index)
+        assert handler.messages == ['message 0', 'message 1', 'message 2']
+        assert console.traffic_log.limiter.take_suppressed() == 7
+
+        # уровень меняется уже после первых записей
+        console.traffic_log.limiter = None
+        console.log.setLevel(logging.WARNING)
+        console.traffic_log.info("hidden")
+        console.traffic_log.warning("shown")
+        assert handler.messages[-1] == 'shown' and 'hidden' not in handler.messages
+    finally:
+        console.log.removeHandler(handler)
+        console.log.setLevel(level)
+        console.traffic_log.limiter = None
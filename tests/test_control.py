@@ -0,0 +1,21 @@
+import json
+import os
+import socket
+import time
+
+def test_reply_not_held_for_partial_next_command(server, tmp_path):
+    path = str(tmp_path / 'control.sock')
+    server('tcp-server', '--control-socket', path)
+    # управляющий сокет создается после строки о запуске
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    sock = socket.socket(socket.AF_UNIX)
+    sock.settimeout(5)
+    sock.connect(path)
+    stream = sock.makefile('rb')
+    sock.sendall(b'{"command": "list", "id": 1}\nli')
+    assert json.loads(stream.readline()) == {'ok': True, 'clients': [], 'command': 'list', 'id': 1}
+    sock.sendall(b'st\n')
+    assert json.loads(stream.readline())['clients'] == []
+    sock.close()
@@ -0,0 +1,41 @@
+from expiry import ExpiryIndex, COMPACT_MIN
+
+def test_expires_only_inactive_keys():
+    index = ExpiryIndex(10)
+    index.touch('a', 0)
+    index.touch('b', 0)
+    index.touch('b', 8)
+    assert index.expire(5) == []
+    assert index.expire(10) == ['a']
+    assert index.expire(17) == []
+    assert index.expire(18) == ['b']
+    assert len(index) == 0 and not index.heap
+
+def test_discard_then_touch_keeps_one_entry():
+    index = ExpiryIndex(10)
+    index.touch('a', 0)
+    index.discard('a')
+    index.touch('a', 1)
+    for now in range(2, 11):
+        index.touch('a', now)
+        assert index.expire(now) == []
+    # устаревшая запись выброшена, живая перенесена - в куче одна запись
+    assert len(index.heap) == 1
+    assert index.expire(21) == ['a']
+    assert not index.heap
+
+def test_discarded_key_never_expires():
+    index = ExpiryIndex(10)
+    index.touch('a', 0)
+    index.discard('a')
+    assert index.expire(100) == []
+    index.discard('missing')
+
+def test_forget_and_register_cycles_do_not_grow_heap():
+    index = ExpiryIndex(300)
+    for now in range(10000):
+        index.touch('client', now)
+        index.discard('client')
+    index.touch('client', 10000)
+    assert len(index.heap) <= COMPACT_MIN + 1
+    assert index.expire(10300) == ['client']
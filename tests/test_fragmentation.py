@@ -0,0 +1,95 @@
+import random
+import fragmentation
+from fragmentation import FRAGMENT_HEADER, Fragmenter, Reassembler, is_fragment
+
+ADDRESS = ('192.0.2.1', 5000)
+
+def fixed_mtu(monkeypatch, mtu=576):
+    # MTU маршрута без обращения к ядру; вызовы считаются
+    calls = []
+    def path_mtu(address):
+        calls.append(address)
+        return mtu
+    monkeypatch.setattr(fragmentation, 'path_mtu', path_mtu)
+    return calls
+
+def test_split_and_reassemble_out_of_order(monkeypatch):
+    fixed_mtu(monkeypatch)
+    message = random.Random(1).randbytes(20000)
+    fragments = Fragmenter().split(message, ADDRESS)
+    assert len(fragments) > 1
+    assert all(len(fragment) <= 576 - 28 and is_fragment(fragment) for fragment in fragments)
+    random.Random(2).shuffle(fragments)
+    reassembler = Reassembler()
+    # повторы фрагментов до завершения сборки не мешают
+    received = fragments[:3] + fragments[:3] + fragments[3:]
+    results = [reassembler.add(fragment, ADDRESS, 0) for fragment in received]
+    assert [result for result in results if result is not None] == [message]
+    assert reassembler.completed == 1 and not reassembler.partial and reassembler.buffered == 0
+
+def test_small_message_is_not_fragmented(monkeypatch):
+    fixed_mtu(monkeypatch)
+    assert Fragmenter().split(b'hello', ADDRESS) == [b'hello']
+
+def test_plain_messages_are_not_fragments():
+    assert not is_fragment(b'hello world, not a fragment')
+    assert not is_fragment(b'\xfe' + b'x' * 20)
+    header = FRAGMENT_HEADER.pack(fragmentation.FRAGMENT_MAGIC, fragmentation.FRAGMENT_VERSION, 1, 0, 2)
+    assert is_fragment(header + b'data')
+    assert not is_fragment(header[:-2] + b'\x00\x00' + b'data')  # 0 фрагментов
+    assert not is_fragment(FRAGMENT_HEADER.pack(fragmentation.FRAGMENT_MAGIC, 2, 1, 0, 2) + b'data')
+
+def test_fragments_of_different_senders_do_not_mix(monkeypatch):
+    fixed_mtu(monkeypatch)
+    first = Fragmenter().split(b'a' * 2000, ADDRESS)
+    second = Fragmenter().split(b'b' * 2000, ADDRESS)  # тот же id сообщения
+    other = ('192.0.2.2', 5000)
+    reassembler = Reassembler()
+    results = []
+    for a, b in zip(first, second):
+        results.append(reassembler.add(a, ADDRESS, 0))
+        results.append(reassembler.add(b, other, 0))
+    assert [result for result in results if result is not None] == [b'a' * 2000, b'b' * 2000]
+
+def test_budget_evicts_oldest_and_timeout_expires(monkeypatch):
+    fixed_mtu(monkeypatch)
+    fragmenter = Fragmenter()
+    first, second = fragmenter.split(b'a' * 3000, ADDRESS), fragmenter.split(b'b' * 3000, ADDRESS)
+    reassembler = Reassembler(max_bytes=4000, timeout=10)
+    for fragment in first[:-1] + second[:-1]:
+        reassembler.add(fragment, ADDRESS, 0)
+    assert reassembler.evicted == 1 and reassembler.buffered <= 4000
+    assert reassembler.add(second[-1], ADDRESS, 0) == b'b' * 3000
+
+    reassembler.add(first[0], ADDRESS, 5)
+    reassembler.expire(14)
+    assert len(reassembler.partial) == 1
+    reassembler.expire(15)
+    assert not reassembler.partial and reassembler.buffered == 0
+
+def test_mtu_looked_up_once_per_host(monkeypatch):
+    calls = fixed_mtu(monkeypatch, 1500)
+    monkeypatch.setattr(fragmentation, 'MTU_CACHE_SIZE', 2)
+    fragmenter = Fragmenter(overhead=20)
+    assert fragmenter.max_datagram(ADDRESS) == 1500 - 28 - 20
+    fragmenter.max_datagram(('192.0.2.1', 5001))
+    assert len(calls) == 1
+    fragmenter.invalidate(ADDRESS)
+    fragmenter.max_datagram(ADDRESS)
+    assert len(calls) == 2
+    # кэш ограничен: самый давний хост вытесняется
+    fragmenter.max_datagram(('192.0.2.2', 5000))
+    fragmenter.max_datagram(('192.0.2.3', 5000))
+    fragmenter.max_datagram(ADDRESS)
+    assert len(calls) == 5
+
+def test_tiny_fragments_with_large_count_stay_within_budget():
+    # каждый пакет открывает сборку на 65535 фрагментов одним байтом данных
+    reassembler = Reassembler(max_bytes=64 * 1024)
+    for message_id in range(10000):
+        header = FRAGMENT_HEADER.pack(fragmentation.FRAGMENT_MAGIC, fragmentation.FRAGMENT_VERSION,
+                                      message_id, 0, fragmentation.MAX_FRAGMENTS)
+        reassembler.add(header + b'x', ADDRESS, 0)
+    assert reassembler.buffered <= 64 * 1024
+    assert len(reassembler.partial) * 2 * fragmentation.ENTRY_OVERHEAD <= 64 * 1024
+    assert all(len(partial.fragments) == 1 for partial in reassembler.partial.values())
@@ -0,0 +1,87 @@
+import pytest
+from framing import FRAME_DATA, FRAME_ECHO, MessageReader, MessageTooLargeError, pack_frame_header
+
+class Chunks:
+    # сокет-заглушка: recv_into отдает данные заданными кусками, затем конец потока
+    def __init__(self, *chunks):
+        self.chunks = list(chunks)
+
+    def recv_into(self, buffer):
+        if not self.chunks:
+            return 0
+        chunk = self.chunks.pop(0)
+        size = min(len(buffer), len(chunk))
+        buffer[:size] = chunk[:size]
+        if size < len(chunk):
+            self.chunks.insert(0, chunk[size:])
+        return size
+
+def bytewise(data):
+    return [data[i:i + 1] for i in range(len(data))]
+
+def test_messages_split_across_reads():
+    reader = MessageReader(Chunks(b'hel', b'lo\nwor', b'ld\n\nlast'), chunk_size=4)
+    assert list(reader) == [b'hello', b'world', b'']
+    # оборванное последнее сообщение без разделителя не отдается
+
+def test_delimiter_split_between_reads():
+    reader = MessageReader(Chunks(*bytewise(b'one\r\ntwo\r\n')), chunk_size=4, delimiter=b'\r\n')
+    assert list(reader) == [b'one', b'two']
+
+def test_message_longer_than_buffer():
+    message = b'x' * 100000
+    reader = MessageReader(Chunks(message[:30000], message[30000:] + b'\nnext\n'), chunk_size=1024)
+    assert reader.read_message() == message
+    assert reader.read_message() == b'next'
+    assert reader.read_message() is None
+
+def test_message_over_max_size():
+    reader = MessageReader(Chunks(b'a' * 10, b'b' * 10, b'\n'), max_message_size=16, chunk_size=8)
+    with pytest.raises(MessageTooLargeError):
+        reader.read_message()
+
+def test_message_at_max_size():
+    reader = MessageReader(Chunks(b'a' * 16 + b'\n'), max_message_size=16, chunk_size=8)
+    assert reader.read_message() == b'a' * 16
+
+def test_frames_after_text():
+    data = (b'/binary\n' + pack_frame_header(FRAME_DATA, 5) + b'hello'
+            + pack_frame_header(FRAME_ECHO, 0) + pack_frame_header(FRAME_DATA, 3000) + b'z' * 3000)
+    reader = MessageReader(Chunks(*bytewise(data[:20]), data[20:]), chunk_size=64)
+    assert reader.read_message() == b'/binary'
+    assert reader.read_frame() == (FRAME_DATA, b'hello')
+    assert reader.read_frame() == (FRAME_ECHO, b'')
+    assert reader.read_frame() == (FRAME_DATA, b'z' * 3000)
+    assert reader.read_frame() is None
+
+def test_partial_frame_at_close():
+    reader = MessageReader(Chunks(pack_frame_header(FRAME_DATA, 10) + b'short'))
+    assert reader.read_frame() is None
+    reader = MessageReader(Chunks(pack_frame_header(FRAME_DATA, 10)[:3]))
+    assert reader.read_frame() is None
+
+def test_frame_over_max_size():
+    reader = MessageReader(Chunks(pack_frame_header(FRAME_DATA, 17) + b'x' * 17), max_message_size=16)
+    with pytest.raises(MessageTooLargeError):
+        reader.read_frame()
+
+def test_has_message_ignores_partial_next_message():
+    # ответ на /ping нельзя придерживать, пока не пришел остаток следующего запроса
+    reader = MessageReader(Chunks(b'/ping\n/pi', b'ng\n'))
+    assert reader.read_message() == b'/ping'
+    assert not reader.has_message()
+    assert reader.read_message() == b'/ping'
+
+def test_has_message_and_frame_with_complete_data():
+    reader = MessageReader(Chunks(b'one\ntwo\nthr'))
+    assert reader.read_message() == b'one'
+    assert reader.has_message()
+    assert reader.read_message() == b'two'
+    assert not reader.has_message()
+
+    frames = pack_frame_header(FRAME_DATA, 3) + b'abc' + pack_frame_header(FRAME_DATA, 3) + b'de'
+    reader = MessageReader(Chunks(frames, b'f'))
+    assert reader.read_frame() == (FRAME_DATA, b'abc')
+    assert not reader.has_frame()
+    assert reader.read_frame() == (FRAME_DATA, b'def')
+    assert not reader.has_frame()
@@ -0,0 +1,42 @@
+import threading
+from metrics import LatencyHistogram, Metrics
+
+def test_histogram_percentiles_within_bucket_precision():
+    histogram = LatencyHistogram()
+    for micros in range(1, 1001):
+        histogram.record(micros / 1e6)
+    assert histogram.count == 1000 and histogram.max == 0.001
+    assert abs(histogram.percentile(50) - 500e-6) <= 500e-6 * 0.03
+    assert abs(histogram.percentile(99) - 990e-6) <= 990e-6 * 0.03
+    assert histogram.percentile(100) == 0.001
+    assert LatencyHistogram().percentile(99) == 0.0
+
+def test_counters_of_finished_threads_are_kept():
+    # поток на клиента: шарды завершившихся потоков сливаются в общий итог
+    metrics = Metrics('test')
+    def work():
+        for _ in range(1000):
+            metrics.inc('messages')
+            metrics.inc('errors', label='timeout')
+        metrics.observe('handling', 0.002)
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.inc('messages')
+    assert metrics.counter('messages') == 8001
+    assert metrics.counter('errors', 'timeout') == 8000
+    assert metrics.histogram('handling').count == 8
+    assert not [thread for thread, shard in metrics.counter_shards if not thread.is_alive()]
+
+def test_external_snapshots_and_prometheus_output():
+    master, worker = Metrics('app'), Metrics('app')
+    worker.inc('messages', 5)
+    worker.gauge('clients', lambda: 3)
+    master.gauge('clients', lambda: 1)
+    master.set_external('worker-1', worker.snapshot())
+    assert master.counter('messages') == 5 and master.gauge_values() == {'clients': 4}
+    text = master.render_prometheus()
+    assert "# TYPE app_messages_total counter\napp_messages_total 5\n" in text
+    assert "app_clients 4\n" in text
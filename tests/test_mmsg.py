@@ -0,0 +1,47 @@
+import socket
+from errno import EMSGSIZE
+import pytest
+import mmsg
+from mmsg import sendmmsg
+
+@pytest.fixture(params=['sendmmsg', 'sendto'])
+def sockets(request, monkeypatch):
+    if request.param == 'sendto':
+        monkeypatch.setattr(mmsg, 'HAVE_SENDMMSG', False)
+    elif not mmsg.HAVE_SENDMMSG:
+        pytest.skip("sendmmsg is not available")
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(2)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+def receive_all(receiver, count):
+    return [receiver.recv(65536) for _ in range(count)]
+
+def test_batch_delivered_in_order(sockets):
+    sender, receiver = sockets
+    address = receiver.getsockname()
+    datagrams = [(b'datagram %d' % index, address) for index in range(200)]
+    assert sendmmsg(sender, datagrams) == 200
+    assert receive_all(receiver, 200) == [data for data, _ in datagrams]
+
+def test_error_skips_to_index_from_callback(sockets):
+    # датаграмма больше 64 КБ всегда дает EMSGSIZE; остаток пачки отправляется
+    sender, receiver = sockets
+    address = receiver.getsockname()
+    datagrams = [(b'first', address), (b'x' * 70000, address), (b'skipped', address), (b'last', address)]
+    errors = []
+    def on_error(index, error):
+        errors.append((index, error.errno))
+        return index + 2
+    assert sendmmsg(sender, datagrams, on_error=on_error) == 2
+    assert errors == [(1, EMSGSIZE)]
+    assert receive_all(receiver, 2) == [b'first', b'last']
+
+def test_error_without_callback_raises(sockets):
+    sender, receiver = sockets
+    with pytest.raises(OSError):
+        sendmmsg(sender, [(b'x' * 70000, receiver.getsockname())])
@@ -0,0 +1,113 @@
+import threading
+import pytest
+from outbound import (
+    Outbox, QueueOverflowError, POLICY_BLOCK, POLICY_DISCONNECT, POLICY_DROP_OLDEST
+)
+
+class SlowSocket:
+    # сокет-заглушка: за один sendmsg принимает не больше capacity байт
+    def __init__(self, capacity=0):
+        self.capacity = capacity
+        self.received = bytearray()
+        self.calls = 0
+
+    def fileno(self):
+        return -1
+
+    def sendmsg(self, buffers, ancdata=(), flags=0):
+        if not self.capacity:
+            raise BlockingIOError
+        self.calls += 1
+        data = b''.join(bytes(buffer) for buffer in buffers)[:self.capacity]
+        self.received += data
+        self.capacity -= len(data)
+        return len(data)
+
+class Engine:
+    def __init__(self):
+        self.waiting = []
+        self.failed = []
+
+    def want_write(self, outbox):
+        self.waiting.append(outbox)
+
+    def connection_failed(self, outbox):
+        self.failed.append(outbox)
+
+def outbox(sock, policy, **limits):
+    return Outbox(Engine(), sock, max_queue_bytes=limits.get('bytes', 1024),
+                  max_queue_messages=limits.get('messages', 4), policy=policy,
+                  block_timeout=limits.get('timeout', 0.1))
+
+def test_coalesced_messages_go_in_one_sendmsg():
+    sock = SlowSocket(1000)
+    queue = outbox(sock, POLICY_DISCONNECT)
+    queue.push([b'one\n'], flush=False)
+    queue.push([b'two', b'\n'], flush=False)
+    assert sock.calls == 0 and queue.depth() == (2, 8)
+    assert queue.flush()
+    assert sock.calls == 1 and bytes(sock.received) == b'one\ntwo\n'
+
+def test_remainder_waits_for_engine():
+    sock = SlowSocket(3)
+    queue = outbox(sock, POLICY_DISCONNECT)
+    queue.push([b'hello\n'])
+    assert queue.depth() == (1, 3) and queue.engine.waiting == [queue]
+    sock.capacity = 100
+    assert queue.flush()
+    assert bytes(sock.received) == b'hello\n' and queue.depth() == (0, 0)
+
+def test_disconnect_policy_raises_on_overflow():
+    queue = outbox(SlowSocket(), POLICY_DISCONNECT)
+    for index in range(4):
+        queue.push([b'%d\n' % index])
+    assert queue.lagging
+    with pytest.raises(QueueOverflowError):
+        queue.push([b'4\n'])
+
+def test_drop_oldest_keeps_partially_sent_head():
+    sock = SlowSocket(2)
+    queue = outbox(sock, POLICY_DROP_OLDEST)
+    for index in range(10):
+        queue.push([b'message %d\n' % index])
+    assert queue.dropped_messages == 6 and queue.depth()[0] == 4
+    sock.capacity = 1000
+    queue.flush()
+    # начатое сообщение досылается целиком, выброшены следующие за ним
+    assert bytes(sock.received) == b'message 0\nmessage 7\nmessage 8\nmessage 9\n'
+
+def test_empty_queue_accepts_message_over_limit():
+    queue = outbox(SlowSocket(), POLICY_DISCONNECT, bytes=16)
+    queue.push([b'x' * 100])
+    assert queue.depth() == (1, 100)
+
+def test_block_policy_times_out():
+    queue = outbox(SlowSocket(), POLICY_BLOCK, messages=1, timeout=0.05)
+    queue.push([b'first\n'])
+    with pytest.raises(QueueOverflowError):
+        queue.push([b'second\n'])
+
+def test_block_policy_waits_for_space():
+    sock = SlowSocket()
+    queue = outbox(sock, POLICY_BLOCK, messages=1, timeout=5)
+    queue.push([b'first\n'])
+
+    def drain():
+        # поток движка досылает очередь, когда сокет снова готов
+        sock.capacity = 1000
+        queue.flush()
+    timer = threading.Timer(0.05, drain)
+    timer.start()
+    queue.push([b'second\n'])
+    timer.join()
+    queue.flush()
+    assert bytes(sock.received) == b'first\nsecond\n'
+
+def test_block_policy_wakes_on_close():
+    queue = outbox(SlowSocket(), POLICY_BLOCK, messages=1, timeout=5)
+    queue.push([b'first\n'])
+    timer = threading.Timer(0.05, queue.close)
+    timer.start()
+    with pytest.raises(ConnectionError):
+        queue.push([b'second\n'])
+    timer.join()
@@ -0,0 +1,53 @@
+import ratelimit
+from ratelimit import AdmissionControl, RateLimiter, TokenBucket
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def fake_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock)
+    return clock
+
+def test_bucket_refills_up_to_burst(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    bucket = TokenBucket(10)
+    bucket.tokens = 0
+    clock.now += 0.5
+    assert bucket.wait_time(clock.now) == 0 and bucket.tokens == 5
+    clock.now += 100
+    bucket.refill(clock.now)
+    assert bucket.tokens == bucket.burst == 10
+
+def test_large_message_goes_into_debt(monkeypatch):
+    # сообщение больше емкости ведра проходит, следующие ждут погашения долга
+    clock = fake_clock(monkeypatch)
+    limiter = RateLimiter(size=100)
+    assert limiter.try_take(250) is None
+    assert limiter.try_take(1) == 'bytes'
+    wait, bucket = limiter.wait_time()
+    assert bucket == 'bytes' and abs(wait - 1.51) < 1e-9
+    clock.now += wait
+    assert limiter.try_take(1) is None
+
+def test_message_limit_checked_first(monkeypatch):
+    fake_clock(monkeypatch)
+    limiter = RateLimiter(messages=2, size=1000)
+    assert limiter.try_take(10) is None and limiter.try_take(10) is None
+    assert limiter.try_take(10) == 'messages'
+
+def test_admission_control(monkeypatch):
+    fake_clock(monkeypatch)
+    control = AdmissionControl(global_messages=1, max_connections=2)
+    assert control.client_limiter() is None
+    assert not control.over_capacity(1) and control.over_capacity(2)
+    assert control.admit(10) is None
+    assert control.admit(10) == 'global_messages'
+    assert ratelimit.busy_message('global_messages') == \
+        "Server busy: global messages limit exceeded, message dropped"
+    assert AdmissionControl(global_bytes=1000).per_worker(4).global_bytes == 250
+    assert AdmissionControl().admit(10) is None
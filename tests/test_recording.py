@@ -0,0 +1,55 @@
+import os
+from recording import (
+    Recorder, TrafficLog, PROTOCOL_TCP, INDEX_ENTRY, INDEX_SUFFIX, RECORD_HEADER,
+    EVENT_CONNECT, EVENT_MESSAGE, EVENT_DISCONNECT, read_index
+)
+
+def events(path):
+    return [(client_id, event, frame_type, payload)
+            for _, client_id, event, frame_type, payload in TrafficLog(path).records()]
+
+def test_records_round_trip(tmp_path):
+    path = str(tmp_path / 'traffic.log')
+    recorder = Recorder(path, PROTOCOL_TCP)
+    recorder.connect(1)
+    recorder.message(1, b'hello')
+    recorder.message(1, b'\x00\x01', frame_type=3)
+    recorder.disconnect(1)
+    recorder.close()
+    assert events(path) == [(1, EVENT_CONNECT, 0, b''), (1, EVENT_MESSAGE, 0, b'hello'),
+                            (1, EVENT_MESSAGE, 3, b'\x00\x01'), (1, EVENT_DISCONNECT, 0, b'')]
+    assert read_index(path)[0][1] == os.path.getsize(path) - sum(
+        RECORD_HEADER.size + len(payload) for payload in (b'', b'hello', b'\x00\x01', b''))
+
+def test_continues_after_partial_record(tmp_path):
+    # сервер убит посреди записи: в журнале обрывок, индекс указывает за конец
+    path = str(tmp_path / 'traffic.log')
+    recorder = Recorder(path, PROTOCOL_TCP)
+    recorder.message(1, b'first')
+    recorder.message(1, b'second' * 100)
+    recorder.close()
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.truncate(size - 50)
+    with open(path + INDEX_SUFFIX, 'ab') as f:
+        f.write(INDEX_ENTRY.pack(2**60, size + 1000))
+        f.write(b'\x00' * 5)
+
+    recorder = Recorder(path, PROTOCOL_TCP)
+    recorder.message(2, b'after restart')
+    recorder.close()
+    assert events(path) == [(1, EVENT_MESSAGE, 0, b'first'), (2, EVENT_MESSAGE, 0, b'after restart')]
+    assert os.path.getsize(path + INDEX_SUFFIX) % INDEX_ENTRY.size == 0
+    assert all(offset < os.path.getsize(path) for _, offset in read_index(path))
+
+def test_start_seeks_through_index(tmp_path):
+    path = str(tmp_path / 'traffic.log')
+    recorder = Recorder(path, PROTOCOL_TCP)
+    recorder.message(1, b'early')
+    recorder.next_index = 0  # следующая запись попадет в индекс, как через секунду
+    recorder.message(1, b'late')
+    recorder.close()
+    log = TrafficLog(path)
+    late = read_index(path)[-1][0]
+    assert [record[4] for record in log.records(late)] == [b'late']
+    assert [record[4] for record in log.records(log.first_time())] == [b'early', b'late']
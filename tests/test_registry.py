@@ -0,0 +1,32 @@
+from registry import ClientRegistry
+
+def test_lookup_by_id_and_address():
+    clients = ClientRegistry()
+    clients.add(1, ('127.0.0.1', 5000), binary=True)
+    clients.add(2, ('127.0.0.1', 5001))
+    assert len(clients) == 2 and 1 in clients
+    assert clients[1].binary and clients.get(1).address == ('127.0.0.1', 5000)
+    assert clients.get_by_address(('127.0.0.1', 5001)).id == 2
+    assert clients.get(3) is None and clients.get_by_address(('127.0.0.1', 5002)) is None
+    assert clients.ids() == [1, 2]
+    assert [client_id for client_id, _ in clients.items()] == [1, 2]
+
+def test_pop_by_id_and_address():
+    clients = ClientRegistry()
+    clients.add(1, ('127.0.0.1', 5000))
+    clients.add(2, ('127.0.0.1', 5001))
+    assert clients.pop(1).id == 1
+    assert clients.pop(1) is None
+    assert clients.get_by_address(('127.0.0.1', 5000)) is None
+    assert clients.pop_address(('127.0.0.1', 5001)).id == 2
+    assert clients.pop_address(('127.0.0.1', 5001)) is None
+    assert len(clients) == 0
+
+def test_reused_address_keeps_new_client():
+    # UDP: клиент перерегистрировался с того же адреса, старая запись удаляется позже
+    clients = ClientRegistry()
+    address = ('127.0.0.1', 5000)
+    clients.add(1, address)
+    clients.add(2, address)
+    clients.pop(1)
+    assert clients.get_by_address(address).id == 2
@@ -0,0 +1,180 @@
+import random
+import select
+import socket
+import time
+from reliable_udp import ReliableEndpoint, TICK_INTERVAL, is_reliable_packet
+
+CLIENT = ('127.0.0.1', 40001)
+SERVER = ('127.0.0.1', 40002)
+
+class Wire:
+    # сокет-заглушка: датаграммы уходят в сеть-имитацию
+    def __init__(self, network, address):
+        self.network = network
+        self.address = address
+
+    def sendto(self, data, address):
+        self.network.in_flight.append((self.address, address, bytes(data)))
+
+class Network:
+    # Сеть с виртуальными часами: теряет и переставляет пакеты
+    def __init__(self, loss=0.0, reorder=False, seed=1):
+        self.random = random.Random(seed)
+        self.loss = loss
+        self.reorder = reorder
+        self.in_flight = []
+        self.endpoints = {}
+        self.delivered = {}
+        self.handlers = {}
+        self.now = 1000.0
+
+    def endpoint(self, address, on_message=None):
+        endpoint = ReliableEndpoint(Wire(self, address))
+        self.endpoints[address] = endpoint
+        self.delivered[address] = []
+        self.handlers[address] = on_message
+        return endpoint
+
+    def step(self):
+        packets, self.in_flight = self.in_flight, []
+        if self.reorder:
+            self.random.shuffle(packets)
+        for source, destination, data in packets:
+            if self.random.random() < self.loss:
+                continue
+            assert is_reliable_packet(data)
+            for payload in self.endpoints[destination].receive(data, source, self.now):
+                self.delivered[destination].append(payload)
+                handler = self.handlers[destination]
+                if handler is not None:
+                    handler(source, payload)
+        self.now += TICK_INTERVAL
+        for endpoint in self.endpoints.values():
+            endpoint.tick(self.now)
+
+    def run(self, condition, limit=20000):
+        for _ in range(limit):
+            if condition():
+                return True
+            self.step()
+        return condition()
+
+def messages(count, prefix=b'm'):
+    return [prefix + b'%d' % i for i in range(count)]
+
+def test_in_order_delivery_without_loss():
+    network = Network()
+    client = network.endpoint(CLIENT)
+    network.endpoint(SERVER)
+    for message in messages(100):
+        client.send(SERVER, message, network.now)
+    assert network.run(lambda: len(network.delivered[SERVER]) == 100)
+    assert network.delivered[SERVER] == messages(100)
+    assert network.run(lambda: not network.endpoints[CLIENT].channels[SERVER].unacked)
+
+def test_loss_and_reordering_both_directions():
+    network = Network(loss=0.3, reorder=True, seed=7)
+    client = network.endpoint(CLIENT)
+    server = network.endpoint(SERVER)
+    for message in messages(200, b'c'):
+        client.send(SERVER, message, network.now)
+    for message in messages(200, b's'):
+        server.send(CLIENT, message, network.now)
+    assert network.run(lambda: len(network.delivered[SERVER]) == 200 and len(network.delivered[CLIENT]) == 200)
+    assert network.delivered[SERVER] == messages(200, b'c')
+    assert network.delivered[CLIENT] == messages(200, b's')
+    assert client.retransmissions and server.retransmissions
+
+def test_recreated_channel_delivers_from_new_session():
+    # сервер забывает клиента (quit, истечение) и принимает его снова: ответы нового
+    # канала начинаются с seq 0 и не должны считаться у клиента повторами
+    for loss in (0.0, 0.2):
+        network = Network(loss=loss, reorder=bool(loss), seed=3)
+        client = network.endpoint(CLIENT)
+        server = network.endpoint(SERVER, on_message=lambda source, payload:
+                                  network.endpoints[SERVER].send(source, b'reply ' + payload, network.now))
+        for message in messages(20):
+            client.send(SERVER, message, network.now)
+        assert network.run(lambda: len(network.delivered[CLIENT]) == 20)
+
+        server.close(CLIENT)
+        assert network.run(lambda: CLIENT not in server.channels)
+
+        client.send(SERVER, b'hello again', network.now)
+        assert network.run(lambda: len(network.delivered[CLIENT]) == 21)
+        assert network.delivered[CLIENT][-1] == b'reply hello again'
+        assert network.delivered[SERVER][-1] == b'hello again'
+        assert network.run(lambda: not server.channels[CLIENT].unacked and not client.channels[SERVER].unacked)
+
+def test_late_packet_of_previous_session_is_ignored():
+    network = Network()
+    client = network.endpoint(CLIENT)
+    server = network.endpoint(SERVER)
+    server.send(CLIENT, b'old', network.now)
+    stale = list(network.in_flight)
+    assert network.run(lambda: network.delivered[CLIENT] == [b'old'])
+    server.close(CLIENT)
+    assert network.run(lambda: CLIENT not in server.channels)
+
+    server.send(CLIENT, b'new', network.now)
+    assert network.run(lambda: network.delivered[CLIENT] == [b'old', b'new'])
+    network.in_flight.extend(stale)
+    server.send(CLIENT, b'newer', network.now)
+    assert network.run(lambda: network.delivered[CLIENT] == [b'old', b'new', b'newer'])
+    assert client.duplicates == 0
+
+def test_timeout_retransmits_within_shrunk_window():
+    # все окно потеряно: после RTO окно - один пакет, остальные уходят по мере ACK
+    network = Network(loss=1.0)
+    client = network.endpoint(CLIENT)
+    network.endpoint(SERVER)
+    for message in messages(4):
+        client.send(SERVER, message, network.now)
+    network.step()
+    network.loss = 0.0
+    assert network.run(lambda: client.retransmissions > 0)
+    channel = client.channels[SERVER]
+    assert client.retransmissions == 1 and channel.cwnd == 1.0
+    assert len([packet for packet in network.in_flight if packet[0] == CLIENT]) == 1
+    assert network.run(lambda: len(network.delivered[SERVER]) == 4 and channel.idle())
+    assert network.delivered[SERVER] == messages(4)
+    # каждый пакет повторен один раз, повторного RTO не было
+    assert client.retransmissions == 4 and channel.retries == 0
+
+def test_loopback_with_simulated_loss():
+    # настоящие сокеты; потери делает сам уровень (--loss)
+    sockets = []
+    for _ in range(2):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        sockets.append(sock)
+    try:
+        sender = ReliableEndpoint(sockets[0], loss=0.1)
+        receiver = ReliableEndpoint(sockets[1], loss=0.1)
+        sender_address, receiver_address = (sock.getsockname() for sock in sockets)
+        sent = messages(150)
+        for message in sent:
+            sender.send(receiver_address, message)
+        received = []
+        deadline = time.time() + 20
+        channel = sender.channels[receiver_address]
+        while (len(received) < len(sent) or not channel.idle()) and time.time() < deadline:
+            readable, _, _ = select.select(sockets, [], [], TICK_INTERVAL)
+            for sock in readable:
+                endpoint = receiver if sock is sockets[1] else sender
+                while True:
+                    try:
+                        data, address = sock.recvfrom(65535)
+                    except BlockingIOError:
+                        break
+                    delivered = endpoint.receive(data, address)
+                    if endpoint is receiver:
+                        received.extend(delivered)
+            sender.tick()
+            receiver.tick()
+        assert received == sent
+        assert sender.simulated_losses and sender.retransmissions
+    finally:
+        for sock in sockets:
+            sock.close()
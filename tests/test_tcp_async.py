@@ -0,0 +1,48 @@
+import time
+from ratelimit import TOO_MANY_CONNECTIONS
+
+def greet(server):
+    sock, stream = server.connect()
+    return sock, stream, stream.readline()
+
+def test_greeting_echo_and_quit(server):
+    process = server('tcp-server-async')
+    clients = [greet(process) for _ in range(3)]
+    assert [greeting for _, _, greeting in clients] == [
+        b'Welcome to TCP Server! You are client #%d\n' % client_id for client_id in (1, 2, 3)]
+    # соединения обслуживает один event loop: сообщения разных клиентов не мешают друг другу
+    for index, (sock, _, _) in enumerate(clients):
+        sock.sendall(b'hello %d\n/ping\n' % index)
+    for index, (_, stream, _) in enumerate(clients):
+        assert stream.readline() == b'Echo: hello %d\n' % index
+        assert stream.readline() == b'pong\n'
+    for sock, stream, _ in clients:
+        sock.sendall(b'quit\n')
+        assert stream.readline() == b'Goodbye!\n'
+        assert stream.readline() == b''
+        sock.close()
+
+def test_over_capacity_reject_keeps_ids_contiguous(server):
+    process = server('tcp-server-async', '--max-connections', '1')
+    first, first_stream, greeting = greet(process)
+    assert greeting == b'Welcome to TCP Server! You are client #1\n'
+
+    rejected, rejected_stream, reply = greet(process)
+    assert reply == (TOO_MANY_CONNECTIONS + "\n").encode()
+    assert rejected_stream.readline() == b''
+    rejected.close()
+
+    first.sendall(b'quit\n')
+    assert first_stream.readline() == b'Goodbye!\n'
+    assert first_stream.readline() == b''
+    first.close()
+    # место освобождается, когда сервер закончит с первым клиентом
+    deadline = time.monotonic() + 5
+    while True:
+        sock, _, greeting = greet(process)
+        sock.close()
+        if not greeting.startswith(TOO_MANY_CONNECTIONS.encode()) or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    # отказ не израсходовал номер клиента
+    assert greeting == b'Welcome to TCP Server! You are client #2\n'
@@ -0,0 +1,12 @@
+import pytest
+
+@pytest.mark.parametrize('mode', ['tcp-server', 'tcp-server-async'])
+def test_reply_not_held_for_partial_next_request(server, mode):
+    # начало следующего запроса уже в буфере, но ответ на первый уходит сразу
+    sock, stream = server(mode).connect()
+    assert stream.readline().startswith(b'Welcome to TCP Server!')
+    sock.sendall(b'/ping\n/pi')
+    assert stream.readline() == b'pong\n'
+    sock.sendall(b'ng\n')
+    assert stream.readline() == b'pong\n'
+    sock.close()
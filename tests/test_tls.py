@@ -0,0 +1,84 @@
+import shutil
+import socket
+import ssl
+import subprocess
+import threading
+import pytest
+from framing import MessageReader
+from tls import TLSClient, TLSConnection, server_context
+
+@pytest.fixture(scope='module')
+def certificate(tmp_path_factory):
+    if shutil.which('openssl') is None:
+        pytest.skip("openssl is not available to create a test certificate")
+    directory = tmp_path_factory.mktemp('tls')
+    cert, key = directory / 'cert.pem', directory / 'key.pem'
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=DNS:localhost',
+                    '-keyout', str(key), '-out', str(cert)],
+                   check=True, capture_output=True)
+    return str(cert), str(key)
+
+def serve(listener, context, connections, received):
+    # сервер как у tcp-server: рукопожатие, затем MessageReader поверх TLSConnection
+    for _ in range(connections):
+        sock, _ = listener.accept()
+        try:
+            connection = TLSConnection(sock, context, server_side=True)
+            connection.handshake(timeout=5)
+            sock.settimeout(5)
+            message = MessageReader(connection).read_message()
+            received.append(message)
+            connection.sendall(b'echo ' + message + b'\n')
+        except Exception as e:
+            received.append(e)
+        finally:
+            sock.close()
+
+def start_server(certificate, connections):
+    listener = socket.create_server(('127.0.0.1', 0))
+    received = []
+    thread = threading.Thread(target=serve, args=(listener, server_context(*certificate), connections, received))
+    thread.daemon = True
+    thread.start()
+    return listener, thread, received
+
+def test_data_sent_with_client_finished(certificate):
+    # клиент отправляет Finished и первую строку одной записью в сокет
+    listener, thread, received = start_server(certificate, 1)
+    try:
+        context = ssl.create_default_context(cafile=certificate[0])
+        incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        client = context.wrap_bio(incoming, outgoing, server_hostname='localhost')
+        sock = socket.create_connection(listener.getsockname(), timeout=5)
+        while True:
+            try:
+                client.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                sock.sendall(outgoing.read())
+                incoming.write(sock.recv(65536))
+        client.write(b'/ping\n')
+        sock.sendall(outgoing.read())
+        thread.join(timeout=5)
+        assert received == [b'/ping']
+        sock.close()
+    finally:
+        listener.close()
+
+def test_handshake_and_session_resumption(certificate):
+    listener, thread, received = start_server(certificate, 2)
+    try:
+        client = TLSClient(certificate[0])
+        for index in range(2):
+            sock = socket.create_connection(listener.getsockname(), timeout=5)
+            connection = client.wrap(sock, 'localhost')
+            connection.sendall(b'hello %d\n' % index)
+            # билет сессии TLS 1.3 приходит вместе с первыми данными
+            assert MessageReader(connection).read_message() == b'echo hello %d' % index
+            connection.close()
+        thread.join(timeout=5)
+        assert received == [b'hello 0', b'hello 1']
+        assert (client.full, client.resumed) == (1, 1)
+    finally:
+        listener.close()
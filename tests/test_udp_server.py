@@ -0,0 +1,47 @@
+import socket
+from errno import EMSGSIZE
+import fragmentation
+import mmsg
+from fragmentation import Reassembler, is_fragment
+from udp_communication import ReplyBatch, UDPServer
+
+SHRUNK = ('192.0.2.1', 5000)
+STEADY = ('192.0.2.2', 5000)
+
+class RouteSocket:
+    # сокет-заглушка: отвергает датаграммы больше MTU маршрута, как ядро при DF
+    def __init__(self, mtus):
+        self.mtus = mtus
+        self.sent = []
+
+    def sendto(self, data, address):
+        if len(data) > self.mtus[address[0]] - 28:
+            raise OSError(EMSGSIZE, "Message too long")
+        self.sent.append((bytes(data), address))
+
+def test_batch_resplits_message_after_emsgsize(monkeypatch):
+    monkeypatch.setattr(mmsg, 'HAVE_SENDMMSG', False)
+    mtus = {SHRUNK[0]: 1500, STEADY[0]: 1500}
+    monkeypatch.setattr(fragmentation, 'path_mtu', lambda address: mtus[address[0]])
+    server = UDPServer()
+    server.socket = RouteSocket(mtus)
+    message = b'm' * 3000
+
+    # нарезка по закэшированному MTU 1500, а маршрут до SHRUNK уже 1000
+    batch = ReplyBatch()
+    for address in (STEADY, SHRUNK, STEADY):
+        server.reply(message, address, batch)
+    mtus[SHRUNK[0]] = 1000
+    server.send_batch(batch)
+
+    # до STEADY дошли оба сообщения, ни одна датаграмма пачки не потеряна
+    received = {SHRUNK: Reassembler(), STEADY: Reassembler()}
+    messages = {SHRUNK: [], STEADY: []}
+    for data, address in server.socket.sent:
+        assert is_fragment(data)
+        result = received[address].add(data, address, 0)
+        if result is not None:
+            messages[address].append(result)
+    assert messages == {SHRUNK: [message], STEADY: [message, message]}
+    # MTU маршрута перечитан: следующая нарезка сразу под новый размер
+    assert server.fragmenter.max_datagram(SHRUNK) == 1000 - 28
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import asyncio
+import ssl
+import threading
+import time
+
+# TLS для TCP (--tls-cert/--tls-key у серверов, --tls у клиентов). Шифрование идет
+# через ssl.MemoryBIO поверх обычного сокета, а не через ssl.SSLSocket: поток клиента
+# читает, а очередь исходящих пишет из других потоков неблокирующим sendmsg - объект
+# SSL при этом используется строго под блокировкой, а сокет остается обычным.
+# Клиенты запоминают сессию (session ticket) и при повторном подключении к тому же
+# серверу проходят сокращенное рукопожатие.
+
+HANDSHAKE_TIMEOUT = 10.0
+RECV_SIZE = 64 * 1024
+
+def server_context(certfile, keyfile=None):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    # билеты сессий (TLS 1.2 и 1.3) включены по умолчанию; по одному на соединение -
+    # клиент все равно хранит только последний
+    context.num_tickets = 1
+    return context
+
+class TLSConnection:
+    # Сокетоподобный объект для MessageReader и send_frame: recv_into/sendall/sendmsg
+    # работают с открытым текстом
+    def __init__(self, sock, context, server_side=False, server_hostname=None, session=None,
+                 sessions=None, session_key=None):
+        self.sock = sock
+        self.incoming = ssl.MemoryBIO()
+        self.outgoing = ssl.MemoryBIO()
+        self.object = context.wrap_bio(self.incoming, self.outgoing, server_side=server_side,
+                                       server_hostname=server_hostname, session=session)
+        self.lock = threading.Lock()
+        self.plaintext = b''
+        self.peer_closed = False
+        self.sessions = sessions  # клиент: TLSClient, куда сохранить полученный билет
+        self.session_key = session_key
+        self.session_saved = False
+        self.handshake_time = 0.0
+
+    def handshake(self, timeout=HANDSHAKE_TIMEOUT):
+        previous = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        started = time.perf_counter()
+        try:
+            while True:
+                try:
+                    self.object.do_handshake()
+                    break
+                except ssl.SSLWantReadError:
+                    self.sock.sendall(self.outgoing.read())
+                    data = self.sock.recv(RECV_SIZE)
+                    if not data:
+                        raise ConnectionError("connection closed during TLS handshake")
+                    self.incoming.write(data)
+            # Finished клиента или билеты сессии сервера
+            self.sock.sendall(self.outgoing.read())
+        finally:
+            self.sock.settimeout(previous)
+        self.handshake_time = time.perf_counter() - started
+
+    async def handshake_stream(self, reader, writer, timeout=HANDSHAKE_TIMEOUT):
+        # то же для asyncio-клиента: MemoryBIO поверх StreamReader/StreamWriter, потому что
+        # TLS самого asyncio не умеет возобновлять сохраненную сессию
+        started = time.perf_counter()
+        while True:
+            try:
+                self.object.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                writer.write(self.outgoing.read())
+                data = await asyncio.wait_for(reader.read(RECV_SIZE), timeout)
+                if not data:
+                    raise ConnectionError("connection closed during TLS handshake")
+                self.incoming.write(data)
+        writer.write(self.outgoing.read())
+        self.handshake_time = time.perf_counter() - started
+
+    @property
+    def session_reused(self):
+        return self.object.session_reused
+
+    @property
+    def version(self):
+        return self.object.version()
+
+    def encrypt(self, buffers):
+        # Возвращает записи TLS в порядке вызовов; заодно забирает то, что SSL сам
+        # сгенерировал при чтении (например, ответ на KeyUpdate)
+        with self.lock:
+            for buffer in buffers:
+                if len(buffer):
+                    self.object.write(buffer)
+            return self.outgoing.read()
+
+    def decrypt(self, data):
+        with self.lock:
+            self.incoming.write(data)
+            chunks = []
+            while True:
+                try:
+                    chunk = self.object.read(RECV_SIZE)
+                except ssl.SSLWantReadError:
+                    break
+                except ssl.SSLZeroReturnError:
+                    chunk = b''
+                if not chunk:
+                    # close_notify от собеседника
+                    self.peer_closed = True
+                    break
+                chunks.append(chunk)
+            if self.sessions is not None and not self.session_saved:
+                # в TLS 1.3 билет приходит уже после рукопожатия, вместе с первыми данными
+                session = self.object.session
+                if session is not None and session.has_ticket:
+                    self.sessions.save(self.session_key, session)
+                    self.session_saved = True
+            return b''.join(chunks)
+
+    def recv_into(self, buffer, nbytes=0):
+        while not self.plaintext:
+            if self.peer_closed:
+                return 0
+            if self.incoming.pending or self.object.pending():
+                # записи, пришедшие одним сегментом с Finished клиента, уже во входном BIO -
+                # сокет их больше не вернет
+                self.plaintext = self.decrypt(b'')
+                if self.plaintext or self.peer_closed:
+                    continue
+            data = self.sock.recv(RECV_SIZE)
+            if not data:
+                return 0
+            self.plaintext = self.decrypt(data)
+        size = min(len(buffer), len(self.plaintext))
+        buffer[:size] = self.plaintext[:size]
+        self.plaintext = self.plaintext[size:]
+        return size
+
+    def sendall(self, data):
+        self.sock.sendall(self.encrypt([data]))
+
+    def sendmsg(self, buffers):
+        self.sock.sendall(self.encrypt(buffers))
+        return sum(len(buffer) for buffer in buffers)
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def setsockopt(self, *args):
+        self.sock.setsockopt(*args)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+class TLSClient:
+    # Контекст клиента и кэш сессий {(host, port): SSLSession} для возобновления
+    def __init__(self, cafile=None):
+        self.context = ssl.create_default_context(cafile=cafile)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.resumed = 0
+        self.full = 0
+
+    def connection(self, host, port, sock=None):
+        # если сервер не примет билет (перезапуск, другой ключ), handshake будет полным
+        key = (host, port)
+        with self.lock:
+            session = self.sessions.get(key)
+        return TLSConnection(sock, self.context, server_hostname=host, session=session,
+                             sessions=self, session_key=key)
+
+    def wrap(self, sock, host, timeout=HANDSHAKE_TIMEOUT):
+        connection = self.connection(host, sock.getpeername()[1], sock)
+        connection.handshake(timeout)
+        self.count(connection)
+        return connection
+
+    async def wrap_stream(self, reader, writer, host, port, timeout=HANDSHAKE_TIMEOUT):
+        connection = self.connection(host, port)
+        await connection.handshake_stream(reader, writer, timeout)
+        self.count(connection)
+        return connection
+
+    def count(self, connection):
+        with self.lock:
+            if connection.session_reused:
+                self.resumed += 1
+            else:
+                self.full += 1
+
+    def save(self, key, session):
+        with self.lock:
+            self.sessions[key] = session
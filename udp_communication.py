@@ -1,81 +1,392 @@
 #!/usr/bin/env python3
 
+import bisect
+from errno import EMSGSIZE
+import select
 import socket
 import threading
 import time
+from channels import CHANNEL_COMMANDS, ChannelIndex, channel_command, channel_message
+from compression import (
+    COMPRESS_COMMAND, DEFAULT_COMPRESS_THRESHOLD, compress_ack, compress_datagram,
+    is_compressed_datagram, decompress_datagram
+)
+from control import ControlServer
+from console import log, traffic_log, preview, hide_prompt, wait_for_shutdown
+from expiry import ExpiryIndex
+from heartbeat import (
+    HEARTBEAT_COMMAND, HEARTBEAT_REPLY, DEFAULT_HEARTBEAT_INTERVAL, DEFAULT_CLIENT_TIMEOUT,
+    DEAD_PEER_INTERVALS, IDLE_CHECK_INTERVAL
+)
+from fragmentation import (
+    DEFAULT_REASSEMBLY_BUDGET, Fragmenter, Reassembler, is_fragment, prepare_socket
+)
+from metrics import Metrics
+from ratelimit import busy_message
+from recording import Recorder, PROTOCOL_UDP
+from mmsg import RecvBatch, SockaddrCache, sendmmsg
+from registry import ClientRegistry
+from reliable_udp import RELIABLE_HEADER, ReliableEndpoint, TICK_INTERVAL, is_reliable_packet
+
+CLEANUP_INTERVAL = 1.0
+MAX_DATAGRAM_SIZE = 65535
+
+class ReplyBatch:
+    # Датаграммы для общей отправки через sendmmsg и сообщения, из которых они нарезаны:
+    # если ядро отвергнет датаграмму (EMSGSIZE - MTU маршрута уменьшился), сообщение
+    # этого получателя режется заново, а остальная пачка уходит как обычно
+    def __init__(self):
+        self.datagrams = []  # [(датаграмма, адрес)]
+        self.starts = []     # индекс первой датаграммы каждого сообщения
+        self.messages = []   # [(данные, адрес)]
+
+    def add(self, data, address, datagrams):
+        self.starts.append(len(self.datagrams))
+        self.messages.append((data, address))
+        self.datagrams.extend((datagram, address) for datagram in datagrams)
+
+    def message_at(self, index):
+        # (данные, адрес, индекс после последней датаграммы сообщения)
+        position = bisect.bisect_right(self.starts, index) - 1
+        end = self.starts[position + 1] if position + 1 < len(self.starts) else len(self.datagrams)
+        return self.messages[position] + (end,)
 
 class UDPServer:
-    def __init__(self, host='localhost', port=8889):
+    def __init__(self, host='localhost', port=8889, batch_size=0, client_timeout=DEFAULT_CLIENT_TIMEOUT,
+                 reliable=False, loss=0.0, metrics_port=None, headless=False, control_socket=None,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD, admission=None, record_path=None):
         self.host = host
         self.port = port
+        self.batch_size = batch_size  # >1 - пакетный режим recvmmsg/sendmmsg
+        self.buffer_size = MAX_DATAGRAM_SIZE
         self.socket = None
         self.client_count = 0
-        self.clients = {}  # {client_address: {"id": int, "last_seen": float}}
+        self.clients = ClientRegistry()
+        self.channels = ChannelIndex()
+        self.addresses = SockaddrCache()
+        self.client_timeout = client_timeout
+        self.expiry = ExpiryIndex(client_timeout)
+        self.expired_count = 0
+        self.next_cleanup = 0
+        self.reliable = reliable
+        self.loss = loss
+        self.endpoint = None
+        self.fragmenter = Fragmenter(RELIABLE_HEADER.size if reliable else 0)
+        self.reassembler = Reassembler()
+        self.metrics_port = metrics_port
+        self.headless = headless
+        self.control_socket = control_socket
+        self.control = None
+        self.compress_threshold = compress_threshold
+        self.admission = admission  # AdmissionControl или None - без ограничений
+        self.record_path = record_path
+        self.recorder = None
+        self.metrics = Metrics('udp_server')
+        self.register_gauges()
         self.running = True
+
+    def register_gauges(self):
+        self.metrics.gauge('clients_connected', lambda: len(self.clients))
+        self.metrics.gauge('reassembly_incomplete', lambda: len(self.reassembler.partial))
+        self.metrics.gauge('reassembly_buffered_bytes', lambda: self.reassembler.buffered)
+        self.metrics.gauge('reliable_channels', lambda: len(self.endpoint.channels) if self.endpoint else 0)
+        self.metrics.gauge('reliable_retransmissions', lambda: self.endpoint.retransmissions if self.endpoint else 0)
+        self.metrics.gauge('channels', lambda: len(self.channels))
+        self.metrics.gauge('subscriptions', self.channels.subscription_count)
         
     def start(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.socket.bind((self.host, self.port))
+            prepare_socket(self.socket)
+            if self.reliable:
+                self.endpoint = ReliableEndpoint(self.socket, self.loss)
 
-            print(f"UDP Server listening on {self.host}:{self.port}")
-            print("UDP Server is connectionless - accepts messages from any client")
-            print("Server commands:")
-            print("  send <client_id> <message>  - Send message to specific client")
-            print("  broadcast <message>         - Send message to all clients")
-            print("  list                        - Show connected clients")
-            print("  quit                        - Exit server")
-            print("-" * 50)
-            print("Server command: ", end="", flush=True)
+            log.info("UDP Server listening on %s:%s", self.host, self.port)
+            log.info("UDP Server is connectionless - accepts messages from any client")
+            if self.record_path:
+                self.recorder = Recorder(self.record_path, PROTOCOL_UDP)
+                log.info("Recording inbound traffic to %s", self.record_path)
+            if self.reliable:
+                log.info("Reliable delivery enabled for clients started with --reliable (simulated loss %.0f%%)",
+                         self.loss * 100)
+            if self.metrics_port:
+                self.metrics.serve('127.0.0.1', self.metrics_port)
+                log.info("Metrics available at http://127.0.0.1:%s/metrics", self.metrics_port)
+            if self.control_socket:
+                self.control = ControlServer(self.control_socket, self)
+                self.control.start()
+                log.info("Control socket listening on %s", self.control_socket)
+            if not self.headless:
+                log.info("Server commands:\n"
+                         "  send <client_id> <message>  - Send message to specific client\n"
+                         "  broadcast <message>         - Send message to all clients\n"
+                         "  publish <channel> <message>  - Send message to channel subscribers\n"
+                         "  list                        - Show connected clients\n"
+                         "  channels                    - Show channels and subscriber counts\n"
+                         "  metrics                     - Show server metrics\n"
+                         "  quit                        - Exit server\n" + "-" * 50)
              
             # Start thread for accepting clients
-            receive_thread = threading.Thread(target=self.receive_messages)
+            if self.batch_size > 1:
+                log.info("Batch mode: up to %s datagrams per wakeup, messages are not echoed to console",
+                         self.batch_size)
+                receive_thread = threading.Thread(target=self.receive_batches)
+            else:
+                receive_thread = threading.Thread(target=self.receive_messages)
             receive_thread.daemon = True
             receive_thread.start()
             
-            self.send_messages()
+            if self.headless:
+                wait_for_shutdown(lambda: self.running)
+            else:
+                self.send_messages()
+                hide_prompt()
                     
         except Exception as e:
-            print(f"UDP Server error: {e}")
+            log.error("UDP Server error: %s", e)
         finally:
             self.running = False
+            if self.control:
+                self.control.stop()
             if self.socket:
                 self.socket.close()
-            print("UDP Server stopped")
+            if self.recorder is not None:
+                self.recorder.close()
+                log.info("Recorded %s events to %s", self.recorder.records, self.record_path)
+            log.info("UDP Server stopped")
     
+    def wait_for_datagrams(self):
+        # Ожидание ограничено периодом очистки, чтобы неактивные клиенты
+        # истекали и без входящего трафика
+        timeout = max(0, self.next_cleanup - time.time())
+        if self.endpoint is not None:
+            timeout = min(timeout, self.endpoint.next_timeout() or timeout)
+        readable = select.select([self.socket], [], [], timeout)[0]
+        self.cleanup_clients()
+        if self.endpoint is not None:
+            self.service_reliable()
+        return bool(readable)
+
+    def service_reliable(self):
+        # повторы, отложенные ACK и клиенты, переставшие подтверждать пакеты
+        for client_address in self.endpoint.tick():
+            client_info = self.clients.pop_address(client_address)
+            if client_info is None:
+                continue
+            self.forget_address(client_address, client_info.id)
+            self.channels.remove_client(client_info.id)
+            self.metrics.inc('clients_dropped', label='unreachable')
+            log.info("Client #%s unreachable (no acknowledgements)", client_info.id)
+
+    def forget_address(self, client_address, client_id):
+        if self.recorder is not None:
+            self.recorder.disconnect(client_id)
+        self.addresses.discard(client_address)
+        self.expiry.discard(client_address)
+        if self.endpoint is not None:
+            # канал закроется после подтверждения уже отправленного
+            self.endpoint.close(client_address)
+
+    def unwrap(self, data, client_address, now):
+        # Датаграмма дает ноль или несколько готовых сообщений: пакет надежного уровня
+        # может освободить очередь переупорядочивания, фрагмент - завершить сборку
+        if self.endpoint is not None and is_reliable_packet(data):
+            payloads = self.endpoint.receive(data, client_address, now)
+        else:
+            payloads = [data]
+        messages = []
+        for payload in payloads:
+            if is_fragment(payload):
+                payload = self.reassembler.add(payload, client_address, now)
+                if payload is None:
+                    continue
+            messages.append(payload)
+        self.metrics.inc('messages_in', len(messages))
+        return messages
+
+    def reply(self, data, client_address, batch=None, fragments=None):
+        # batch - ReplyBatch для общей отправки через sendmmsg;
+        # fragments - кэш нарезки одного сообщения для нескольких получателей
+        limit = self.fragmenter.max_datagram(client_address)
+        if fragments is None:
+            datagrams = self.fragmenter.split(data, client_address)
+        else:
+            datagrams = fragments.get(limit)
+            if datagrams is None:
+                datagrams = fragments[limit] = self.fragmenter.split(data, client_address)
+        self.metrics.inc('messages_out')
+        self.metrics.inc('datagrams_out', len(datagrams))
+        self.metrics.inc('bytes_out', len(data))
+
+        if self.endpoint is not None and self.endpoint.has_channel(client_address):
+            for datagram in datagrams:
+                self.endpoint.send(client_address, datagram)
+        elif batch is not None:
+            batch.add(data, client_address, datagrams)
+        else:
+            try:
+                sendmmsg(self.socket, [(datagram, client_address) for datagram in datagrams], self.addresses)
+            except OSError as e:
+                if e.errno != EMSGSIZE:
+                    raise
+                self.resplit(data, client_address)
+
+    def resplit(self, data, client_address):
+        # MTU маршрута уменьшился - режем заново по новому MTU от ядра
+        self.fragmenter.invalidate(client_address)
+        datagrams = self.fragmenter.split(data, client_address)
+        self.metrics.inc('datagrams_out', len(datagrams))
+        sendmmsg(self.socket, [(datagram, client_address) for datagram in datagrams], self.addresses)
+
+    def send_batch(self, batch):
+        def message_too_large(index, error):
+            if error.errno != EMSGSIZE:
+                raise error
+            # уже отправленные фрагменты старой нарезки получатель выбросит по таймауту
+            data, client_address, end = batch.message_at(index)
+            self.resplit(data, client_address)
+            return end
+        sendmmsg(self.socket, batch.datagrams, self.addresses, message_too_large)
+
+    def respond(self, response, client_address, batch=None):
+        client_info = self.clients.get_by_address(client_address)
+        data = response.encode()
+        if client_info is not None and client_info.compressed:
+            data = self.compress(data)
+        self.reply(data, client_address, batch)
+
+    def compress(self, data):
+        # сжатие - до нарезки на фрагменты: большое сообщение уходит меньшим числом датаграмм
+        compressed = compress_datagram(data, self.compress_threshold)
+        if len(compressed) < len(data):
+            self.metrics.inc('compression_saved_bytes', len(data) - len(compressed))
+        return compressed
+
     def receive_messages(self):
         while self.running:
             try:
-                data, client_address = self.socket.recvfrom(1024)
-                
-                is_new_client = False
-                if client_address not in self.clients:
-                    self.client_count += 1
-                    self.clients[client_address] = {
-                        "id": self.client_count,
-                        "last_seen": time.time()
-                    }
-                    is_new_client = True
-                    print(f"\n[New UDP client #{self.client_count} from {client_address}]")
-                    print("Server command: ", end="", flush=True)
-                else:
-                    self.clients[client_address]["last_seen"] = time.time()
-                
-                message = data.decode().strip()
-                print(f"\n[Client {self.clients[client_address]['id']}] {message}")
-                
-                response = self.process_message(message, client_address, is_new_client)
-                if response:
-                    self.socket.sendto(response.encode(), client_address)
-                        
-                self.cleanup_clients()
-                print("Server command: ", end="", flush=True)
+                if not self.wait_for_datagrams():
+                    continue
+                data, client_address = self.socket.recvfrom(self.buffer_size)
+                now = time.time()
+                self.metrics.inc('datagrams_in')
+                self.metrics.inc('bytes_in', len(data))
+
+                for data in self.unwrap(data, client_address, now):
+                    started = time.perf_counter()
+                    if self.admission is not None:
+                        reason = self.admit(client_address, len(data))
+                        if reason is not None:
+                            self.respond(busy_message(reason), client_address)
+                            continue
+                    is_new_client = self.touch_client(client_address, now)
+                    
+                    client_id = self.clients.get_by_address(client_address).id
+                    if self.recorder is not None:
+                        self.record(client_id, data, is_new_client)
+                    try:
+                        message = data.decode().strip()
+                    except UnicodeDecodeError as e:
+                        self.metrics.inc('decode_errors')
+                        traffic_log.warning("[Client %s] UTF-8 decode error: %s", client_id, e)
+                        continue
+                    traffic_log.info("[Client %s] %s", client_id, preview(message))
+                    
+                    response = self.process_message(message, client_address, is_new_client)
+                    if response:
+                        self.respond(response, client_address)
+                    self.metrics.observe('message_handling', time.perf_counter() - started)
                     
             except Exception as e:
                 if self.running:
-                    print(f"\nError processing UDP message: {e}")
+                    log.error("Error processing UDP message: %s", e)
     
+    def receive_batches(self):
+        # Высокопроизводительный режим: за одно пробуждение забираем все пришедшие
+        # датаграммы в заранее выделенные буферы, ответы отправляем одним sendmmsg
+        batch = RecvBatch(self.batch_size, self.buffer_size)
+        while self.running:
+            try:
+                if not self.wait_for_datagrams():
+                    continue
+                datagrams = batch.receive(self.socket)
+                if not datagrams:
+                    continue
+
+                now = time.time()
+                replies = ReplyBatch()
+                self.metrics.inc('datagrams_in', len(datagrams))
+                self.metrics.inc('bytes_in', sum(len(datagram) for datagram, client_address in datagrams))
+                for datagram, client_address in datagrams:
+                    for data in self.unwrap(datagram, client_address, now):
+                        started = time.perf_counter()
+                        if self.admission is not None:
+                            reason = self.admit(client_address, len(data))
+                            if reason is not None:
+                                self.respond(busy_message(reason), client_address, replies)
+                                continue
+                        is_new_client = self.touch_client(client_address, now)
+                        if self.recorder is not None:
+                            self.record(self.clients.get_by_address(client_address).id, data, is_new_client)
+                        try:
+                            message = data.decode().strip()
+                        except UnicodeDecodeError:
+                            self.metrics.inc('decode_errors')
+                            continue
+                        response = self.process_message(message, client_address, is_new_client)
+                        if response:
+                            self.respond(response, client_address, replies)
+                        # ответы пачки уходят позже одним sendmmsg - здесь время без отправки
+                        self.metrics.observe('message_handling', time.perf_counter() - started)
+
+                self.send_batch(replies)
+
+            except Exception as e:
+                if self.running:
+                    log.error("Error processing UDP batch: %s", e)
+
+    def admit(self, client_address, size):
+        # None - обработать сообщение, иначе причина отказа. Обратного давления у UDP
+        # нет, поэтому и лимит клиента отклоняет сообщение, а не откладывает его
+        client_info = self.clients.get_by_address(client_address)
+        if client_info is None:
+            if self.admission.over_capacity(len(self.clients)):
+                self.metrics.inc('connections_rejected', label='max_connections')
+                return 'max_connections'
+        elif client_info.limiter is not None:
+            bucket = client_info.limiter.try_take(size)
+            if bucket is not None:
+                self.metrics.inc('throttled', label=f"client_{bucket}")
+                return f"client_{bucket}"
+        reason = self.admission.admit(size)
+        if reason is not None:
+            self.metrics.inc('throttled', label=reason)
+        return reason
+
+    def record(self, client_id, data, is_new_client):
+        # пишется собранное сообщение, а не датаграммы: воспроизведение нарежет его заново
+        if is_new_client:
+            self.recorder.connect(client_id)
+        self.recorder.message(client_id, data)
+
+    def touch_client(self, client_address, now):
+        # Возвращает True, если клиент новый
+        client_info = self.clients.get_by_address(client_address)
+        self.expiry.touch(client_address, now)
+        if client_info is not None:
+            client_info.last_seen = now
+            return False
+
+        self.client_count += 1
+        client_info = self.clients.add(self.client_count, client_address, last_seen=now)
+        if self.admission is not None:
+            client_info.limiter = self.admission.client_limiter()
+        self.metrics.inc('clients_accepted')
+        log.info("[New UDP client #%s from %s]", self.client_count, client_address)
+        return True
+
     def send_messages(self):
         while self.running:
             try:
@@ -101,11 +412,24 @@ class UDPServer:
                     message = command[10:]
                     self.broadcast_to_all(message)
                     print("Server command: ", end="", flush=True)
+                elif command.startswith('publish '):
+                    parts = command.split(' ', 2)
+                    if len(parts) >= 3:
+                        self.publish_to_channel(parts[1], parts[2])
+                    else:
+                        print("Usage: publish <channel> <message>")
+                    print("Server command: ", end="", flush=True)
                 elif command == 'list':
                     self.list_clients()
                     print("Server command: ", end="", flush=True)
+                elif command == 'channels':
+                    self.list_channels()
+                    print("Server command: ", end="", flush=True)
+                elif command == 'metrics':
+                    print(self.metrics.render_text())
+                    print("Server command: ", end="", flush=True)
                 else:
-                    print("Unknown command. Available: send, broadcast, list, quit")
+                    print("Unknown command. Available: send, broadcast, publish, list, channels, metrics, quit")
                     print("Server command: ", end="", flush=True)
                     
             except Exception as e:
@@ -113,85 +437,195 @@ class UDPServer:
                 print("Server command: ", end="", flush=True)
     
     def get_client_by_id(self, client_id):
-        for address, info in self.clients.items():
-            if info["id"] == client_id:
-                return address
-        return None
+        client_info = self.clients.get(client_id)
+        return client_info.address if client_info else None
     
+    # Команды администратора: control_* возвращают результат в виде словаря
+    # (его же получает управляющий сокет), методы ниже выводят его в консоль
     def send_to_client(self, client_id, message):
-        if not self.clients:
-            print("No clients connected")
-            return
-        
-        client_address = self.get_client_by_id(client_id)
-        if not client_address:
-            print(f"Client #{client_id} not found")
-            return
-            
-        full_message = f"Server: {message}"
-        self.socket.sendto(full_message.encode(), client_address)
-        print(f"Sent to client #{client_id}: {message}")
-        self.clients[client_address]["last_seen"] = time.time()
+        result = self.control_send(client_id, message)
+        print(f"Sent to client #{client_id}: {message}" if result['ok'] else result['error'])
     
     def broadcast_to_all(self, message):
-        if not self.clients:
+        result = self.control_broadcast(message)
+        if not result['delivered']:
             print("No clients connected")
             return
-            
-        full_message = f"Broadcast from server: {message}"
-        current_time = time.time()
-        for client_address in self.clients.keys():
-            self.socket.sendto(full_message.encode(), client_address)
-            self.clients[client_address]["last_seen"] = current_time
-        print(f"Broadcasted to {len(self.clients)} clients: {message}")
+        print(f"Broadcasted to {result['delivered']} clients: {message}")
     
     def list_clients(self):
-        if not self.clients:
+        clients = self.control_list()
+        if not clients:
             print("No clients connected")
             return
         
         print("Connected clients:")
-        for address, info in self.clients.items():
-            client_id = info["id"]
-            last_seen = time.time() - info["last_seen"]
-            print(f"  Client #{client_id}: {address} (last seen {last_seen:.1f}s ago)")
+        for client in clients:
+            reliable = f" [reliable: {client['reliable']}]" if client['reliable'] else ""
+            if client['compressed']:
+                reliable += " [compressed]"
+            print(f"  Client #{client['id']}: {client['address']} "
+                  f"(last seen {client['last_seen_ago']:.1f}s ago){reliable}")
+
+    def publish_to_channel(self, channel, message):
+        result = self.control_publish(channel, message)
+        print(f"Published to {channel}: {result['delivered']} subscribers")
+
+    def list_channels(self):
+        channels = self.control_channels()
+        if not channels:
+            print("No channels")
+            return
+
+        print("Channels:")
+        for channel, subscribers in sorted(channels.items()):
+            print(f"  {channel}: {subscribers} subscribers")
+
+    def control_send(self, client_id, message):
+        client_info = self.clients.get(client_id)
+        if client_info is None:
+            return {'ok': False, 'error': f"Client #{client_id} not found"}
+            
+        data = f"Server: {message}".encode()
+        if client_info.compressed:
+            data = self.compress(data)
+        try:
+            self.reply(data, client_info.address)
+        except (OSError, ValueError) as e:
+            return {'ok': False, 'error': f"Error sending to client #{client_id}: {e}"}
+        return {'ok': True, 'client': client_id}
+    
+    def control_broadcast(self, message):
+        recipients = self.clients.records()
+        # отправка сервером не продлевает жизнь клиента: иначе регулярные рассылки
+        # держали бы в реестре клиентов, которых давно нет
+        self.reply_all(f"Broadcast from server: {message}".encode(), recipients)
+        return {'ok': True, 'delivered': len(recipients)}
+
+    def control_publish(self, channel, message):
+        delivered = self.publish(channel, channel_message(channel, "Server", message))
+        return {'ok': True, 'channel': channel, 'delivered': delivered}
+
+    def control_channels(self):
+        return self.channels.counts()
+
+    def publish(self, channel, text):
+        # Датаграммы уходят только подписчикам канала
+        self.metrics.inc('channel_messages')
+        recipients = [client_info for client_info in map(self.clients.get, self.channels.members(channel))
+                      if client_info is not None]
+        self.reply_all(text.encode(), recipients)
+        return len(recipients)
+
+    def reply_all(self, data, recipients):
+        # Сообщение кодируется (и сжимается) один раз, все датаграммы уходят пачками через sendmmsg
+        datagrams = ReplyBatch()
+        fragments = {}
+        compressed = None
+        compressed_fragments = {}
+        for client_info in recipients:
+            if client_info.compressed:
+                if compressed is None:
+                    compressed = self.compress(data)
+                self.reply(compressed, client_info.address, datagrams, compressed_fragments)
+            else:
+                self.reply(data, client_info.address, datagrams, fragments)
+        self.send_batch(datagrams)
+
+    def control_list(self):
+        current_time = time.time()
+        return [{'id': client_id, 'address': client_info.address,
+                 'last_seen_ago': round(current_time - client_info.last_seen, 3),
+                 'compressed': client_info.compressed,
+                 'reliable': self.endpoint.channel_info(client_info.address) if self.endpoint else None}
+                for client_id, client_info in sorted(self.clients.items())]
 
     def process_message(self, message, client_address, is_new_client):
-        client_id = self.clients[client_address]["id"]
+        client_id = self.clients.get_by_address(client_address).id
         
         if is_new_client:
             return f"Welcome to UDP Server! You are client #{client_id}"
         
+        command = message.lower()
+        name = command.split(' ', 1)[0]
+        if name in ('quit', '/stats', '/ping', HEARTBEAT_COMMAND, '/help', COMPRESS_COMMAND) or name in CHANNEL_COMMANDS:
+            self.metrics.inc('commands', label=name)
+        else:
+            self.metrics.inc('commands', label='unknown' if command.startswith('/') else 'echo')
+
         if message.lower() == 'quit':
-            print(f"Client #{client_id} disconnected")
-            del self.clients[client_address]
+            log.info("Client #%s disconnected", client_id)
+            self.clients.pop(client_id)
+            self.forget_address(client_address, client_id)
+            self.channels.remove_client(client_id)
             return "Goodbye from UDP Server!"
         elif message.lower() == '/stats':
             active_clients = len(self.clients)
-            return f"UDP Server stats: Total clients: {self.client_count}, Active: {active_clients}"
+            counters = self.metrics.counter_values()
+            handling = self.metrics.histogram('message_handling')
+            stats = (f"UDP Server stats: Total clients: {self.client_count}, Active: {active_clients}, "
+                     f"Timed out: {self.expired_count}, "
+                     f"messages in/out: {counters.get(('messages_in', None), 0)}/{counters.get(('messages_out', None), 0)}, "
+                     f"bytes in/out: {counters.get(('bytes_in', None), 0)}/{counters.get(('bytes_out', None), 0)}, "
+                     f"handling p99: {handling.percentile(99) * 1000:.3f}ms")
+            stats += f"; fragments: {self.reassembler.stats()}"
+            if self.endpoint is not None:
+                stats += f"; reliable: {self.endpoint.stats()}"
+            return stats
         elif message.lower() == '/ping':
             return "pong"
+        elif command == HEARTBEAT_COMMAND:
+            # ответ показывает клиенту, что сервер жив; сам запрос уже продлил жизнь клиента
+            return HEARTBEAT_REPLY
         elif message.lower() == '/help':
-            return "Available commands: /ping, /stats, quit, /help"
+            return ("Available commands: /ping, /heartbeat, /stats, /compress, /subscribe <channel>, /unsubscribe <channel>, "
+                    "/publish <channel> <message>, /channels, quit, /help")
+        elif command == COMPRESS_COMMAND:
+            # датаграммы сжимаются каждая отдельно - контекста между сообщениями нет
+            self.clients.get(client_id).compressed = True
+            return compress_ack(self.compress_threshold)
+        elif name in CHANNEL_COMMANDS:
+            return channel_command(self.channels, client_id, message, self.publish)
         else:
             return f"UDP Echo (client #{client_id}): {message}"
     
     def cleanup_clients(self):
+        # Вызывается не чаще раза в CLEANUP_INTERVAL, стоимость - O(log n) на истекшего клиента
         current_time = time.time()
-        expired_clients = [
-            addr for addr, info in self.clients.items() 
-            if current_time - info["last_seen"] > 300
-        ]
+        if current_time < self.next_cleanup:
+            return
+        self.next_cleanup = current_time + min(CLEANUP_INTERVAL, self.client_timeout or CLEANUP_INTERVAL)
+        self.reassembler.expire(current_time)
+        if not self.client_timeout:
+            return
+        expired_clients = self.expiry.expire(current_time)
         for addr in expired_clients:
-            client_id = self.clients[addr]["id"]
-            print(f"Client #{client_id} timed out")
-            del self.clients[addr]
+            client_info = self.clients.pop_address(addr)
+            if client_info is None:
+                continue
+            self.expired_count += 1
+            self.metrics.inc('clients_dropped', label='timeout')
+            log.info("Client #%s timed out", client_info.id)
+            self.forget_address(addr, client_info.id)
+            self.channels.remove_client(client_info.id)
 
 class UDPClient:
-    def __init__(self, host='localhost', port=8889):
+    def __init__(self, host='localhost', port=8889, reliable=False, loss=0.0, compress=False,
+                 heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL):
         self.host = host
         self.port = port
         self.server_address = (host, port)
+        self.reliable = reliable
+        self.loss = loss
+        self.compress = compress
+        self.endpoint = None
+        self.fragmenter = Fragmenter(RELIABLE_HEADER.size if reliable else 0)
+        self.reassembler = Reassembler()
+        self.heartbeat_interval = heartbeat_interval
+        self.send_lock = threading.Lock()  # поток ввода и поток heartbeat
+        self.last_sent = 0.0
+        self.last_received = 0.0
+        self.server_silent = False
         self.running = True
         self.socket = None
         self.client_id = None
@@ -199,17 +633,34 @@ class UDPClient:
     def start(self):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.socket.settimeout(1.0)
+            prepare_socket(self.socket)
+            if self.reliable:
+                # короткий таймаут - чтобы вовремя повторять неподтвержденные пакеты
+                self.socket.settimeout(TICK_INTERVAL)
+                self.endpoint = ReliableEndpoint(self.socket, self.loss)
+            else:
+                self.socket.settimeout(1.0)
             print(f"UDP Client ready to send to {self.host}:{self.port}")
-            print("Note: UDP is connectionless - messages may be lost!")
-            print("Type 'quit' to exit")
+            if self.reliable:
+                print(f"Reliable ordered delivery enabled (simulated loss {self.loss:.0%})")
+            else:
+                print("Note: UDP is connectionless - messages may be lost!")
+            print("Type 'quit' to exit, '/sendfile <path>' to send a file as one message")
             print("Connecting to server...")
 
-            self.socket.sendto(b"/ping", self.server_address)
+            self.last_received = time.monotonic()
+            self.send(b"/ping")
+            if self.compress:
+                self.send(COMPRESS_COMMAND.encode())
             
             listen_thread = threading.Thread(target=self.listen_messages)
             listen_thread.daemon = True
             listen_thread.start()
+
+            if self.heartbeat_interval:
+                heartbeat_thread = threading.Thread(target=self.send_heartbeats)
+                heartbeat_thread.daemon = True
+                heartbeat_thread.start()
             
             self.send_messages()
                 
@@ -224,21 +675,29 @@ class UDPClient:
     def listen_messages(self):
         while self.running:
             try:
-                data, server_addr = self.socket.recvfrom(1024)
-                message = data.decode()
-                
-                if "You are client #" in message and self.client_id is None:
-                    try:
-                        self.client_id = int(message.split("#")[1].split()[0])
-                        print(f"\n>>> {message}")
-                        print(f"Successfully registered as client #{self.client_id}")
-                        print("Client is now listening for server messages...")
-                    except:
-                        print(f"\n>>> {message}")
+                if self.endpoint is not None and self.endpoint.tick():
+                    print("\nServer does not acknowledge messages")
+                    print("Enter message: ", end="", flush=True)
+
+                self.reassembler.expire()
+                data, server_addr = self.socket.recvfrom(MAX_DATAGRAM_SIZE)
+                if self.endpoint is not None and is_reliable_packet(data):
+                    # клиент общается только с сервером - канал один
+                    payloads = self.endpoint.receive(data, self.server_address)
                 else:
-                    print(f"\n>>> {message}")
-                
-                print("Enter message: ", end="", flush=True)
+                    payloads = [data]
+
+                for data in payloads:
+                    if is_fragment(data):
+                        data = self.reassembler.add(data, self.server_address)
+                        if data is None:
+                            continue
+                    if is_compressed_datagram(data):
+                        data = decompress_datagram(data, DEFAULT_REASSEMBLY_BUDGET)
+                    self.server_alive()
+                    if data == HEARTBEAT_REPLY.encode():
+                        continue
+                    self.show_message(data.decode())
                     
             except socket.timeout:
                 continue
@@ -246,17 +705,80 @@ class UDPClient:
                 if self.running:
                     print(f"\nError receiving message: {e}")
     
+    def send_heartbeats(self):
+        # /heartbeat после heartbeat_interval без отправки: сервер не забудет клиента,
+        # а ответ показывает, что сервер жив
+        while self.running:
+            time.sleep(min(IDLE_CHECK_INTERVAL, self.heartbeat_interval))
+            now = time.monotonic()
+            if not self.server_silent and now - self.last_received > DEAD_PEER_INTERVALS * self.heartbeat_interval:
+                self.server_silent = True
+                print("\nServer is not responding")
+                print("Enter message: ", end="", flush=True)
+            if now - self.last_sent >= self.heartbeat_interval:
+                try:
+                    self.send(HEARTBEAT_COMMAND.encode())
+                except OSError:
+                    pass
+
+    def server_alive(self):
+        self.last_received = time.monotonic()
+        if self.server_silent:
+            self.server_silent = False
+            print("\nServer is responding again")
+
+    def show_message(self, message):
+        if "You are client #" in message and self.client_id is None:
+            try:
+                self.client_id = int(message.split("#")[1].split()[0])
+                print(f"\n>>> {message}")
+                print(f"Successfully registered as client #{self.client_id}")
+                print("Client is now listening for server messages...")
+            except:
+                print(f"\n>>> {message}")
+        elif message.startswith("Welcome to UDP Server!"):
+            # сервер забыл клиента (перезапуск или таймаут) и зарегистрировал заново
+            print(f"\n>>> {message}")
+            self.client_id = int(message.rpartition("#")[2])
+            if self.compress:
+                self.send(COMPRESS_COMMAND.encode())
+        else:
+            print(f"\n>>> {preview(message)}")
+        
+        print("Enter message: ", end="", flush=True)
+
+    def send(self, data):
+        with self.send_lock:
+            for datagram in self.fragmenter.split(data, self.server_address):
+                if self.endpoint is not None:
+                    self.endpoint.send(self.server_address, datagram)
+                else:
+                    self.socket.sendto(datagram, self.server_address)
+            self.last_sent = time.monotonic()
+
+    def send_file(self, path):
+        with open(path, 'rb') as f:
+            payload = f.read()
+        self.send(payload)
+        print(f"Sent {len(payload)} bytes from {path}")
+
     def send_messages(self):
         while self.running:
             try:
                 message = input().strip()
                 
                 if message.lower() == 'quit':
+                    self.send(message.encode())
+                    if self.endpoint is not None:
+                        # ждем подтверждения, иначе quit может потеряться
+                        self.endpoint.flush(timeout=2.0)
                     self.running = False
-                    self.socket.sendto(message.encode(), self.server_address)
                     break
+                elif message.startswith('/sendfile '):
+                    self.send_file(message[len('/sendfile '):].strip())
+                    print("Enter message: ", end="", flush=True)
                 elif message.strip():
-                    self.socket.sendto(message.encode(), self.server_address)
+                    self.send(message.encode())
                     print("Enter message: ", end="", flush=True)
                 
             except Exception as e: